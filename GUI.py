@@ -1,20 +1,18 @@
 import gradio as gr
-from src.reddit_story_engine import RedditStoryGenerator
-from src.ready_made_script_engine import ReadyMadeScriptGenerator
-import asyncio
+from src.job_client import JobClient
 import logging
 import traceback
 import os
 
-reddit_story_generator = RedditStoryGenerator()
-ready_made_script_generator = ReadyMadeScriptGenerator()
+# Videos are generated by the job server (python -m src.job_server), this UI only submits and follows jobs
+job_client = JobClient()
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 def generate_video_reddit(video_source, video_file, video_url, video_topic, add_images):
     try:
-        video_path = video_file.name if video_file else None
+        video_path = job_client.upload(video_file.name) if video_file else None
         params = {
             "video_path_or_url": video_source,
             "video_path": video_path,
@@ -22,15 +20,18 @@ def generate_video_reddit(video_source, video_file, video_url, video_topic, add_
             "video_topic": video_topic,
             "add_images": add_images
         }
-        result = asyncio.run(reddit_story_generator.generate_video(**params))
-        return result  # Return the result dictionary and None for the button update
+        job_id = job_client.submit("reddit", params)
     except Exception as e:
         logger.error(traceback.format_exc())
-        return {"status": "error", "message": str(e)}
+        yield {"status": "error", "message": str(e)}, None
+        return
+    # Progress log while the job runs, then the result dictionary; the job id is kept for the cancel button
+    for update in job_client.follow(job_id):
+        yield update, job_id
 
 def generate_video_ready_made(video_source, video_hook, video_file, video_url, video_script, add_images):
     try:
-        video_path = video_file.name if video_file else None
+        video_path = job_client.upload(video_file.name) if video_file else None
         params = {
             "video_path_or_url": video_source,
             "video_path": video_path,
@@ -39,11 +40,18 @@ def generate_video_ready_made(video_source, video_hook, video_file, video_url, v
             "video_script": video_script,
             "add_images": add_images
         }
-        result = asyncio.run(ready_made_script_generator.generate_video(**params))
-        return result  # Return only the result dictionary
+        job_id = job_client.submit("ready_made", params)
     except Exception as e:
         logger.error(traceback.format_exc())
-        return {"status": "error", "message": str(e)}
+        yield {"status": "error", "message": str(e)}, None
+        return
+    for update in job_client.follow(job_id):
+        yield update, job_id
+
+def cancel_job(job_id):
+    # Cancel on the server right away instead of relying on Gradio closing the handler's generator
+    if job_id:
+        job_client.cancel(job_id)
 
 with gr.Blocks() as iface:
     gr.Markdown("# TurboReel Video Generator")
@@ -67,6 +75,8 @@ with gr.Blocks() as iface:
             reddit_output = gr.Textbox(label="Result")
             reddit_download_btn = gr.File(label="Download Generated Video", visible=False)
             reddit_submit_btn = gr.Button("Generate Reddit Story Video")
+            reddit_cancel_btn = gr.Button("Cancel")
+            reddit_job = gr.State(None)
 
         with gr.TabItem("Ready-Made Script Videos"):
             ##title
@@ -85,6 +95,8 @@ with gr.Blocks() as iface:
             ready_made_output = gr.Textbox(label="Result")
             ready_made_download_btn = gr.File(label="Download Generated Video", visible=False)
             ready_made_submit_btn = gr.Button("Generate Ready-Made Script Video")
+            ready_made_cancel_btn = gr.Button("Cancel")
+            ready_made_job = gr.State(None)
 
     def update_visibility(video_src):
         return (
@@ -117,25 +129,29 @@ with gr.Blocks() as iface:
         else:
             return f"Status: {result['status']}\nMessage: {result['message']}", gr.update(visible=False), None
 
-    reddit_submit_btn.click(
+    reddit_event = reddit_submit_btn.click(
         generate_video_reddit,
         inputs=[reddit_video_source, reddit_video_file, reddit_video_url, reddit_video_topic, reddit_add_images],
-        outputs=reddit_output
+        outputs=[reddit_output, reddit_job]
     ).then(
         process_result,
         inputs=reddit_output,
         outputs=[reddit_output, reddit_submit_btn, reddit_download_btn]
     )
 
-    ready_made_submit_btn.click(
+    ready_made_event = ready_made_submit_btn.click(
         generate_video_ready_made,
         inputs=[ready_made_video_source, ready_made_video_hook, ready_made_video_file, ready_made_video_url, ready_made_video_script, ready_made_add_images],
-        outputs=ready_made_output
+        outputs=[ready_made_output, ready_made_job]
     ).then(
         process_result,
         inputs=ready_made_output,
         outputs=[ready_made_output, ready_made_submit_btn, ready_made_download_btn]
     )
 
+    # Cancel the job on the server and stop following it
+    reddit_cancel_btn.click(fn=cancel_job, inputs=reddit_job, cancels=[reddit_event])
+    ready_made_cancel_btn.click(fn=cancel_job, inputs=ready_made_job, cancels=[ready_made_event])
+
 if __name__ == "__main__":
     iface.launch()
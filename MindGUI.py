@@ -4,9 +4,7 @@ from openai import OpenAI
 import os
 import logging
 from dotenv import load_dotenv
-from src.json_2_video_engine.json_2_video import PyJson2Video  # Import the process_video function
-import asyncio
-import uuid
+from src.job_client import JobClient
 
 logging.basicConfig(level=logging.INFO)
 
@@ -19,15 +17,23 @@ with open('src/json_2_video/tests/json2video_template_clean.json', 'r') as f:
 # Initialize the OpenAI client
 openai = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
+# Videos are rendered by the job server (python -m src.job_server)
+job_client = JobClient()
+
 def generate_from_json(json_input):
     try:
-        output_filename = f"output_{uuid.uuid4()}.mp4"
-        output_path = os.path.join(os.path.abspath("result"), output_filename)
-        pyjson2video = PyJson2Video(json_input, output_path)
-        output_path = asyncio.run(pyjson2video.convert())
-        return {"status": "success", "message": "Video generated successfully", "output_path": output_path}
+        job_id = job_client.submit("json2video", {"json_input": json_input})
     except Exception as e:
-        return {"status": "error", "message": f"Error processing video: {str(e)}"}
+        yield {"status": "error", "message": f"Error processing video: {str(e)}"}, None
+        return
+    # The job id is kept for the cancel button
+    for update in job_client.follow(job_id):
+        yield update, job_id
+
+def cancel_job(job_id):
+    # Cancel on the server right away instead of relying on Gradio closing the handler's generator
+    if job_id:
+        job_client.cancel(job_id)
 
 def generate_and_process_video(instructions):
     try:
@@ -58,16 +64,16 @@ def generate_and_process_video(instructions):
         if verification["status"] == "corrected":
             generated_json = verification["data"]
         elif verification["status"] == "feedback":
-            return None, verification["message"]
-
-        output_filename = f"output_{uuid.uuid4()}.mp4"
-        output_path = os.path.join(os.path.abspath("result"), output_filename)
-        pyjson2video = PyJson2Video(generated_json, output_path)
-        output_path = asyncio.run(pyjson2video.convert())
-        
-        return {"status": "success", "message": "Video generated successfully", "output_path": output_path}, json.dumps(generated_json, indent=2)
+            yield None, verification["message"], None
+            return
+        job_id = job_client.submit("json2video", {"json_input": generated_json})
     except Exception as e:
-        return {"status": "error", "message": f"Error processing video: {str(e)}"}, None
+        yield {"status": "error", "message": f"Error processing video: {str(e)}"}, None, None
+        return
+
+    generated_json_text = json.dumps(generated_json, indent=2)
+    for update in job_client.follow(job_id):
+        yield update, generated_json_text, job_id
 
 def json_verification(json_data):
     try:
@@ -129,6 +135,8 @@ with gr.Blocks() as iface:
     with gr.Tab("Text Instructions"):
         input_text = gr.Textbox(lines=5, label="Enter your video instructions")
         generate_button_text = gr.Button("Generate Video from Text", variant="primary")
+        cancel_button_text = gr.Button("Cancel")
+        text_job = gr.State(None)
         text_output = gr.Textbox(label="Result")
         video_output_text = gr.File(label="Download Generated Video", visible=False)
         json_output = gr.Textbox(label="JSON template or Error Message", lines=10)
@@ -137,28 +145,34 @@ with gr.Blocks() as iface:
         json_input = gr.Textbox(lines=10, label="Enter your JSON structure directly")
         json_template = gr.File(label="JSON Template", file_count="single", file_types=[".json"])
         generate_button_json = gr.Button("Generate Video from JSON", variant="primary")
+        cancel_button_json = gr.Button("Cancel")
+        json_job = gr.State(None)
         json_output_result = gr.Textbox(label="Result")
         video_output_json = gr.File(label="Download Generated Video", visible=False)
     
-    generate_button_text.click(
+    text_event = generate_button_text.click(
         generate_and_process_video, 
         inputs=[input_text], 
-        outputs=[text_output, json_output]
+        outputs=[text_output, json_output, text_job]
     ).then(
         process_result,
         inputs=text_output,
         outputs=[text_output, generate_button_text, video_output_text]
     )
 
-    generate_button_json.click(
+    json_event = generate_button_json.click(
         generate_from_json, 
         inputs=[json_input], 
-        outputs=json_output_result
+        outputs=[json_output_result, json_job]
     ).then(
         process_result,
         inputs=json_output_result,
         outputs=[json_output_result, generate_button_json, video_output_json]
     )
 
+    # Cancel the job on the server and stop following it
+    cancel_button_text.click(fn=cancel_job, inputs=text_job, cancels=[text_event])
+    cancel_button_json.click(fn=cancel_job, inputs=json_job, cancels=[json_event])
+
 # Launch the interface
 iface.launch()
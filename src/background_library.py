@@ -0,0 +1,500 @@
+import os
+import re
+import glob
+import math
+import random
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl  # Cross-process download locks, POSIX only
+except ImportError:
+    fcntl = None
+
+from yt_dlp import YoutubeDL
+from yt_dlp.utils import download_range_func
+
+from .ffmpeg_tools import keyframe_times, make_vertical_proxy
+from . import media_probe
+from . import tracing
+
+# URL shapes whose video ID can be read without asking YouTube
+YOUTUBE_ID_PATTERN = re.compile(r'(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/|live/)|youtu\.be/)([A-Za-z0-9_-]{11})')
+
+
+class BackgroundLibrary:
+    """Local cache of background videos, keyed by canonical video ID.
+
+    Downloads are kept under root as `<extractor>_<id>.mp4` and described in a SQLite
+    index (duration, resolution, fps and keyframe times), so a job can pick a
+    background by ID or by minimum duration without probing or downloading anything.
+    """
+
+    def __init__(self, root: str, index_path: str = None, max_height: int = 720, section_margin: float = 5.0, section_pool: int = 4,
+                 lease_timeout: float = 6 * 3600):
+        self.root = root
+        self.index_path = index_path or os.path.join(root, 'library.sqlite3')
+        self.max_height = max_height
+        self.section_margin = section_margin  # Extra seconds downloaded past a section, for keyframe alignment
+        self.section_pool = section_pool  # Sections kept per URL; new random ranges are downloaded until there are this many
+        self.lease_timeout = lease_timeout  # Leases older than this (e.g. of a crashed job) no longer protect a section
+        self._lock = threading.Lock()
+        self._download_locks = {}
+        os.makedirs(self.root, exist_ok=True)
+        with self._connect() as db:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS videos (
+                    video_id TEXT PRIMARY KEY,
+                    source_url TEXT,
+                    path TEXT NOT NULL,
+                    duration REAL,
+                    width INTEGER,
+                    height INTEGER,
+                    fps REAL,
+                    keyframes TEXT,
+                    added_at REAL
+                );
+                CREATE TABLE IF NOT EXISTS urls (
+                    url TEXT PRIMARY KEY,
+                    video_id TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS proxies (
+                    source_path TEXT NOT NULL,
+                    source_size INTEGER NOT NULL,
+                    source_mtime REAL NOT NULL,
+                    width INTEGER NOT NULL,
+                    height INTEGER NOT NULL,
+                    path TEXT NOT NULL,
+                    PRIMARY KEY (source_path, width, height)
+                );
+                CREATE TABLE IF NOT EXISTS remote_videos (
+                    video_id TEXT PRIMARY KEY,
+                    duration REAL,
+                    width INTEGER,
+                    height INTEGER
+                );
+                CREATE TABLE IF NOT EXISTS keyframe_index (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    keyframes TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS section_leases (
+                    lease_id TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    acquired_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS videos_duration ON videos (duration);
+                CREATE INDEX IF NOT EXISTS section_leases_path ON section_leases (path);
+            """)
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.index_path, timeout=30)
+        try:
+            with db:  # Commits, or rolls back on error
+                yield db
+        finally:
+            db.close()
+
+    @staticmethod
+    def _row_to_dict(row) -> dict:
+        keys = ('video_id', 'source_url', 'path', 'duration', 'width', 'height', 'fps', 'keyframes', 'added_at')
+        entry = dict(zip(keys, row))
+        entry['keyframes'] = json.loads(entry['keyframes']) if entry['keyframes'] else None
+        return entry
+
+    def canonical_id(self, url: str) -> str:
+        """The cache key of a URL, e.g. 'youtube:dQw4w9WgXcQ'. Only unknown non-YouTube URLs hit the network."""
+        match = YOUTUBE_ID_PATTERN.search(url)
+        if match:
+            return f"youtube:{match.group(1)}"
+        with self._connect() as db:
+            row = db.execute("SELECT video_id FROM urls WHERE url = ?", (url,)).fetchone()
+        if row:
+            return row[0]
+        with YoutubeDL({'quiet': True}) as ydl:
+            info = ydl.extract_info(url, download=False)
+        return f"{info['extractor_key'].lower()}:{info['id']}"
+
+    def get(self, video_id: str) -> dict:
+        """The index entry of a video, or None if it is not in the library (or its file is gone)."""
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM videos WHERE video_id = ?", (video_id,)).fetchone()
+        if not row:
+            return None
+        entry = self._row_to_dict(row)
+        if not os.path.exists(entry['path']):
+            logging.warning(f"Library file missing for {video_id}, dropping it from the index.")
+            self.remove(video_id)
+            return None
+        return entry
+
+    def lookup_path(self, path: str) -> dict:
+        """The index entry of a library file by its path, or None."""
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM videos WHERE path = ?", (os.path.abspath(path),)).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def pick(self, min_duration: float = 0.0) -> dict:
+        """A random library video lasting at least min_duration seconds, or None."""
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT * FROM videos WHERE duration >= ? ORDER BY RANDOM()", (min_duration,)
+            ).fetchall()
+        for row in rows:
+            entry = self._row_to_dict(row)
+            if os.path.exists(entry['path']):
+                return entry
+        return None
+
+    def list(self) -> list:
+        with self._connect() as db:
+            rows = db.execute("SELECT * FROM videos ORDER BY added_at").fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def remove(self, video_id: str):
+        with self._connect() as db:
+            db.execute("DELETE FROM videos WHERE video_id = ?", (video_id,))
+            db.execute("DELETE FROM urls WHERE video_id = ?", (video_id,))
+
+    def add_file(self, path: str, video_id: str = None, source_url: str = None) -> dict:
+        """Index a local video file, probing its headers and keyframes once."""
+        path = os.path.abspath(path)
+        video_id = video_id or f"file:{os.path.basename(path)}"
+        info = media_probe.probe(path, 'video')
+        try:
+            keyframes = keyframe_times(path)
+        except Exception as e:
+            logging.warning(f"Could not read keyframes of {path}: {e}")
+            keyframes = None
+
+        with self._lock, self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO videos VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (video_id, source_url, path, info['duration'], info['width'], info['height'], info['fps'],
+                 json.dumps(keyframes) if keyframes is not None else None, time.time())
+            )
+            if source_url:
+                db.execute("INSERT OR REPLACE INTO urls VALUES (?, ?)", (source_url, video_id.split('#', 1)[0]))
+        logging.info(f"Indexed background {video_id}: {info['duration']:.1f}s {info['width']}x{info['height']} @ {info['fps']:.2f}fps")
+        return self.get(video_id)
+
+    def proxy(self, source_path: str, width: int, height: int) -> str:
+        """Path of a width x height cropped, short-GOP proxy of source_path, built on first use.
+
+        Proxies are keyed by the source's path, size and mtime, so a replaced source is re-ingested.
+        Each build writes its own temporary file, so concurrent jobs (threads or processes)
+        building the same proxy never interleave writes; the last one to finish wins.
+        """
+        source_path = os.path.abspath(source_path)
+        stat = os.stat(source_path)
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT path, source_size, source_mtime FROM proxies WHERE source_path = ? AND width = ? AND height = ?",
+                (source_path, width, height)
+            ).fetchone()
+        if row and row[1] == stat.st_size and row[2] == stat.st_mtime and os.path.exists(row[0]):
+            tracing.record(cache_hits=1)
+            return row[0]
+        tracing.record(cache_misses=1)
+
+        proxy_dir = os.path.join(self.root, 'proxies')
+        os.makedirs(proxy_dir, exist_ok=True)
+        name = os.path.splitext(os.path.basename(source_path))[0]
+        # Same-named sources in different directories, or a replaced source, get distinct files
+        source_key = hashlib.sha1(f"{source_path}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()[:12]
+        proxy_path = os.path.join(proxy_dir, f"{name}_{source_key}_{width}x{height}.mp4")
+        partial_path = f"{proxy_path}.{os.getpid()}-{uuid.uuid4().hex[:8]}.part.mp4"
+        logging.info(f"Building {width}x{height} proxy of {source_path}")
+        start = time.monotonic()
+        try:
+            make_vertical_proxy(source_path, partial_path, width, height)
+            os.replace(partial_path, proxy_path)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        tracing.record(bytes=os.path.getsize(proxy_path))
+        logging.info(f"Proxy built in {time.monotonic() - start:.1f}s: {proxy_path}")
+
+        with self._lock, self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO proxies VALUES (?, ?, ?, ?, ?, ?)",
+                (source_path, stat.st_size, stat.st_mtime, width, height, proxy_path)
+            )
+        return proxy_path
+
+    def duration_of(self, path: str) -> float:
+        """Duration of a video, from the index when it is a library file."""
+        entry = self.lookup_path(path)
+        if entry and entry['duration']:
+            return entry['duration']
+        return media_probe.duration(path)
+
+    def keyframes(self, path: str) -> list:
+        """Keyframe times of any video file (library download, proxy or local file), probed once and cached.
+
+        Returns None if they cannot be read.
+        """
+        path = os.path.abspath(path)
+        entry = self.lookup_path(path)
+        if entry and entry['keyframes'] is not None:
+            return entry['keyframes']
+
+        stat = os.stat(path)
+        with self._connect() as db:
+            row = db.execute("SELECT size, mtime, keyframes FROM keyframe_index WHERE path = ?", (path,)).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime:
+            return json.loads(row[2])
+
+        try:
+            keyframes = keyframe_times(path)
+        except Exception as e:
+            logging.warning(f"Could not read keyframes of {path}: {e}")
+            return None
+        with self._lock, self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO keyframe_index VALUES (?, ?, ?, ?)",
+                (path, stat.st_size, stat.st_mtime, json.dumps(keyframes))
+            )
+        return keyframes
+
+    def _section_opts(self) -> dict:
+        # The narration replaces the background audio, so video-only formats are enough
+        return {
+            'quiet': True,
+            'format': f'bestvideo[height<={self.max_height}][ext=mp4]/bestvideo[height<={self.max_height}]/best[height<={self.max_height}]',
+            'postprocessors': [{
+                'key': 'FFmpegVideoRemuxer',
+                'preferedformat': 'mp4',
+            }]
+        }
+
+    def sections(self, video_id: str, min_duration: float = 0.0) -> list:
+        """Downloaded sections of a video lasting at least min_duration seconds, oldest first."""
+        # Video IDs often contain '_', a LIKE wildcard, which would match other videos' sections
+        pattern = video_id.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '#%'
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT * FROM videos WHERE video_id LIKE ? ESCAPE '\\' AND duration >= ? ORDER BY added_at", (pattern, min_duration)
+            ).fetchall()
+        return [entry for entry in map(self._row_to_dict, rows) if os.path.exists(entry['path'])]
+
+    def lease(self, path: str) -> str:
+        """Mark a section as in use, so no trim deletes it (or its proxies) until release(lease_id).
+
+        Leases live in the index, so they hold across the processes sharing the library.
+        """
+        lease_id = uuid.uuid4().hex
+        with self._lock, self._connect() as db:
+            db.execute("INSERT INTO section_leases VALUES (?, ?, ?)", (lease_id, os.path.abspath(path), time.time()))
+        return lease_id
+
+    def release(self, lease_id: str):
+        """End a lease taken by lease() or fetch_section; None is ignored."""
+        if not lease_id:
+            return
+        with self._lock, self._connect() as db:
+            db.execute("DELETE FROM section_leases WHERE lease_id = ?", (lease_id,))
+
+    def _trim_sections(self, video_id: str):
+        """Delete the oldest sections of a video (files, proxies and index rows) beyond section_pool.
+
+        Sections leased by a running job are skipped; a later trim drops them once released.
+        """
+        sections = self.sections(video_id)
+        excess = len(sections) - self.section_pool
+        cutoff = time.time() - self.lease_timeout
+        with self._lock, self._connect() as db:
+            db.execute("DELETE FROM section_leases WHERE acquired_at <= ?", (cutoff,))
+        for entry in sections:
+            if excess <= 0:
+                break
+            with self._lock, self._connect() as db:
+                # One statement: a lease taken concurrently either stops the delete, or finds the row gone
+                deleted = db.execute(
+                    "DELETE FROM videos WHERE video_id = ? AND NOT EXISTS (SELECT 1 FROM section_leases WHERE path = ? AND acquired_at > ?)",
+                    (entry['video_id'], entry['path'], cutoff)
+                ).rowcount
+                if not deleted:
+                    logging.info(f"Background section {entry['video_id']} is in use, keeping it for now.")
+                    continue
+                proxies = [row[0] for row in db.execute("SELECT path FROM proxies WHERE source_path = ?", (entry['path'],))]
+                db.execute("DELETE FROM proxies WHERE source_path = ?", (entry['path'],))
+            excess -= 1
+            for path in [entry['path'], *proxies]:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logging.warning(f"Could not delete {path}: {e}")
+            logging.info(f"Dropped background section {entry['video_id']} from the pool.")
+
+    @contextmanager
+    def _download_lock(self, video_id: str):
+        """Serialize the downloads of one video across threads and, where flock exists, processes."""
+        with self._lock:
+            thread_lock = self._download_locks.setdefault(video_id, threading.Lock())
+        lock_dir = os.path.join(self.root, 'locks')
+        os.makedirs(lock_dir, exist_ok=True)
+        lock_path = os.path.join(lock_dir, re.sub(r'[^A-Za-z0-9_-]+', '_', video_id) + '.lock')
+        with thread_lock, open(lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)  # Released when the file is closed
+            yield
+
+    def resolve(self, url: str) -> dict:
+        """Metadata of a URL's video, without downloading it.
+
+        Returns a dict with video_id, duration, width and height (of the format a section
+        download would fetch). 'entry' is set when the full video is already in the library.
+        Once a URL's section pool is full the metadata stored with it is used, as no new
+        section will be downloaded; otherwise 'info' holds the extracted info so
+        fetch_section needs no second lookup.
+        """
+        video_id = self.canonical_id(url)
+        entry = self.get(video_id)
+        if entry:
+            tracing.record(cache_hits=1)
+            return {'url': url, 'video_id': video_id, 'duration': entry['duration'], 'width': entry['width'], 'height': entry['height'], 'entry': entry, 'info': None}
+        if len(self.sections(video_id)) >= self.section_pool:
+            with self._connect() as db:
+                row = db.execute("SELECT duration, width, height FROM remote_videos WHERE video_id = ?", (video_id,)).fetchone()
+            if row:
+                tracing.record(cache_hits=1)
+                return {'url': url, 'video_id': video_id, 'duration': row[0], 'width': row[1], 'height': row[2], 'entry': None, 'info': None}
+        tracing.record(cache_misses=1)
+        with YoutubeDL(self._section_opts()) as ydl:
+            info = ydl.extract_info(url, download=False)
+        resolved = {
+            'url': url,
+            'video_id': video_id,
+            'duration': float(info.get('duration') or 0.0),
+            'width': int(info.get('width') or 0),
+            'height': int(info.get('height') or 0),
+            'entry': None,
+            'info': info,
+        }
+        with self._lock, self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO remote_videos VALUES (?, ?, ?, ?)",
+                (video_id, resolved['duration'], resolved['width'], resolved['height'])
+            )
+        return resolved
+
+    def fetch_section(self, resolved: dict, duration: float) -> dict:
+        """Return a library entry covering at least duration seconds of a resolved URL.
+
+        Uses the full video when it is in the library. Otherwise downloads only a random
+        duration-long range of the video (plus section_margin), until section_pool sections
+        long enough exist; from then on a random one of them is reused, so backgrounds keep
+        varying without downloading on every job. The entry's 'reused' is False when it was
+        just downloaded.
+
+        A section is returned leased (entry['lease_id']), so that another job's trim cannot
+        delete it mid-render: pass the ID to release() once the video is rendered.
+        """
+        if resolved['entry']:
+            tracing.record(cache_hits=1)
+            return dict(resolved['entry'], reused=True, lease_id=None)  # Full videos are never trimmed
+        video_id = resolved['video_id']
+        cached = self.sections(video_id, duration)
+        if len(cached) >= self.section_pool:
+            random.shuffle(cached)
+            for entry in cached:
+                lease_id = self.lease(entry['path'])
+                # A trim may have dropped the section between the query and the lease
+                if self.lookup_path(entry['path']) and os.path.exists(entry['path']):
+                    logging.info(f"Background section of {video_id} picked from a pool of {len(cached)}.")
+                    tracing.record(cache_hits=1)
+                    return dict(entry, reused=True, lease_id=lease_id)
+                self.release(lease_id)
+        tracing.record(cache_misses=1)
+
+        total = resolved['duration']
+        length = duration + self.section_margin
+        start = random.uniform(0, max(total - length, 0.0)) if total else 0.0
+        end = min(start + length, total) if total else start + length
+        section_id = f"{video_id}#{int(start)}-{int(math.ceil(end))}"
+        file_stem = re.sub(r'[^A-Za-z0-9_-]+', '_', section_id)
+
+        ydl_opts = self._section_opts()
+        ydl_opts['outtmpl'] = os.path.join(self.root, f"{file_stem}.%(ext)s")
+        ydl_opts['download_ranges'] = download_range_func(None, [(start, end)])
+        logging.info(f"Downloading {end - start:.0f}s of {video_id} from {start:.0f}s")
+        with YoutubeDL(ydl_opts) as ydl:
+            info = resolved['info'] or ydl.extract_info(resolved['url'], download=False)
+            info = ydl.process_ie_result(info, download=True)
+        downloads = info.get('requested_downloads') or []
+        video_path = downloads[0].get('filepath') if downloads else None
+        if not video_path or not os.path.exists(video_path):
+            matches = glob.glob(os.path.join(glob.escape(self.root), f"{glob.escape(file_stem)}.*"))
+            if not matches:
+                raise RuntimeError(f"Section download of {video_id} produced no file.")
+            video_path = matches[0]
+        tracing.record(bytes=os.path.getsize(video_path))
+        entry = self.add_file(video_path, video_id=section_id, source_url=resolved['url'])
+        lease_id = self.lease(entry['path'])
+        self._trim_sections(video_id)
+        return dict(entry, reused=False, lease_id=lease_id)
+
+    def fetch(self, url: str) -> dict:
+        """Return the library entry for a URL, downloading and indexing it on a miss.
+
+        The entry's 'reused' is False when it was just downloaded. Jobs asking for the same
+        video at once wait for the first one's download instead of starting their own.
+        """
+        video_id = self.canonical_id(url)
+        with self._download_lock(video_id):
+            return self._fetch(url, video_id)
+
+    def _fetch(self, url: str, video_id: str) -> dict:
+        entry = self.get(video_id)
+        if entry:
+            logging.info(f"Background {video_id} found in the library.")
+            tracing.record(cache_hits=1)
+            return dict(entry, reused=True)
+        tracing.record(cache_misses=1)
+
+        ydl_opts = {
+            'format': f'bestvideo[height<={self.max_height}]+bestaudio',
+            'outtmpl': os.path.join(self.root, '%(extractor_key)s_%(id)s.%(ext)s'),
+            'postprocessors': [{
+                'key': 'FFmpegVideoConvertor',
+                'preferedformat': 'mp4',
+            }]
+        }
+        with YoutubeDL(ydl_opts) as ydl:
+            # One round trip: extract_info with download=True returns the info of what it downloaded
+            info = ydl.extract_info(url, download=True)
+            video_path = ydl.prepare_filename(info)
+        # The convertor always leaves an mp4
+        video_path = video_path.rsplit('.', 1)[0] + '.mp4'
+        tracing.record(bytes=os.path.getsize(video_path))
+        video_id = f"{info['extractor_key'].lower()}:{info['id']}"
+        return dict(self.add_file(video_path, video_id=video_id, source_url=url), reused=False)
+
+
+_default_library = None
+
+
+def default_library() -> BackgroundLibrary:
+    """The process-wide library, stored in TURBOREEL_BACKGROUND_LIBRARY (default: downloads/).
+
+    TURBOREEL_SECTION_POOL sets how many sections are kept per background URL (default 4),
+    TURBOREEL_SECTION_LEASE_TIMEOUT after how many seconds a job's lease on a section lapses.
+    """
+    global _default_library
+    if _default_library is None:
+        root = os.getenv('TURBOREEL_BACKGROUND_LIBRARY') or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'downloads')
+        _default_library = BackgroundLibrary(
+            os.path.abspath(root),
+            section_pool=int(os.getenv('TURBOREEL_SECTION_POOL', 4)),
+            lease_timeout=float(os.getenv('TURBOREEL_SECTION_LEASE_TIMEOUT', 6 * 3600)),
+        )
+    return _default_library
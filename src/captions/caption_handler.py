@@ -1,8 +1,10 @@
 import os
+import asyncio
 import logging
 
 from .subtitle_generator import SubtitleGenerator
 from .video_captioner import VideoCaptioner
+from .. import tracing
 
 # Load environment variables from .env file
 from dotenv import load_dotenv
@@ -18,14 +20,47 @@ class CaptionHandler:
         self.video_captioner = VideoCaptioner()
         self.default_font = "Dacherry.ttf"
 
-    async def process(self, audio_file: str, captions_color="white", shadow_color="cyan", font_size=60, font=None, width=540):
-        subtitles_file = await self.subtitle_generator.generate_subtitles(audio_file)
-        caption_clips = self.video_captioner.generate_captions_to_video(
-            subtitles_file,
+    async def process(self, audio_file: str, captions_color="white", shadow_color="cyan", font_size=60, font=None, width=540,
+                      style="chunks", highlight_color="yellow"):
+        """Transcribe audio_file and build its caption clips.
+
+        style is 'chunks' (one text clip per subtitle) or 'karaoke' (word-highlight lines).
+        """
+        words = await self.subtitle_generator.transcribe_words(audio_file)
+        subtitles = await self.subtitle_generator.generate_subtitles(audio_file, words=words)
+        if style == 'karaoke':
+            caption_clips = await self.render_word_highlight(words, captions_color, shadow_color, font_size, font, width, highlight_color)
+        else:
+            caption_clips = self.render(subtitles, captions_color, shadow_color, font_size, font, width)
+        return subtitles, caption_clips
+
+    async def render_word_highlight(self, words: list, captions_color="white", shadow_color="black", font_size=60, font=None, width=540,
+                                    highlight_color="yellow"):
+        """Karaoke captions for the word timings of SubtitleGenerator.transcribe_words, the same ones the subtitles were built from."""
+        return await asyncio.to_thread(self.word_highlight, words, captions_color, shadow_color, font_size, font, width, highlight_color)
+
+    def word_highlight(self, words: list, captions_color="white", shadow_color="black", font_size=60, font=None, width=540,
+                       highlight_color="yellow"):
+        """Blocking part of render_word_highlight: rasterize the karaoke caption lines (Pillow)."""
+        with tracing.span('captions.karaoke', words=len(words)):
+            return self.video_captioner.generate_word_highlight_captions(
+                words,
+                font=font,
+                captions_color=captions_color,
+                shadow_color=shadow_color,
+                highlight_color=highlight_color,
+                font_size=font_size,
+                width=width
+            )
+
+    @tracing.traced('captions.imagemagick')
+    def render(self, subtitles, captions_color="white", shadow_color="cyan", font_size=60, font=None, width=540):
+        """Rasterize the caption clips of Subtitles or an SRT path (blocking, ImageMagick)."""
+        return self.video_captioner.generate_captions_to_video(
+            subtitles,
             font=font,
             captions_color=captions_color,
             shadow_color=shadow_color,
             font_size=font_size,
             width=width
-        )
-        return subtitles_file, caption_clips
\ No newline at end of file
+        )
\ No newline at end of file
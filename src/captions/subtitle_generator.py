@@ -2,53 +2,99 @@ import logging
 import os
 import pysrt
 import uuid
-from openai import OpenAI
+import asyncio
+from types import SimpleNamespace
+from openai import AsyncOpenAI
 
 from .utils import convert_seconds_to_srt_time
+from .transcription_cache import TranscriptionCache
+from .subtitles import Subtitles
+from ..workspace import scratch_path
+from ..ffmpeg_tools import compact_audio
+from .. import tracing
+from .. import openai_session
 
 class SubtitleGenerator:
     def __init__(self):
-        self.openai = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
         self.convert_seconds_to_srt_time = convert_seconds_to_srt_time
         self.base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-
-    async def generate_subtitles(self, audio_file: str):
+        self.transcription_cache = TranscriptionCache()
+        self.compact_uploads = os.getenv('TURBOREEL_COMPACT_UPLOADS', '1') == '1'
+
+    @property
+    def openai(self) -> AsyncOpenAI:
+        # Looked up per call: clients are bound to the event loop that first used them
+        return openai_session.get_client()
+
+    @tracing.traced('openai.whisper')
+    async def transcribe_words(self, audio_file: str) -> list:
+        """Word-level Whisper transcription of an audio file, with .word, .start and .end per word.
+
+        Results are cached by audio content and request parameters. On a miss the audio is
+        first transcoded to small mono Opus, which Whisper accepts and uploads much faster
+        than WAV or stereo MP3; timings are unaffected.
+        """
+        params = {'model': 'whisper-1', 'timestamp_granularities': ['word']}
+        key = await asyncio.to_thread(self.transcription_cache.key, audio_file, **params)
+        words = self.transcription_cache.get(key)
+        if words is not None:
+            logging.info("Transcription found in cache.")
+            tracing.record(cache_hits=1)
+        else:
+            tracing.record(cache_misses=1)
+            upload_file = audio_file
+            if self.compact_uploads:
+                try:
+                    output_path = scratch_path(f'upload_{uuid.uuid4()}.ogg', default_dir=os.path.join(self.base_dir, 'assets'))
+                    upload_file = await asyncio.to_thread(compact_audio, audio_file, output_path)
+                except Exception as e:
+                    logging.warning(f"Could not compact audio for upload, sending it as is: {e}")
+            try:
+                tracing.record(bytes=os.path.getsize(upload_file))
+                with open(upload_file, "rb") as audio:  # Open the audio file
+                    transcript = await self.openai.audio.transcriptions.create(  # Use OpenAI's transcription method
+                        file=audio,
+                        model=params['model'],
+                        response_format="verbose_json",
+                        timestamp_granularities=params['timestamp_granularities']
+                    )
+            finally:
+                if upload_file != audio_file and os.path.exists(upload_file):
+                    os.remove(upload_file)
+            words = [{'word': word.word, 'start': word.start, 'end': word.end} for word in transcript.words]
+            self.transcription_cache.put(key, words)
+        return [SimpleNamespace(**word) for word in words]
+
+    async def generate_subtitles(self, audio_file: str, export_path: str = None, words: list = None):
+        """Transcribe audio_file into in-memory Subtitles; they are also saved as SRT when export_path is given.
+
+        Pass the words of transcribe_words when the caller already has them, e.g. for karaoke captions.
+        """
         try:
-            subtitles = await self.speech_to_text(audio_file)
-            srt_file = pysrt.SubRipFile()
-
-            for index, (start, end, text) in enumerate(subtitles):
-                srt_file.append(pysrt.SubRipItem(index=index + 1, start=start, end=end, text=text))
-            
-            unique_id = uuid.uuid4()
-            output_dir = os.path.join(self.base_dir, 'assets')
-            output_file = os.path.join(output_dir, f'subtitles_{unique_id}.srt')
-            srt_file.save(output_file)
+            subtitles = Subtitles.from_cues(await self.speech_to_text(audio_file, words))
+            if export_path:
+                subtitles.save(export_path)
+                logging.info(f"Subtitles exported to {export_path}")
             
-            logging.info("Subtitles generated and saved successfully.")
-            return output_file  # Return the path to the saved SRT file
+            logging.info("Subtitles generated successfully.")
+            return subtitles
         except Exception as e:
             logging.error(f"Error generating subtitles: {e}")
             return None
 
-    async def speech_to_text(self, audio_file: str):
+    async def speech_to_text(self, audio_file: str, words: list = None):
         try:
-            audio_file = open(audio_file, "rb")  # Open the audio file
-            transcript = self.openai.audio.transcriptions.create(  # Use OpenAI's transcription method
-                file=audio_file,
-                model="whisper-1",
-                response_format="verbose_json",
-                timestamp_granularities=["word"]
-            )
+            if words is None:
+                words = await self.transcribe_words(audio_file)
             subtitles = []
             current_words = []
             subtitle_start_time = None
 
-            for i, word_info in enumerate(transcript.words):
+            for i, word_info in enumerate(words):
                 word_start_time = self.convert_seconds_to_srt_time(word_info.start)
                 word_end_time = self.convert_seconds_to_srt_time(word_info.end)
 
-                previous_word_end = self.convert_seconds_to_srt_time(transcript.words[i - 1].end)
+                previous_word_end = self.convert_seconds_to_srt_time(words[i - 1].end)
 
                 if subtitle_start_time is None:
                     subtitle_start_time = word_start_time
@@ -90,7 +136,7 @@ class SubtitleGenerator:
             
             unique_id = uuid.uuid4()
             output_dir = os.path.join(self.base_dir, 'assets')
-            output_file = os.path.join(output_dir, f'subtitles_{unique_id}.srt')
+            output_file = scratch_path(f'subtitles_{unique_id}.srt', default_dir=output_dir)
             srt_file.save(output_file)
             
             logging.info("Subtitles generated and saved successfully.")
@@ -101,22 +147,16 @@ class SubtitleGenerator:
 
     async def speech_to_text_for_translation(self, audio_file):
         try:
-            audio_file = open(audio_file, "rb")  # Open the audio file
-            transcript = self.openai.audio.transcriptions.create(  # Use OpenAI's transcription method
-                file=audio_file,
-                model="whisper-1",
-                response_format="verbose_json",
-                timestamp_granularities=["word"]
-            )
+            words = await self.transcribe_words(audio_file)
             subtitles = []
             current_words = []
             subtitle_start_time = None
 
-            for i, word_info in enumerate(transcript.words):
+            for i, word_info in enumerate(words):
                 word_start_time = self.convert_seconds_to_srt_time(word_info.start)
                 word_end_time = self.convert_seconds_to_srt_time(word_info.end)
 
-                previous_word_end = self.convert_seconds_to_srt_time(transcript.words[i - 1].end)
+                previous_word_end = self.convert_seconds_to_srt_time(words[i - 1].end)
 
                 if subtitle_start_time is None:
                     subtitle_start_time = word_start_time
@@ -0,0 +1,71 @@
+import bisect
+
+import pysrt
+
+
+def _seconds(value) -> float:
+    """Seconds from a pysrt SubRipTime or a number."""
+    return value.ordinal / 1000 if hasattr(value, 'ordinal') else float(value)
+
+
+class Subtitles:
+    """Subtitle cues kept in memory as parallel arrays of start, end (seconds) and text.
+
+    Produced by SubtitleGenerator and consumed directly by the captioner and the image
+    keyword extraction; an SRT file is only written when one is asked for with save().
+    Cues are in time order.
+    """
+
+    __slots__ = ('starts', 'ends', 'texts')
+
+    def __init__(self, starts=(), ends=(), texts=()):
+        self.starts = [float(start) for start in starts]
+        self.ends = [float(end) for end in ends]
+        self.texts = list(texts)
+
+    @classmethod
+    def from_cues(cls, cues) -> 'Subtitles':
+        """Build from (start, end, text) tuples, times as SubRipTime or seconds."""
+        subtitles = cls()
+        for start, end, text in cues:
+            subtitles.starts.append(_seconds(start))
+            subtitles.ends.append(_seconds(end))
+            subtitles.texts.append(text)
+        return subtitles
+
+    @classmethod
+    def from_srt(cls, path: str) -> 'Subtitles':
+        return cls.from_cues((item.start, item.end, item.text) for item in pysrt.open(path))
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __iter__(self):
+        return zip(self.starts, self.ends, self.texts)
+
+    def save(self, path: str) -> str:
+        """Export as an SRT file."""
+        srt_file = pysrt.SubRipFile()
+        for index, (start, end, text) in enumerate(self, 1):
+            srt_file.append(pysrt.SubRipItem(
+                index=index,
+                start=pysrt.SubRipTime.from_ordinal(int(round(start * 1000))),
+                end=pysrt.SubRipTime.from_ordinal(int(round(end * 1000))),
+                text=text
+            ))
+        srt_file.save(path)
+        return path
+
+    def index_at(self, t: float) -> int:
+        """Index of the cue shown at t seconds, or None between cues."""
+        index = bisect.bisect_right(self.starts, t) - 1
+        if index >= 0 and t < self.ends[index]:
+            return index
+        return None
+
+    def windows(self, window: float, duration: float) -> list:
+        """Texts of the cues starting in each consecutive window of `window` seconds up to duration."""
+        count = max(int(-(-duration // window)), 1)
+        bounds = [bisect.bisect_left(self.starts, k * window) for k in range(count + 1)]
+        bounds[-1] = len(self.starts)  # Cues past the last window belong to it
+        return [self.texts[bounds[k]:bounds[k + 1]] for k in range(count)]
@@ -0,0 +1,60 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+
+
+class TranscriptionCache:
+    """Word-level transcriptions kept on disk, keyed by the audio's content hash and the request parameters.
+
+    The same audio (a retry, a re-render, the same voice line) is only sent to Whisper once.
+    """
+
+    def __init__(self, cache_dir: str = None):
+        default_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'cache')
+        self.cache_dir = os.path.join(cache_dir or os.getenv('TURBOREEL_CACHE_DIR') or default_dir, 'transcriptions')
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    @staticmethod
+    def key(audio_file: str, **params) -> str:
+        digest = hashlib.sha256()
+        with open(audio_file, 'rb') as audio:
+            for chunk in iter(lambda: audio.read(1 << 20), b''):
+                digest.update(chunk)
+        digest.update(json.dumps(params, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> list:
+        """The cached words ([{'word', 'start', 'end'}]) for key, or None."""
+        try:
+            with open(self._path(key), 'r') as cached:
+                words = json.load(cached)
+        except FileNotFoundError:
+            with self._lock:
+                self.stats['misses'] += 1
+            return None
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable transcription cache entry {key}: {e}")
+            with self._lock:
+                self.stats['misses'] += 1
+            return None
+        with self._lock:
+            self.stats['hits'] += 1
+        return words
+
+    def put(self, key: str, words: list):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename, so a concurrent reader never sees half a file
+            partial_path = f"{path}.{threading.get_ident()}.part"
+            with open(partial_path, 'w') as cached:
+                json.dump(words, cached)
+            os.replace(partial_path, path)
+        except Exception as e:
+            logging.warning(f"Could not cache transcription {key}: {e}")
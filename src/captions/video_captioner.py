@@ -1,8 +1,13 @@
-from moviepy.editor import TextClip, CompositeVideoClip
+from moviepy.editor import TextClip, CompositeVideoClip, VideoClip, ImageClip
+from PIL import Image, ImageDraw, ImageFont
+import numpy as np
+import bisect
 import pysrt
 import logging
 import os
 
+from .subtitles import Subtitles
+
 class VideoCaptioner:
     def __init__(self):
         self.default_font = self.get_font_path("Dacherry.ttf")
@@ -38,7 +43,7 @@ class VideoCaptioner:
 
     """ Call this function to generate the captions to video """
     def generate_captions_to_video(self, 
-                                   subtitles_path,
+                                   subtitles,
                                    font=None, 
                                    captions_color='#BA4A00', 
                                    shadow_color='white',
@@ -47,7 +52,6 @@ class VideoCaptioner:
                                    ):
         font = self.get_font_path(font) if font else self.default_font
         try:
-            subtitles = subtitles_path
             subtitle_clips = []
             shadow_offset = font_size / 10
 
@@ -56,6 +60,9 @@ class VideoCaptioner:
             if isinstance(subtitles, str):
                 # If subtitles is a string (file path), read the SRT file
                 subtitles = pysrt.open(subtitles)
+            elif isinstance(subtitles, Subtitles):
+                # In-memory subtitles: (start, end, text) tuples in seconds
+                subtitles = list(subtitles)
             elif isinstance(subtitles, list):
                 # If subtitles is a list, assume it's a list of tuples (start, end, text)
                 subtitles = [pysrt.SubRipItem(index=i, start=s, end=e, text=t) for i, (s, e, t) in enumerate(subtitles, 1)]
@@ -100,3 +107,121 @@ class VideoCaptioner:
             logging.error(f"Error adding captions to video: {e}")
             logging.exception("Traceback:")  # This will log the full traceback
             return []
+
+    def group_words_into_lines(self, words, max_words=4, max_pause=0.6):
+        """Group word timings (.word, .start, .end) into caption lines.
+
+        A line ends after max_words words or before a pause of at least max_pause seconds,
+        like the two-word chunks of SubtitleGenerator.speech_to_text.
+        """
+        lines = []
+        current = []
+        for word in words:
+            if current and (len(current) >= max_words or word.start - current[-1].end >= max_pause):
+                lines.append(current)
+                current = []
+            current.append(word)
+        if current:
+            lines.append(current)
+        return lines
+
+    def rasterize_line(self, texts, font, color, stroke_color, stroke_width, max_width):
+        """Render a caption line once with Pillow.
+
+        Words wrap onto centered rows no wider than max_width. Returns the RGB and alpha
+        arrays of the line, a mask of the text fill (without stroke) and the bounding box
+        of every word, so single words can be recolored later without re-rendering.
+        """
+        space = font.getlength(' ')
+        rows = [[]]
+        row_width = 0.0
+        for index, text in enumerate(texts):
+            word_width = font.getlength(text)
+            if rows[-1] and row_width + space + word_width > max_width:
+                rows.append([])
+                row_width = 0.0
+            row_width += (space if rows[-1] else 0) + word_width
+            rows[-1].append((index, text, word_width))
+
+        ascent, descent = font.getmetrics()
+        row_height = ascent + descent + 2 * stroke_width
+        row_widths = [sum(w for _, _, w in row) + space * (len(row) - 1) for row in rows]
+        image_width = int(np.ceil(max(row_widths) + 2 * stroke_width)) + 2
+        image_height = int(row_height * len(rows)) + 2
+
+        base = Image.new('RGBA', (image_width, image_height), (0, 0, 0, 0))
+        fill = Image.new('L', (image_width, image_height), 0)
+        base_draw = ImageDraw.Draw(base)
+        fill_draw = ImageDraw.Draw(fill)
+        boxes = [None] * len(texts)
+        for row_index, row in enumerate(rows):
+            x = (image_width - row_widths[row_index]) / 2
+            y = row_index * row_height + stroke_width
+            for index, text, word_width in row:
+                base_draw.text((x, y), text, font=font, fill=color, stroke_width=stroke_width, stroke_fill=stroke_color)
+                fill_draw.text((x, y), text, font=font, fill=255)
+                left, top, right, bottom = base_draw.textbbox((x, y), text, font=font, stroke_width=stroke_width)
+                boxes[index] = (max(int(left), 0), max(int(top), 0), min(int(np.ceil(right)), image_width), min(int(np.ceil(bottom)), image_height))
+                x += word_width + space
+
+        pixels = np.array(base)
+        return pixels[:, :, :3], pixels[:, :, 3] / 255.0, np.array(fill) / 255.0, boxes
+
+    def generate_word_highlight_captions(self,
+                                         words,
+                                         font=None,
+                                         captions_color='white',
+                                         shadow_color='black',
+                                         highlight_color='yellow',
+                                         font_size=60,
+                                         width=540,
+                                         max_words=4
+                                         ):
+        """Karaoke-style captions: the word being spoken is recolored on its line.
+
+        Each line is rasterized once; at frame time the active word's box is recolored in
+        NumPy through the fill mask, so the cost per word is one array blend, not one more
+        text rendering.
+
+        Args:
+            words (list): Word timings with .word, .start and .end (seconds), e.g. from SubtitleGenerator.transcribe_words.
+        """
+        font_path = self.get_font_path(font) if font else self.default_font
+        try:
+            size = int(font_size * 1.1)
+            pil_font = ImageFont.truetype(font_path, size) if font_path else ImageFont.load_default(size)
+            stroke_width = max(int(round(font_size / 15)), 1)
+            highlight_rgb = np.array(Image.new('RGB', (1, 1), highlight_color).getpixel((0, 0)), dtype=np.float32)
+
+            caption_clips = []
+            for line in self.group_words_into_lines(words, max_words):
+                texts = [word.word.strip().upper() for word in line]
+                rgb, alpha, fill, boxes = self.rasterize_line(texts, pil_font, captions_color, shadow_color, stroke_width, width * 0.8)
+                line_start = line[0].start
+                word_starts = [word.start - line_start for word in line]
+                frames = {}
+
+                def make_frame(t, rgb=rgb, fill=fill, boxes=boxes, word_starts=word_starts, frames=frames):
+                    index = max(bisect.bisect_right(word_starts, t) - 1, 0)
+                    if index not in frames:
+                        frame = rgb.astype(np.float32)
+                        left, top, right, bottom = boxes[index]
+                        weight = fill[top:bottom, left:right, None]
+                        frame[top:bottom, left:right] = frame[top:bottom, left:right] * (1 - weight) + highlight_rgb * weight
+                        frames[index] = frame.astype(np.uint8)
+                    return frames[index]
+
+                duration = max(line[-1].end - line_start, 0.05)
+                mask = ImageClip(alpha, ismask=True).set_duration(duration)
+                caption_clip = (VideoClip(make_frame, duration=duration)
+                                .set_mask(mask)
+                                .set_start(line_start)
+                                .set_position(('center', 0.4), relative=True))
+                caption_clips.append(caption_clip)
+
+            logging.info(f"Generated {len(caption_clips)} word-highlight caption clips")
+            return caption_clips
+        except Exception as e:
+            logging.error(f"Error generating word-highlight captions: {e}")
+            logging.exception("Traceback:")
+            return []
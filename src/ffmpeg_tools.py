@@ -0,0 +1,282 @@
+import os
+import re
+import json
+import shutil
+import logging
+import subprocess
+
+import numpy as np
+from moviepy.config import get_setting
+
+from . import tracing
+
+
+def ffmpeg_exe() -> str:
+    """The ffmpeg binary moviepy is configured with (FFMPEG_BINARY or the imageio-ffmpeg build)."""
+    return get_setting("FFMPEG_BINARY")
+
+
+def ffprobe_exe() -> str:
+    """The ffprobe binary: FFPROBE_BINARY, the one next to moviepy's ffmpeg, or ffprobe on the PATH.
+
+    Returns None when none is available (imageio-ffmpeg does not ship ffprobe).
+    """
+    if os.getenv('FFPROBE_BINARY'):
+        return os.getenv('FFPROBE_BINARY')
+    ffmpeg = ffmpeg_exe()
+    directory, name = os.path.split(ffmpeg)
+    sibling = os.path.join(directory, name.replace('ffmpeg', 'ffprobe', 1))
+    if directory and sibling != ffmpeg and os.path.isfile(sibling):
+        return sibling
+    return shutil.which('ffprobe')
+
+
+def run_ffprobe(args: list) -> dict:
+    """Run ffprobe with JSON output and return the parsed result.
+
+    Raises:
+        RuntimeError: If ffprobe is not available or exits with an error.
+    """
+    exe = ffprobe_exe()
+    if not exe:
+        raise RuntimeError("ffprobe is not available, set FFPROBE_BINARY or install ffmpeg.")
+    command = [exe, '-hide_banner', '-loglevel', 'error', '-of', 'json'] + [str(arg) for arg in args]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe failed ({result.returncode}): {result.stderr.decode(errors='replace')[-2000:]}")
+    return json.loads(result.stdout or b'{}')
+
+
+def keyframe_times(video_path: str) -> list:
+    """Timestamps (seconds) of the video keyframes.
+
+    With ffprobe they are read from the packet flags without decoding. Without it (the
+    imageio-ffmpeg build moviepy installs has no ffprobe) ffmpeg decodes the keyframes
+    only (-skip_frame nokey) and reports their timestamps through the showinfo filter.
+    """
+    if not ffprobe_exe():
+        return _keyframe_times_ffmpeg(video_path)
+    probe = run_ffprobe(['-select_streams', 'v:0', '-show_entries', 'packet=pts_time,flags', video_path])
+    times = [
+        float(packet['pts_time']) for packet in probe.get('packets', [])
+        if 'K' in packet.get('flags', '') and packet.get('pts_time') not in (None, 'N/A')
+    ]
+    return sorted(times)
+
+
+_SHOWINFO_PTS = re.compile(r'pts_time:\s*(-?[0-9.]+)')
+
+
+def _keyframe_times_ffmpeg(video_path: str) -> list:
+    command = [
+        ffmpeg_exe(), '-hide_banner', '-nostats', '-skip_frame', 'nokey', '-i', str(video_path),
+        '-map', '0:v:0', '-an', '-sn', '-dn', '-vf', 'showinfo', '-f', 'null', '-'
+    ]
+    result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = result.stderr.decode(errors='replace')
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed ({result.returncode}): {stderr[-2000:]}")
+    return sorted(
+        float(match.group(1)) for line in stderr.splitlines()
+        if 'Parsed_showinfo' in line and (match := _SHOWINFO_PTS.search(line))
+    )
+
+
+def video_info(video_path: str) -> dict:
+    """Duration, resolution and frame rate of a video from its container headers (no decode).
+
+    Uses ffprobe when available, otherwise moviepy's parse of `ffmpeg -i`.
+    """
+    if ffprobe_exe():
+        probe = run_ffprobe([
+            '-select_streams', 'v:0',
+            '-show_entries', 'stream=width,height,avg_frame_rate,r_frame_rate:format=duration',
+            video_path
+        ])
+        stream = (probe.get('streams') or [{}])[0]
+        rate = stream.get('avg_frame_rate') or stream.get('r_frame_rate') or '0/1'
+        numerator, _, denominator = rate.partition('/')
+        fps = float(numerator) / float(denominator or 1) if float(denominator or 1) else 0.0
+        return {
+            'duration': float(probe.get('format', {}).get('duration') or 0.0),
+            'width': int(stream.get('width') or 0),
+            'height': int(stream.get('height') or 0),
+            'fps': fps,
+        }
+    from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+    infos = ffmpeg_parse_infos(video_path)
+    width, height = infos.get('video_size') or (0, 0)
+    return {
+        'duration': float(infos.get('duration') or 0.0),
+        'width': int(width),
+        'height': int(height),
+        'fps': float(infos.get('video_fps') or 0.0),
+    }
+
+
+def run_ffmpeg(args: list, input_bytes: bytes = None) -> bytes:
+    """Run ffmpeg with args and return its stdout.
+
+    Raises:
+        RuntimeError: If ffmpeg exits with an error.
+    """
+    command = [ffmpeg_exe(), '-hide_banner', '-loglevel', 'error', '-y'] + [str(arg) for arg in args]
+    logging.debug(f"Running: {' '.join(command)}")
+    result = subprocess.run(command, input=input_bytes, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed ({result.returncode}): {result.stderr.decode(errors='replace')[-2000:]}")
+    return result.stdout
+
+
+@tracing.traced('ffmpeg.encode_pcm')
+def encode_pcm(samples: np.ndarray, sample_rate: int, output_path: str, output_sample_rate: int = 44100, bitrate: str = '128k') -> str:
+    """Encode mono float samples in [-1, 1] to an audio file, the codec follows the extension."""
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype('<i2').tobytes()
+    run_ffmpeg([
+        '-f', 's16le', '-ar', sample_rate, '-ac', 1, '-i', 'pipe:0',
+        '-ar', output_sample_rate, '-b:a', bitrate,
+        output_path
+    ], input_bytes=pcm)
+    return output_path
+
+
+@tracing.traced('ffmpeg.demux_audio')
+def demux_audio(video_path: str, output_path: str) -> str:
+    """Copy the first audio stream out of a video without decoding it.
+
+    output_path should be an .mp4/.m4a container, which holds the usual AAC/MP3/Opus
+    tracks and is accepted by Whisper. Falls back to an AAC encode if the stream cannot
+    be copied into it.
+    """
+    try:
+        run_ffmpeg(['-i', video_path, '-map', '0:a:0', '-vn', '-c:a', 'copy', output_path])
+    except RuntimeError as e:
+        logging.warning(f"Audio stream copy failed, encoding to AAC instead: {e}")
+        run_ffmpeg(['-i', video_path, '-map', '0:a:0', '-vn', '-c:a', 'aac', '-b:a', '128k', output_path])
+    return output_path
+
+
+@tracing.traced('ffmpeg.remux_audio')
+def remux_audio(video_path: str, audio_path: str, output_path: str, audio_codec: str = 'copy', audio_bitrate: str = '192k') -> str:
+    """Replace a video's audio track, copying the video stream unchanged.
+
+    With audio_codec='copy' the audio is muxed as is (it must already be AAC or another
+    codec MP4 accepts); otherwise it is encoded with the given codec.
+    """
+    audio_args = ['-c:a', 'copy'] if audio_codec == 'copy' else ['-c:a', audio_codec, '-b:a', audio_bitrate]
+    run_ffmpeg([
+        '-i', video_path, '-i', audio_path,
+        '-map', '0:v:0', '-map', '1:a:0',
+        '-c:v', 'copy', *audio_args,
+        '-movflags', '+faststart',
+        output_path
+    ])
+    return output_path
+
+
+@tracing.traced('ffmpeg.mux_audio_tracks')
+def mux_audio_tracks(video_path: str, audio_tracks: list, output_path: str) -> str:
+    """Mux several audio tracks next to a copied video stream in one MP4.
+
+    audio_tracks is a list of (audio_path, title) tuples; titles are written as track
+    metadata so players can show the language names. Audio is copied, so it must
+    already be AAC or another codec MP4 accepts.
+    """
+    args = ['-i', video_path]
+    for audio_path, _ in audio_tracks:
+        args += ['-i', audio_path]
+    args += ['-map', '0:v:0']
+    for index in range(len(audio_tracks)):
+        args += ['-map', f'{index + 1}:a:0']
+    args += ['-c:v', 'copy', '-c:a', 'copy']
+    for index, (_, title) in enumerate(audio_tracks):
+        args += [f'-metadata:s:a:{index}', f'title={title}']
+        # Only ISO 639 style codes are valid language tags
+        if len(title) in (2, 3) and title.isalpha():
+            args += [f'-metadata:s:a:{index}', f'language={title.lower()}']
+    args += ['-disposition:a:0', 'default', '-movflags', '+faststart', output_path]
+    run_ffmpeg(args)
+    return output_path
+
+
+@tracing.traced('ffmpeg.stream_copy_cut')
+def stream_copy_cut(video_path: str, start_time: float, duration: float, output_path: str, loop: bool = False) -> str:
+    """Cut duration seconds out of a video without re-encoding.
+
+    The input is seeked before decoding, so with stream copy the cut starts on the
+    keyframe at or before start_time; the output still lasts duration seconds. With
+    loop=True the input is repeated, for sources shorter than the cut.
+    """
+    loop_args = ['-stream_loop', '-1'] if loop else []
+    run_ffmpeg([
+        *loop_args, '-ss', f'{start_time:.3f}', '-i', video_path,
+        '-t', f'{duration:.3f}',
+        '-map', '0:v:0', '-map', '0:a?',
+        '-c', 'copy', '-avoid_negative_ts', 'make_zero',
+        output_path
+    ])
+    return output_path
+
+
+def _vertical_filter(width: int, height: int) -> str:
+    """Filter center-cropping a video to width:height and scaling it to exactly that size."""
+    return f"crop='min(iw,ih*{width}/{height})':'min(ih,iw*{height}/{width})',scale={width}:{height},setsar=1"
+
+
+@tracing.traced('ffmpeg.vertical_proxy')
+def make_vertical_proxy(video_path: str, output_path: str, width: int, height: int, fps: int = 30, gop_seconds: float = 1.0) -> str:
+    """Center-crop a video to width:height and scale it to exactly that size, in one ffmpeg pass.
+
+    The proxy gets a fixed short GOP (a keyframe every gop_seconds, no scene-cut
+    keyframes) so that seeking anywhere in it only decodes a few frames.
+    """
+    gop = max(int(round(fps * gop_seconds)), 1)
+    run_ffmpeg([
+        '-i', video_path,
+        '-map', '0:v:0', '-map', '0:a?',
+        '-vf', _vertical_filter(width, height), '-r', fps,
+        '-c:v', 'libx264', '-preset', 'veryfast', '-crf', 18, '-pix_fmt', 'yuv420p',
+        '-g', gop, '-keyint_min', gop, '-sc_threshold', 0,
+        '-c:a', 'aac', '-b:a', '128k',
+        '-movflags', '+faststart',
+        output_path
+    ])
+    return output_path
+
+
+@tracing.traced('ffmpeg.vertical_cut')
+def vertical_cut(video_path: str, start_time: float, duration: float, output_path: str, width: int, height: int, loop: bool = False) -> str:
+    """Cut duration seconds of a video, center-cropped to width:height and scaled to that size, in one pass.
+
+    Meant for backgrounds rendered once, where a full proxy would not pay off: only the
+    section is encoded, so the render reads its frames at output size. With loop=True the
+    input is repeated, for sources shorter than the cut.
+    """
+    loop_args = ['-stream_loop', '-1'] if loop else []
+    run_ffmpeg([
+        *loop_args, '-ss', f'{start_time:.3f}', '-i', video_path,
+        '-t', f'{duration:.3f}',
+        '-map', '0:v:0', '-map', '0:a?',
+        '-vf', _vertical_filter(width, height),
+        '-c:v', 'libx264', '-preset', 'veryfast', '-crf', 18, '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac', '-b:a', '128k',
+        '-movflags', '+faststart',
+        output_path
+    ])
+    return output_path
+
+
+@tracing.traced('ffmpeg.compact_audio')
+def compact_audio(audio_path: str, output_path: str, sample_rate: int = 16000, bitrate: str = '24k') -> str:
+    """Transcode audio to a small mono file for speech APIs (Opus in Ogg, MP3 if Opus is unavailable).
+
+    Returns the path actually written, whose extension may differ from output_path's.
+    """
+    root = os.path.splitext(output_path)[0]
+    try:
+        run_ffmpeg(['-i', audio_path, '-vn', '-ac', 1, '-ar', sample_rate, '-c:a', 'libopus', '-b:a', bitrate, '-application', 'voip', root + '.ogg'])
+        return root + '.ogg'
+    except RuntimeError as e:
+        logging.warning(f"Opus encode failed, using MP3 instead: {e}")
+        run_ffmpeg(['-i', audio_path, '-vn', '-ac', 1, '-ar', sample_rate, '-c:a', 'libmp3lame', '-b:a', '32k', root + '.mp3'])
+        return root + '.mp3'
@@ -0,0 +1,192 @@
+import os
+import asyncio
+import logging
+import weakref
+from urllib.parse import urlsplit
+
+import httpx
+
+from . import tracing
+
+# HTTP/2 needs the optional 'h2' package, fall back to HTTP/1.1 keep-alive without it
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+def _parse_host_limits(value: str) -> dict:
+    """Parse 'host=limit,host=limit' into a dict."""
+    host_limits = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        host, _, limit = item.partition('=')
+        try:
+            host_limits[host.strip().lower()] = int(limit)
+        except ValueError:
+            logging.warning(f"Ignoring invalid host limit: {item}")
+    return host_limits
+
+
+# Pool configuration, overridable through the environment or configure()
+settings = {
+    'max_connections': int(os.getenv('TURBOREEL_HTTP_MAX_CONNECTIONS', 50)),
+    'max_keepalive_connections': int(os.getenv('TURBOREEL_HTTP_MAX_KEEPALIVE', 20)),
+    'keepalive_expiry': float(os.getenv('TURBOREEL_HTTP_KEEPALIVE_EXPIRY', 30)),
+    'max_per_host': int(os.getenv('TURBOREEL_HTTP_MAX_PER_HOST', 6)),
+    'host_limits': _parse_host_limits(os.getenv('TURBOREEL_HTTP_HOST_LIMITS', '')),
+    'timeout': float(os.getenv('TURBOREEL_HTTP_TIMEOUT', 15)),
+}
+
+
+class ConnectionStats:
+    """Counters used to verify how many requests reused a pooled connection."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.new_connections = 0
+        self.tls_handshakes = 0
+        self.bytes_downloaded = 0
+        self.http_versions = {}
+
+    def as_dict(self) -> dict:
+        reused = max(self.requests - self.new_connections, 0)
+        return {
+            'requests': self.requests,
+            'new_connections': self.new_connections,
+            'reused_connections': reused,
+            'reuse_ratio': reused / self.requests if self.requests else 0.0,
+            'tls_handshakes': self.tls_handshakes,
+            'bytes_downloaded': self.bytes_downloaded,
+            'http_versions': dict(self.http_versions),
+        }
+
+
+stats = ConnectionStats()
+
+
+async def _trace(event_name: str, info: dict):
+    """httpcore trace hook, only fires the connect/TLS events when a new connection is opened."""
+    if event_name == 'connection.connect_tcp.complete':
+        stats.new_connections += 1
+    elif event_name == 'connection.start_tls.complete':
+        stats.tls_handshakes += 1
+
+
+async def _on_request(request: httpx.Request):
+    stats.requests += 1
+    request.extensions['trace'] = _trace
+
+
+async def _on_response(response: httpx.Response):
+    stats.http_versions[response.http_version] = stats.http_versions.get(response.http_version, 0) + 1
+
+
+class _LoopSession:
+    """The pooled client and per-host limits belonging to one event loop."""
+
+    def __init__(self):
+        self.client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            timeout=settings['timeout'],
+            follow_redirects=True,
+            limits=httpx.Limits(
+                max_connections=settings['max_connections'],
+                max_keepalive_connections=settings['max_keepalive_connections'],
+                keepalive_expiry=settings['keepalive_expiry'],
+            ),
+            event_hooks={'request': [_on_request], 'response': [_on_response]},
+        )
+        self.host_semaphores = {}
+
+    def host_semaphore(self, url) -> asyncio.Semaphore:
+        host = (urlsplit(str(url)).hostname or '').lower()
+        if host not in self.host_semaphores:
+            limit = settings['host_limits'].get(host, settings['max_per_host'])
+            self.host_semaphores[host] = asyncio.Semaphore(limit)
+        return self.host_semaphores[host]
+
+
+# httpx connections are bound to the loop that opened them, so keep one pool per running loop
+_sessions = weakref.WeakKeyDictionary()
+
+
+def _session() -> _LoopSession:
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.client.is_closed:
+        session = _LoopSession()
+        _sessions[loop] = session
+    return session
+
+
+def configure(max_connections=None, max_keepalive_connections=None, keepalive_expiry=None,
+              max_per_host=None, host_limits=None, timeout=None):
+    """Update the pool settings. Applies to clients created after the call."""
+    for key, value in {
+        'max_connections': max_connections,
+        'max_keepalive_connections': max_keepalive_connections,
+        'keepalive_expiry': keepalive_expiry,
+        'max_per_host': max_per_host,
+        'timeout': timeout,
+    }.items():
+        if value is not None:
+            settings[key] = value
+    if host_limits is not None:
+        settings['host_limits'].update({host.lower(): limit for host, limit in host_limits.items()})
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return the shared keep-alive client for the running event loop."""
+    return _session().client
+
+
+async def get(url, **kwargs) -> httpx.Response:
+    """GET through the shared pool, respecting the per-host connection limit."""
+    session = _session()
+    async with session.host_semaphore(url):
+        response = await session.client.get(url, **kwargs)
+    stats.bytes_downloaded += len(response.content)
+    tracing.record(bytes=len(response.content))
+    return response
+
+
+async def stream_download(url, file_path, chunk_size=64 * 1024, **kwargs) -> str:
+    """Stream a response body straight to disk instead of buffering it in memory.
+
+    Raises:
+        httpx.HTTPError: If the request fails or returns an error status.
+    """
+    session = _session()
+    tmp_path = f"{file_path}.part"
+    async with session.host_semaphore(url):
+        async with session.client.stream('GET', url, **kwargs) as response:
+            response.raise_for_status()
+            try:
+                with open(tmp_path, 'wb') as f:
+                    async for chunk in response.aiter_bytes(chunk_size):
+                        f.write(chunk)
+                        stats.bytes_downloaded += len(chunk)
+                        tracing.record(bytes=len(chunk))
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+    os.replace(tmp_path, file_path)
+    return file_path
+
+
+def connection_stats() -> dict:
+    """Return request/connection counters for the current process."""
+    return stats.as_dict()
+
+
+async def close():
+    """Close the pooled client of the running event loop."""
+    loop = asyncio.get_running_loop()
+    session = _sessions.pop(loop, None)
+    if session is not None:
+        await session.client.aclose()
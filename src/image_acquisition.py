@@ -0,0 +1,422 @@
+import os
+import math
+import time
+import asyncio
+import logging
+from urllib.parse import quote
+
+import httpx
+import numpy as np
+from PIL import Image
+
+from . import http_session
+from . import tracing
+from .provider_health import registry as default_registry
+
+
+class ProviderError(Exception):
+    """The provider failed (HTTP error, timeout, quota) as opposed to having no result."""
+
+
+class ImageProvider:
+    """Base class for an image source.
+
+    fetch() writes the image to output_path and returns it, returns None when the
+    provider has no image for the query, and raises ProviderError when it fails.
+    target_size is the (width, height) box the image will be shown in, providers use it
+    to pick the smallest variant that still covers it.
+    """
+    name = 'base'
+
+    async def fetch(self, query, output_path, target_size=None):
+        raise NotImplementedError
+
+
+class PollinationsProvider(ImageProvider):
+    """Generate an image using Pollinations AI API.
+
+    The generation request itself returns the image, so the body is streamed to disk
+    from that first response instead of being fetched a second time.
+    """
+    name = 'pollinations'
+
+    def __init__(self, width=1024, height=1024, model=None, seed=None, nologo=False, private=True, enhance=False, timeout=15):
+        self.width = width
+        self.height = height
+        self.model = model
+        self.seed = seed
+        self.nologo = nologo
+        self.private = private
+        self.enhance = enhance
+        self.timeout = timeout
+
+    min_side = 256
+
+    def generation_size(self, target_size=None) -> tuple:
+        """Generate at the on-screen size instead of a fixed 1024x1024.
+
+        A None side in target_size (e.g. images shown at a fixed height, any width) is
+        derived from the configured width/height aspect ratio.
+        """
+        if not target_size or not any(target_size):
+            return self.width, self.height
+        width, height = target_size
+        if width is None:
+            width = height * self.width / self.height
+        elif height is None:
+            height = width * self.height / self.width
+        # Multiples of 8 keep the diffusion models happy
+        return tuple(max(self.min_side, int(math.ceil(side / 8)) * 8) for side in (width, height))
+
+    def build_url(self, query, target_size=None) -> str:
+        width, height = self.generation_size(target_size)
+        # Build query parameters
+        params = {
+            'width': width,
+            'height': height,
+            'nologo': str(self.nologo).lower(),
+            'private': str(self.private).lower(),
+            'enhance': str(self.enhance).lower()
+        }
+        if self.model:
+            params['model'] = self.model
+        if self.seed is not None:
+            params['seed'] = self.seed
+
+        # URL encode the prompt
+        generate_url = f"https://image.pollinations.ai/prompt/{quote(query)}"
+        return str(httpx.URL(generate_url, params=params))
+
+    async def fetch(self, query, output_path, target_size=None):
+        full_url = self.build_url(query, target_size)
+        try:
+            return await http_session.stream_download(full_url, output_path, timeout=self.timeout)
+        except httpx.TimeoutException as e:
+            raise ProviderError(f"Timeout occurred while generating image: {full_url}") from e
+        except httpx.HTTPError as e:
+            raise ProviderError(f"Failed to generate image: {e}") from e
+
+
+class SearchProvider(ImageProvider):
+    """A stock-photo API: search for URLs, then download the first hit."""
+    download_timeout = 15
+
+    async def _search(self, query, target_size=None) -> list:
+        """Return image URLs for the query. Raises ProviderError on failure."""
+        raise NotImplementedError
+
+    async def search(self, query, target_size=None) -> list:
+        """Search for images and return the URLs, or an empty list on error."""
+        try:
+            return await self._search(query, target_size)
+        except ProviderError as e:
+            logging.error(e)
+            return []
+
+    async def _get_json(self, url, **kwargs) -> dict:
+        try:
+            response = await http_session.get(url, **kwargs)
+            response.raise_for_status()  # Raise an error for bad responses
+            return response.json()
+        except httpx.HTTPStatusError as e:
+            raise ProviderError(f"HTTP error occurred: {e}") from e
+        except Exception as e:
+            raise ProviderError(f"An error occurred during the request: {e}") from e
+
+    async def fetch(self, query, output_path, target_size=None):
+        image_urls = await self._search(query, target_size)
+        if not image_urls:
+            logging.info(f"No images found on {self.name} for: {query}")
+            return None
+        image_path = await download_image(image_urls[0], output_path, timeout=self.download_timeout)
+        if not image_path:
+            raise ProviderError(f"Failed to download {self.name} image: {image_urls[0]}")
+        return image_path
+
+
+class PexelsProvider(SearchProvider):
+    name = 'pexels'
+    search_url = "https://api.pexels.com/v1/search"
+
+    def __init__(self, api_key, per_page=2):
+        self.api_key = api_key
+        self.per_page = per_page
+
+    # Pexels 'src' variants, smallest first, as the box each one is fitted into
+    variants = [('medium', (None, 350)), ('large', (940, 650)), ('large2x', (1880, 1300))]
+
+    def pick_variant(self, photo, target_size=None) -> str:
+        """Smallest Pexels variant that covers the target box, 'original' only if nothing else does."""
+        if target_size:
+            width, height = photo.get('width'), photo.get('height')
+            if width and height:
+                needed = fitted_size((width, height), target_size)
+                for variant, box in self.variants:
+                    if variant in photo['src'] and covers(fitted_size((width, height), box), needed):
+                        return photo['src'][variant]
+        return photo['src']['original']
+
+    async def _search(self, query, target_size=None) -> list:
+        """Search for images using Pexels API and return the URLs."""
+        headers = {
+            'Authorization': self.api_key
+        }
+        params = {
+            'query': query,
+            'per_page': self.per_page
+        }
+        search_results = await self._get_json(self.search_url, headers=headers, params=params)
+        return [self.pick_variant(photo, target_size) for photo in search_results.get('photos', [])]
+
+
+class PixabayProvider(SearchProvider):
+    name = 'pixabay'
+    search_url = "https://pixabay.com/api/"
+
+    def __init__(self, api_key, per_page=3):
+        self.api_key = api_key
+        self.per_page = per_page
+
+    def pick_variant(self, hit, target_size=None) -> str:
+        """webformatURL (640px) when it covers the target box, largeImageURL (1280px) otherwise."""
+        width, height = hit.get('imageWidth'), hit.get('imageHeight')
+        if target_size and hit.get('webformatURL') and width and height:
+            needed = fitted_size((width, height), target_size)
+            if covers((hit.get('webformatWidth', 0), hit.get('webformatHeight', 0)), needed):
+                return hit['webformatURL']
+        return hit['largeImageURL']
+
+    async def _search(self, query, target_size=None) -> list:
+        """Search for images using Pixabay API and return the URLs."""
+        params = {
+            'key': self.api_key,
+            'q': query,
+            'image_type': 'all',
+            'per_page': self.per_page
+        }
+        search_results = await self._get_json(self.search_url, params=params)
+        return [self.pick_variant(hit, target_size) for hit in search_results.get('hits', [])]
+
+
+def fitted_size(size, box) -> tuple:
+    """Size of an image scaled to fit inside box. A None side in box is unconstrained."""
+    width, height = size
+    box_width, box_height = box
+    scales = [box_width / width if box_width else None, box_height / height if box_height else None]
+    scale = min(scale for scale in scales if scale is not None)
+    return math.ceil(width * scale), math.ceil(height * scale)
+
+
+def covers(size, needed) -> bool:
+    # One pixel of slack for rounding
+    return size[0] >= needed[0] - 1 and size[1] >= needed[1] - 1
+
+
+def load_image(image_path, target_size=None) -> np.ndarray:
+    """Decode an image as an array no larger than needed to fill target_size.
+
+    JPEGs use Pillow's draft mode, so the DCT scaling happens inside the decoder and the
+    full-resolution frame is never materialized.
+    """
+    with Image.open(image_path) as img:
+        if target_size:
+            needed = fitted_size(img.size, target_size)
+            if img.format == 'JPEG':
+                img.draft('RGB', needed)
+            if img.size[0] > needed[0] or img.size[1] > needed[1]:
+                img = img.resize(needed, Image.LANCZOS)
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'A' in img.getbands() or 'transparency' in img.info else 'RGB')
+        return np.array(img)
+
+
+async def download_image(url, output_path, timeout=15):
+    """Download an image from a URL to output_path. Returns the path, or None on failure."""
+    try:
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        return await http_session.stream_download(url, output_path, timeout=timeout)
+    except httpx.HTTPError as e:
+        logging.error(f"Failed to download image: {e}")
+    except Exception as e:
+        logging.error(f"Error while saving image: {e}")
+    return None
+
+
+class ImageAcquisition:
+    """Single pipeline that turns a query into an image file on disk.
+
+    Providers are tried in the order the health registry ranks them, skipping any whose
+    circuit is open; the first one that produces a file wins. In hedging mode, if a
+    provider has not answered within the configured percentile of its observed latency,
+    the next provider is started in parallel and the losers are cancelled once one of
+    them succeeds. Hedges are counted on the images.acquire span (hedged, hedges,
+    hedge_wins), so they show in the job traces and the /metrics export.
+    """
+
+    def __init__(self, providers: list, hedge=False, hedge_percentile=0.9, initial_hedge_delay=8.0, min_samples=5, registry=None):
+        self.providers = providers
+        self.registry = registry or default_registry
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.initial_hedge_delay = initial_hedge_delay
+        self.min_samples = min_samples
+        self.stats = {'requests': 0, 'hedged_requests': 0, 'hedges_launched': 0, 'hedge_wins': 0}
+
+    def hedge_delay(self, provider) -> float:
+        """How long to wait on provider before starting the next one."""
+        health = self.registry.health(provider.name)
+        if len(health.latencies) < self.min_samples:
+            return self.initial_hedge_delay
+        return health.latency_percentile(self.hedge_percentile)
+
+    def hedge_stats(self) -> dict:
+        requests = self.stats['requests']
+        return {
+            **self.stats,
+            'hedge_rate': self.stats['hedged_requests'] / requests if requests else 0.0,
+        }
+
+    async def _timed_fetch(self, provider, query, output_path, target_size=None):
+        started = time.monotonic()
+        try:
+            with tracing.span(f"images.{provider.name}"):
+                image_path = await provider.fetch(query, output_path, target_size)
+        except asyncio.CancelledError:
+            self.registry.record_cancelled(provider.name, time.monotonic() - started)
+            raise
+        except Exception as e:
+            logging.error(f"Error fetching image from {provider.name}: {e}")
+            self.registry.record_failure(provider.name)
+            return None
+        # An empty result still means the provider answered
+        self.registry.record_success(provider.name, time.monotonic() - started)
+        return image_path
+
+    def _ranked_providers(self) -> list:
+        providers = self.registry.rank(self.providers)
+        skipped = [provider.name for provider in self.providers if provider not in providers]
+        if skipped:
+            logging.info(f"Skipping providers with open circuits: {', '.join(skipped)}")
+        return providers
+
+    @tracing.traced('images.acquire')
+    async def acquire(self, query, output_path, target_size=None):
+        """Fetch an image for query into output_path.
+
+        target_size is the (width, height) on-screen box, used to download the smallest
+        adequate variant. Returns the path, or None when no provider had an image.
+        """
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        self.stats['requests'] += 1
+        if self.hedge:
+            image_path = await self._acquire_hedged(query, output_path, target_size)
+        else:
+            image_path = await self._acquire_sequential(query, output_path, target_size)
+        if not image_path:
+            logging.error(f"No images found for prompt: {query}")
+        return image_path
+
+    async def _acquire_sequential(self, query, output_path, target_size=None):
+        attempts = 0
+        for provider in self._ranked_providers():
+            if not self.registry.allow(provider.name):
+                continue
+            if attempts:
+                tracing.record(retries=1)  # Falling back to the next provider
+            attempts += 1
+            image_path = await self._timed_fetch(provider, query, output_path, target_size)
+            if image_path:
+                logging.info(f"Image for '{query}' acquired from {provider.name}: {image_path}")
+                return image_path
+            logging.info(f"No image from {provider.name}, trying next provider...")
+        return None
+
+    async def _acquire_hedged(self, query, output_path, target_size=None):
+        root, ext = os.path.splitext(output_path)
+        remaining = self._ranked_providers()
+        pending = {}
+        hedged = False
+        launched = []  # (provider, monotonic launch time), in launch order
+
+        def candidate_path(provider):
+            # Racing providers each get their own file, the winner is moved to output_path
+            return f"{root}.{provider.name}{ext}"
+
+        def launch():
+            provider = remaining.pop(0)
+            while not self.registry.allow(provider.name):
+                if not remaining:
+                    return None
+                provider = remaining.pop(0)
+            if launched:
+                tracing.record(retries=1)  # A hedge or a fallback to the next provider
+            launched.append((provider, time.monotonic()))
+            task = asyncio.create_task(self._timed_fetch(provider, query, candidate_path(provider), target_size))
+            pending[task] = provider
+            return provider
+
+        try:
+            primary = launch() if remaining else None
+            while pending:
+                timeout = None
+                if remaining:
+                    # The hedge delay runs from the newest provider's launch, not from this wait
+                    last_launched, launched_at = launched[-1]
+                    delay = self.hedge_delay(last_launched)
+                    timeout = max(0.0, launched_at + delay - time.monotonic())
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # The newest provider is slower than usual, start the next one alongside it
+                    provider = launch()
+                    if provider is None:
+                        continue
+                    logging.info(f"{last_launched.name} slower than {delay:.1f}s, hedging with {provider.name}")
+                    if not hedged:
+                        self.stats['hedged_requests'] += 1
+                        tracing.record(hedged=1)
+                        hedged = True
+                    self.stats['hedges_launched'] += 1
+                    tracing.record(hedges=1)
+                    continue
+                for task in done:
+                    provider = pending.pop(task)
+                    image_path = task.result()
+                    if image_path:
+                        if provider is not primary and hedged:
+                            self.stats['hedge_wins'] += 1
+                            tracing.record(hedge_wins=1)
+                        tracing.annotate(provider=provider.name)
+                        os.replace(image_path, output_path)
+                        logging.info(f"Image for '{query}' acquired from {provider.name}: {output_path}")
+                        return output_path
+                    logging.info(f"No image from {provider.name}, trying next provider...")
+                if not pending and remaining:
+                    launch()
+            return None
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+            # Losers may have finished their file in the same batch as the winner or just
+            # before being cancelled; the winner's file was already moved to output_path
+            for provider, _ in launched:
+                if os.path.exists(candidate_path(provider)):
+                    os.remove(candidate_path(provider))
+
+
+def default_acquisition(pexels_api_key, pixabay_api_key, width=1024, height=1024, timeout=15, hedge=None) -> ImageAcquisition:
+    """Pollinations first, then Pexels, then Pixabay.
+
+    width/height are the Pollinations size used when a request has no target_size.
+
+    Hedging is enabled with hedge=True or TURBOREEL_IMAGE_HEDGE=1, the percentile with
+    TURBOREEL_IMAGE_HEDGE_PERCENTILE (default 0.9).
+    """
+    if hedge is None:
+        hedge = os.getenv('TURBOREEL_IMAGE_HEDGE', '0') == '1'
+    return ImageAcquisition([
+        PollinationsProvider(width=width, height=height, timeout=timeout),
+        PexelsProvider(pexels_api_key),
+        PixabayProvider(pixabay_api_key),
+    ], hedge=hedge, hedge_percentile=float(os.getenv('TURBOREEL_IMAGE_HEDGE_PERCENTILE', 0.9)))
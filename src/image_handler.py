@@ -1,11 +1,19 @@
-import requests
-import pysrt  
+import httpx
 import logging
 import os
 import re
-from openai import OpenAI 
+import json
+import asyncio
+from openai import AsyncOpenAI
+
+from . import http_session
+from . import rate_limit
+from . import tracing
+from . import openai_session
+from .workspace import scratch_path
+from .captions.subtitles import Subtitles
+from .image_acquisition import PexelsProvider, PixabayProvider, default_acquisition, download_image
 import math
-import time
 
 from dotenv import load_dotenv  # To load environment variables
 
@@ -17,106 +25,25 @@ class ImageHandler:
         self.pexels_api_key = pexels_api_key
         self.openai_api_key = openai_api_key
         self.pixabay_api_key = os.getenv('PIXABAY_API_KEY') or ''
-        self.openai = OpenAI(api_key=self.openai_api_key)
         self.base_dir = os.path.dirname(os.path.abspath(__file__))
+        self.assets_dir = os.path.join(self.base_dir, '..', 'assets')
+        self.keywords_per_request = 15  # Phrases per refinement request, long videos are split into chunks
+        self.image_acquisition = default_acquisition(self.pexels_api_key, self.pixabay_api_key, width=1024, height=1024, timeout=15)
 
-    def generate_image_pollinations(self, query, width=1024, height=1024, model=None, seed=None, nologo=False, private=True, enhance=False, timeout=15):
-        """Generate an image using Pollinations AI API
-        
-        Args:
-            query (str): Text description of the image to generate
-            width (int, optional): Width of generated image. Defaults to 1024
-            height (int, optional): Height of generated image. Defaults to 1024
-            model (str, optional): Model to use for generation
-            seed (int, optional): Seed for reproducible results
-            nologo (bool, optional): Turn off logo rendering. Defaults to False
-            private (bool, optional): Prevent image from appearing in public feed. Defaults to True
-            enhance (bool, optional): Enable prompt enhancing via LLM. Defaults to False
-            timeout (int, optional): Maximum time to wait for image generation in seconds. Defaults to 15
-        
-        Returns:
-            list: List containing the generated image URL if successful, empty list otherwise
-        """
-        # Build query parameters
-        params = {
-            'width': width,
-            'height': height,
-            'nologo': str(nologo).lower(),
-            'private': str(private).lower(),
-            'enhance': str(enhance).lower()
-        }
-        if model:
-            params['model'] = model
-        if seed is not None:
-            params['seed'] = seed
-
-        # URL encode the prompt
-        encoded_query = requests.utils.quote(query)
-        generate_url = f"https://image.pollinations.ai/prompt/{encoded_query}"
+    @property
+    def openai(self) -> AsyncOpenAI:
+        # Looked up per call: clients are bound to the event loop that first used them
+        return openai_session.get_client(self.openai_api_key)
 
-        try:
-            full_url = requests.Request('GET', generate_url, params=params).prepare().url
-            response = requests.get(full_url, timeout=timeout)
-            if response.status_code == 200:
-                return [full_url]
-            return []
-        except Exception as e:
-            logging.error(f"Error generating image URL: {e}")
-            return []
-
-    def search_pexels_images(self, query):
+    async def search_pexels_images(self, query, target_size=None):
         """Search for images using Pexels API and return the URLs."""
-        search_url = "https://api.pexels.com/v1/search"
-
-        headers = {
-            'Authorization': self.pexels_api_key
-        }
-        
-        params = {
-            'query': query,
-            'per_page': 2
-        }
-        
-        try:
-            response = requests.get(search_url, headers=headers, params=params)
-            response.raise_for_status()  # Raise an error for bad responses
-        except requests.exceptions.HTTPError as e:
-            logging.error(f"HTTP error occurred: {e}")  # Log the error
-            return []  # Return an empty list on error
-        except Exception as e:
-            logging.error(f"An error occurred during the request: {e}")
-            return []
-
-        search_results = response.json()
-        image_urls = [photo['src']['original'] for photo in search_results.get('photos', [])]  # Extract image URLs
-        return image_urls
+        return await PexelsProvider(self.pexels_api_key).search(query, target_size)
 
-    def search_pixabay_images(self, query):
+    async def search_pixabay_images(self, query, target_size=None):
         """Search for images using Pixabay API and return the URLs."""
-        search_url = "https://pixabay.com/api/"
-        
-        params = {
-            'key': self.pixabay_api_key,
-            'q': query,
-            'image_type': 'all',
-            'per_page': 3
-        }
-        
-        try:
-            response = requests.get(search_url, params=params)
-            response.raise_for_status()  # Raise an error for bad responses
-        except requests.exceptions.HTTPError as e:
-            logging.error(f"HTTP error occurred: {e}")  # Log the error
-            return []  # Return an empty list on error
-        except Exception as e:
-            logging.error(f"An error occurred during the request: {e}")
-            return []
-
-        search_results = response.json()
-        image_urls = [hit['largeImageURL'] for hit in search_results.get('hits', [])]  # Extract image URLs
-        return image_urls
+        return await PixabayProvider(self.pixabay_api_key).search(query, target_size)
 
-    def search_google_images(self, query):
+    async def search_google_images(self, query):
         """Search for images using Google Custom Search API and return the URLs."""
         search_url = "https://customsearch.googleapis.com/customsearch/v1?"
         
@@ -129,9 +56,9 @@ class ImageHandler:
         }
         
         try:
-            response = requests.get(search_url, params=params)
+            response = await http_session.get(search_url, params=params)
             response.raise_for_status()  # Raise an error for bad responses
-        except requests.exceptions.HTTPError as e:
+        except httpx.HTTPStatusError as e:
             logging.error(f"HTTP error occurred: {e}")  # Log the error
             return []  # Return an empty list on error
         except Exception as e:
@@ -143,33 +70,21 @@ class ImageHandler:
         image_urls = [item['link'] for item in search_results.get('items', [])]  # Extract image URLs
         return image_urls
 
-    def download_image(self, url, filename):
+    async def download_image(self, url, filename):
         """Download an image from a URL."""
-        try:
-            response = requests.get(url, timeout=10)  # Timeout for network issues
-            response.raise_for_status()  # Raise for HTTP errors
-            
-            # Use absolute path for saving images
-            assets_dir = os.path.join(self.base_dir, '..', 'assets', 'images')
-            os.makedirs(assets_dir, exist_ok=True)  # Ensure directory exists
-            
-            full_path = os.path.join(assets_dir, filename)
-            with open(full_path, 'wb') as f:
-                f.write(response.content)
-            return full_path
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Failed to download image: {e}")
-        except Exception as e:
-            logging.error(f"Error while saving image: {e}")
-        return None
+        return await download_image(url, scratch_path(filename, 'images', default_dir=self.assets_dir), timeout=10)
+
+    def extract_keywords_from_subtitles(self, subtitles, video_duration):
+        """Extract key phrases from subtitles based on video duration.
 
-    def extract_keywords_from_subtitles(self, subtitles_file, video_duration):
-        """Extract key phrases from subtitles based on video duration."""
+        subtitles is a Subtitles object (or the path of an SRT file). There is one phrase per
+        time window, so phrase i matches the image shown at that time; windows without
+        speech reuse the nearest phrase.
+        """
         seconds_per_keyword = 5
         try:
-            subs = pysrt.open(subtitles_file)
-            keywords = []
-            current_text = []
+            if isinstance(subtitles, str):
+                subtitles = Subtitles.from_srt(subtitles)
             
             # Calculate the number of keywords we should extract
             num_keywords = math.ceil(video_duration / seconds_per_keyword)
@@ -177,20 +92,14 @@ class ImageHandler:
             # Calculate the duration for each keyword
             duration_per_keyword = video_duration / num_keywords
             
-            current_duration = 0
-            keyword_end_time = duration_per_keyword
-            
-            for sub in subs:
-                if sub.start.seconds < keyword_end_time:
-                    current_text.append(sub.text)
-                else:
-                    keywords.append(' '.join(current_text))
-                    current_text = [sub.text]
-                    keyword_end_time += duration_per_keyword
-
-            # Add any remaining text as the last keyword
-            if current_text:
-                keywords.append(' '.join(current_text))
+            # Cues are bucketed into their windows by bisecting the start times
+            keywords = [' '.join(texts) for texts in subtitles.windows(duration_per_keyword, video_duration)]
+            if not any(keywords):
+                return []
+            for i in range(1, len(keywords)):
+                keywords[i] = keywords[i] or keywords[i - 1]
+            first = next(keyword for keyword in keywords if keyword)
+            keywords = [keyword or first for keyword in keywords]
             
             logging.info(f"Extracted {len(keywords)} keywords from subtitles.")
             return keywords
@@ -198,76 +107,80 @@ class ImageHandler:
             logging.error(f"Error extracting keywords from subtitles: {e}")
             return []
 
-    def refine_keyword_with_openai(self, keyword, video_context):
-        """Refine the keyword using OpenAI's ChatGPT 3.5 for better image search results."""
+    @tracing.traced('openai.keywords')
+    async def refine_keywords_batch(self, keywords, video_context):
+        """Refine a list of phrases in one chat completion.
 
-        try:
-            completion = self.openai.chat.completions.create(  # Async call to create chat completion
-                model="gpt-3.5-turbo",  # Updated model name
+        Returns the refined queries aligned by index with keywords; any phrase the model
+        leaves out keeps its original text.
+        """
+        phrases = [{"id": index, "phrase": keyword} for index, keyword in enumerate(keywords)]
+        async with rate_limit.limit('openai'):
+            completion = await self.openai.chat.completions.create(
+                model="gpt-3.5-turbo",
                 temperature=0.25,
+                response_format={"type": "json_object"},
                 messages = [
                     {
                         'role': 'system',
                         'content': 
-                            '''You are a query generation system designed to enhance video automation. "
-                            Your task is to take provided phrases and generate concise queries that will assist in finding appropriate images for the given scene.
+                            '''You are a query generation system designed to enhance video automation.
+                            Your task is to take each provided phrase and generate a concise query that will assist in finding an appropriate image for that part of the video.
                             Always produce a short, clear query based on the original phrase and the context of the video.
-                            Example of ideal output: 'Sunset in California', 'Halloween costume', 'Friends meeting'.'''
+                            Example of ideal queries: 'Sunset in California', 'Halloween costume', 'Friends meeting'.
+                            Return one query per phrase, keeping its id, as a JSON object structured as follows:
+                            {"queries": [{"id": 0, "query": "query here"}]}'''
                     },
                     {
                         'role': 'user',
-                        'content': f'Original phrase: "{keyword}"\nVideo topic: {video_context}'
+                        'content': f'Video topic: {video_context}\nPhrases: {json.dumps(phrases)}'
                     }
                 ],
-                max_tokens=200
+                max_tokens=40 * len(keywords) + 100
             )
-            refined_keyword = completion.choices[0].message.content.strip()
-            return refined_keyword
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Error calling OpenAI API: {e}")
-            return keyword  # Return the original keyword on error
-
-    def get_images_from_subtitles(self, subtitles_file_path, video_context, video_duration):
-        """Fetch relevant images based on the subtitles and video duration."""
-        keywords = self.extract_keywords_from_subtitles(subtitles_file_path, video_duration)
-        image_paths = []
+        response_json = json.loads(completion.choices[0].message.content)
+
+        refined = list(keywords)
+        answered = set()
+        for item in response_json.get("queries", []):
+            if isinstance(item, dict) and isinstance(item.get("id"), int) and 0 <= item["id"] < len(keywords) and item.get("query"):
+                refined[item["id"]] = item["query"].strip()
+                answered.add(item["id"])
+        missing = len(keywords) - len(answered)
+        if missing:
+            logging.warning(f"{missing} of {len(keywords)} phrases came back without a refined query, using the original text.")
+        return refined
+
+    async def get_images_from_subtitles(self, subtitles, video_context, video_duration, target_size=None):
+        """Fetch relevant images based on the subtitles and video duration.
+
+        Keywords are refined in batches of keywords_per_request; every chunk is sent at once
+        and each image search starts as soon as its chunk's queries come back.
+        target_size is the (width, height) box the images are shown in, see VideoEditor.image_box.
+        """
+        keywords = self.extract_keywords_from_subtitles(subtitles, video_duration)
+        image_paths = [None] * len(keywords)  # None for failed image searches
 
-        for keyword in keywords:
+        async def fetch_image(index, refined_keyword):
+            logging.info(f"Searching image for keywords: {refined_keyword}")
+            # Pollinations -> Pexels -> Pixabay, the winning provider writes the file directly
+            safe_keyword = re.sub(r'[^a-zA-Z0-9_]', '', refined_keyword.replace(' ', '_').replace('"', ''))
+            img_path = scratch_path(f"subtitle_image_{index}_{safe_keyword}.jpg", 'images', default_dir=self.assets_dir)
             try:
-                refined_keyword = self.refine_keyword_with_openai(keyword, video_context)
+                image_paths[index] = await self.image_acquisition.acquire(refined_keyword, img_path, target_size)
             except Exception as e:
-                logging.error(f"Error refining keyword: {keyword}")
-                refined_keyword = keyword  # Use original keyword if refinement fails
-
-            logging.info(f"Searching image for keywords: {refined_keyword}")
+                logging.error(f"Error searching for images: {e}")
 
+        async def refine_chunk(start):
+            chunk = keywords[start:start + self.keywords_per_request]
             try:
-                ## Search for images using first Pollinations API
-                image_urls = self.generate_image_pollinations(refined_keyword)
-                if not image_urls:
-                    ## Search for images using Pexels API
-                    image_urls = self.search_pexels_images(refined_keyword)
-                    if not image_urls:
-                        ## Search for images using Pixabay API
-                        image_urls = self.search_pixabay_images(refined_keyword)
-                    logging.info(f"No images found on Pexels, searching on Pixabay: {image_urls}")
-                if not image_urls:
-                    logging.info(f"No images found on Pixabay")
+                refined_chunk = await self.refine_keywords_batch(chunk, video_context)
             except Exception as e:
-                logging.error(f"Error searching for images: {e}")
-                image_paths.append(None)  # Add None for failed image search
-                continue
+                logging.error(f"Error refining keywords {start}-{start + len(chunk) - 1}: {e}")
+                refined_chunk = chunk  # Use original keywords if refinement fails
+            return [asyncio.create_task(fetch_image(start + offset, query)) for offset, query in enumerate(refined_chunk)]
 
-            if image_urls:
-                refined_keyword = re.sub(r'[^a-zA-Z0-9_]', '', refined_keyword.replace(' ', '_').replace('"', ''))
-                img_filename = f"subtitle_image_{refined_keyword}.jpg"
-                logging.info(f"Downloading image: {image_urls[0]}")
-                downloaded_path = self.download_image(image_urls[0], img_filename)
-                if downloaded_path:
-                    image_paths.append(downloaded_path)
-                else:
-                    image_paths.append(None)  # Add None for failed download
-            else:
-                image_paths.append(None)  # Add None if no image URLs found
+        chunks = await asyncio.gather(*(refine_chunk(start) for start in range(0, len(keywords), self.keywords_per_request)))
+        await asyncio.gather(*(task for tasks in chunks for task in tasks))
 
         return image_paths
@@ -0,0 +1,130 @@
+import os
+import json
+import logging
+
+import httpx
+
+result_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'result')
+
+
+class JobClient:
+    """Small synchronous client of the job server (src/job_server.py), used by the Gradio UIs."""
+
+    def __init__(self, base_url: str = None, timeout: float = 30.0):
+        self.base_url = (base_url or os.getenv('TURBOREEL_JOB_SERVER', 'http://127.0.0.1:8000')).rstrip('/')
+        self.client = httpx.Client(base_url=self.base_url, timeout=timeout)
+
+    def submit(self, engine: str, params: dict) -> str:
+        """Queue a job and return its id.
+
+        Raises:
+            RuntimeError: If the server rejects the job (full queue, unknown engine...).
+        """
+        response = self.client.post('/jobs', json={'engine': engine, 'params': params})
+        if response.status_code != 202:
+            raise RuntimeError(response.json().get('detail', response.text))
+        return response.json()['job_id']
+
+    def upload(self, path: str) -> str:
+        """Upload a local file and return its path on the server."""
+        with open(path, 'rb') as f:
+            response = self.client.post('/uploads', files={'file': (os.path.basename(path), f)}, timeout=None)
+        response.raise_for_status()
+        return response.json()['path']
+
+    def events(self, job_id: str):
+        """Yield the job's progress events as dicts, until its 'done' event."""
+        with self.client.stream('GET', f'/jobs/{job_id}/events', timeout=None) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line.startswith('data:'):
+                    continue  # Event names, keep-alive comments and separators
+                event = json.loads(line[5:])
+                yield event
+                if event['type'] == 'done':
+                    return
+
+    def cancel(self, job_id: str):
+        """Cancel a queued or running job; a job that already finished is left alone."""
+        try:
+            self.client.delete(f'/jobs/{job_id}')
+        except httpx.HTTPError as e:
+            logging.warning(f"Could not cancel job {job_id}: {e}")
+
+    def download(self, job_id: str, result: dict) -> str:
+        """Local path of a job's video, downloading it when the server runs on another machine."""
+        path = result.get('output_path') or result.get('translated_video_path')
+        if path and os.path.exists(path):
+            return path
+        os.makedirs(result_dir, exist_ok=True)
+        local_path = os.path.abspath(os.path.join(result_dir, os.path.basename(path or f'{job_id}.mp4')))
+        with self.client.stream('GET', f'/jobs/{job_id}/video', timeout=None) as response:
+            response.raise_for_status()
+            with open(local_path, 'wb') as f:
+                for chunk in response.iter_bytes():
+                    f.write(chunk)
+        return local_path
+
+    def run(self, engine: str, params: dict):
+        """Submit a job and follow it, see follow()."""
+        try:
+            job_id = self.submit(engine, params)
+        except Exception as e:
+            logging.error(f"Could not submit the {engine} job: {e}")
+            yield {"status": "error", "message": str(e)}
+            return
+        yield from self.follow(job_id)
+
+    def follow(self, job_id: str):
+        """Follow a submitted job.
+
+        A generator for Gradio handlers: yields the progress log as text while the job runs,
+        then the result dict. The job is cancelled on the server if the generator is closed
+        before the job finishes.
+        """
+        finished = False
+        try:
+            log = [f"Job {job_id} queued"]
+            yield "\n".join(log)
+            for event in self.events(job_id):
+                if event['type'] == 'done':
+                    finished = True
+                    result = event.get('result') or {}
+                    if event['status'] != 'succeeded':
+                        yield {"status": "error", "message": event.get('error') or f"Job {event['status']}"}
+                        return
+                    if result.get('output_path') or result.get('translated_video_path'):
+                        result['output_path'] = self.download(job_id, result)
+                    yield result
+                    return
+                line = self._describe(event)
+                if line:
+                    log.append(line)
+                    yield "\n".join(log)
+        except Exception as e:
+            logging.error(f"Job {job_id} failed: {e}")
+            yield {"status": "error", "message": str(e)}
+        finally:
+            if not finished:
+                self.cancel(job_id)
+
+    @staticmethod
+    def _describe(event: dict) -> str:
+        """One log line for an event, or None for the ones not worth a line."""
+        if event['type'] == 'span':
+            attributes = event.get('attributes') or {}
+            if 'stage' in attributes:
+                label = f"[{attributes['pipeline']}] {attributes['stage']}"
+            elif event['state'] == 'started':
+                return None  # Provider calls, renders... are only logged when they end
+            else:
+                label = event['name']
+            line = f"{label} {event['state']}"
+            if event.get('duration') is not None:
+                line += f" in {event['duration']:.1f}s"
+            if event.get('error'):
+                line += f": {event['error']}"
+            return line
+        if event['type'] == 'status':
+            return f"Job {event['status']}"
+        return json.dumps(event, default=str)
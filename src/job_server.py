@@ -0,0 +1,522 @@
+"""
+Job server for all the video engines.
+
+Run it with:
+    python -m src.job_server
+
+Requests are queued (up to TURBOREEL_JOB_QUEUE jobs) and up to TURBOREEL_JOB_CONCURRENCY
+of them run at once on the server's event loop, so their network stages (LLM, TTS, image
+and download calls) overlap, and provider health, latency windows and keep-alive
+connections carry over from one job to the next. Only the moviepy/ffmpeg render calls
+leave the loop, for a pool of TURBOREEL_RENDER_WORKERS processes (see render_pool): a
+job waiting on the network never holds a render slot. Uploaded files are deleted once
+the last job that used them is over (or after TURBOREEL_UPLOAD_TTL seconds if no job
+claimed them).
+
+Endpoints:
+    POST /jobs                  {"engine": "reddit", "params": {...}} -> 202 {"job_id": ...}, 429 when the queue is full,
+                                422 for parameters the engine does not take or paths outside uploads/
+    GET  /jobs                  All known jobs
+    GET  /jobs/{job_id}         Status and result of a job
+    GET  /jobs/{job_id}/events  Server-sent events: job status and span starts/ends (pipeline stages,
+                                provider calls, renders...), ends with a 'done' event
+    DELETE /jobs/{job_id}       Cancel a queued (freeing its queue slot) or running job
+    GET  /jobs/{job_id}/video   The generated video
+    GET  /jobs/{job_id}/trace   Spans of a finished job: durations, bytes, cache hits and retries per stage and provider call
+    GET  /metrics               Span and queue aggregates in the Prometheus text format
+    POST /uploads               Upload a background or source video, returns its server path
+"""
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi.responses import StreamingResponse, FileResponse, JSONResponse, PlainTextResponse
+from pydantic import BaseModel, model_validator
+
+from . import tracing
+from . import render_pool
+
+logging.basicConfig(level=logging.INFO)
+
+# The parameters each engine takes from clients; requests with others are rejected
+ENGINE_PARAMS = {
+    'reddit': ('video_path_or_url', 'video_path', 'video_url', 'video_topic', 'background_id', 'background_min_duration',
+               'captions_settings', 'add_images'),
+    'ready_made': ('video_path_or_url', 'video_path', 'video_url', 'video_script', 'video_hook', 'background_id',
+                   'background_min_duration', 'captions_settings', 'add_images'),
+    'storytelling': ('is_instructions', 'script', 'instructions'),
+    'json2video': ('json_input',),
+    'translation': ('video_path', 'target_language', 'languages', 'multi_track'),
+}
+# Parameters naming a file on the server, which must have been sent to POST /uploads
+PATH_PARAMS = ('video_path',)
+ENGINES = tuple(ENGINE_PARAMS)
+FINISHED = ('succeeded', 'failed', 'cancelled')
+
+base_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+result_dir = os.path.join(base_dir, 'result')
+upload_dir = os.path.join(base_dir, 'uploads')
+
+
+class JobRequest(BaseModel):
+    engine: str
+    params: dict = {}
+
+    @model_validator(mode='after')
+    def check_params(self) -> 'JobRequest':
+        # A ValueError here is answered with a 422
+        self.params = _check_params(self.engine, self.params)
+        return self
+
+
+class Job:
+    """A generation request and everything the server knows about its progress."""
+
+    def __init__(self, engine: str, params: dict):
+        self.id = uuid.uuid4().hex[:12]
+        self.engine = engine
+        self.params = params
+        self.status = 'queued'
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.trace = None
+        self.events = []
+        self.task = None
+        self._updated = asyncio.Event()
+
+    def publish(self, event: dict):
+        event.setdefault('time', time.time())
+        self.events.append(event)
+        # Wake every follower, then start a fresh event for the next update
+        self._updated.set()
+        self._updated = asyncio.Event()
+
+    def set_status(self, status: str, **extra):
+        self.status = status
+        if status == 'running':
+            self.started_at = time.time()
+        elif status in FINISHED:
+            self.finished_at = time.time()
+        self.publish({'type': 'done' if status in FINISHED else 'status', 'status': status, **extra})
+
+    async def follow(self, keepalive: float = 15.0):
+        """Yield the job's events from the first one, then live ones until the job is done.
+
+        Yields None every keepalive seconds without news, so streams stay open behind proxies.
+        """
+        index = 0
+        while True:
+            while index < len(self.events):
+                yield self.events[index]
+                index += 1
+            if self.status in FINISHED:
+                return
+            try:
+                await asyncio.wait_for(self._updated.wait(), keepalive)
+            except asyncio.TimeoutError:
+                yield None
+
+    def summary(self) -> dict:
+        return {
+            'job_id': self.id,
+            'engine': self.engine,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'result': self.result,
+            'error': self.error,
+        }
+
+
+class JobManager:
+    """Bounded job queue, run on the server's event loop.
+
+    Up to `concurrency` jobs run at once, each as a task of the loop. Their renders go to
+    the render pool (render_workers processes, none to render in threads), so the number
+    of running jobs can be well above the number of renders the machine can take.
+    Cancelling a running job cancels its task (the job's workspace is removed on the way
+    out); a render it already started finishes in its worker and is discarded.
+    """
+
+    def __init__(self, concurrency: int = None, render_workers: int = None, max_queued: int = None, history: int = None,
+                 upload_ttl: float = None):
+        self.concurrency = concurrency or int(os.getenv('TURBOREEL_JOB_CONCURRENCY', 8))
+        if render_workers is None:
+            render_workers = int(os.getenv('TURBOREEL_RENDER_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+        self.render_workers = render_workers
+        self.max_queued = max_queued or int(os.getenv('TURBOREEL_JOB_QUEUE', 16))
+        self.history = history or int(os.getenv('TURBOREEL_JOB_HISTORY', 100))
+        # Uploads no job claimed (e.g. the submit failed) are deleted after this many seconds
+        self.upload_ttl = upload_ttl or float(os.getenv('TURBOREEL_UPLOAD_TTL', 24 * 3600))
+        self.jobs = {}
+        self.queue = None
+        self._tasks = []
+
+    async def start(self):
+        # Unbounded: submit() bounds the jobs still queued, so cancelled ones free their place at once
+        self.queue = asyncio.Queue()
+        render_pool.start(self.render_workers)
+        self._tasks = [asyncio.create_task(self._serve(), name=f"turboreel-job-slot-{i}") for i in range(self.concurrency)]
+        self._tasks.append(asyncio.create_task(self._sweep_uploads(), name="upload-sweeper"))
+        logging.info(f"Job server started: {self.concurrency} jobs at once, {self.render_workers} render workers, "
+                     f"a queue of {self.max_queued}")
+
+    async def stop(self):
+        running = [job.task for job in self.jobs.values() if job.task is not None and not job.task.done()]
+        for task in running + self._tasks:
+            task.cancel()
+        await asyncio.gather(*running, *self._tasks, return_exceptions=True)
+        render_pool.shutdown()
+
+    def queued(self) -> int:
+        """Jobs waiting for a slot; cancelled jobs left in the queue are not counted."""
+        return sum(job.status == 'queued' for job in self.jobs.values())
+
+    def submit(self, engine: str, params: dict) -> Job:
+        """Queue a job.
+
+        Raises:
+            ValueError: If the engine is unknown.
+            asyncio.QueueFull: If the queue is full.
+        """
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine {engine}, expected one of {', '.join(ENGINES)}.")
+        if self.queued() >= self.max_queued:
+            raise asyncio.QueueFull()
+        job = Job(engine, params)
+        self.jobs[job.id] = job
+        self.queue.put_nowait(job)
+        job.set_status('queued', position=self.queued())
+        self._trim_history()
+        return job
+
+    def cancel(self, job: Job) -> bool:
+        """Cancel a queued or running job. Returns False if it had already finished."""
+        if job.status in FINISHED:
+            return False
+        if job.status == 'running':
+            # _run marks the job cancelled once its task has unwound
+            job.task.cancel()
+        else:
+            # The slots skip it when they get to it, and it no longer counts against the queue
+            job.set_status('cancelled')
+        return True
+
+    def _trim_history(self):
+        finished = [job for job in self.jobs.values() if job.status in FINISHED]
+        for job in finished[:max(len(finished) - self.history, 0)]:
+            del self.jobs[job.id]
+
+    async def _serve(self):
+        while True:
+            job = await self.queue.get()
+            if job.status != 'queued':
+                continue  # Cancelled while queued
+            job.task = asyncio.create_task(self._run(job), name=f"job-{job.id}")
+            # wait() rather than await: cancelling the job must not cancel its slot
+            await asyncio.wait([job.task])
+
+    async def _run(self, job: Job):
+        job.set_status('running')
+        loop = asyncio.get_running_loop()
+        loop_thread = threading.get_ident()
+
+        def listen(event: dict):
+            # Spans also end in worker threads, whose events are handed to the loop (in order, before the stage's result)
+            if threading.get_ident() == loop_thread:
+                job.publish(event)
+            else:
+                loop.call_soon_threadsafe(job.publish, event)
+
+        tracing.span_listener.set(listen)
+        trace = tracing.Trace(job.id, job.engine)
+        cancelled = False
+        try:
+            with trace:
+                job.result = await _run_engine(job.id, job.engine, job.params)
+        except asyncio.CancelledError:
+            cancelled = True
+        except Exception as e:
+            logging.error(f"Job {job.id} failed: {e}")
+            job.error = str(e)
+        job.trace = trace.to_dict()
+        self._remove_uploads(job)
+
+        if cancelled:
+            job.set_status('cancelled')
+        elif isinstance(job.result, dict) and job.result.get('status') != 'error':
+            job.set_status('succeeded', result=job.result)
+        else:
+            if job.error is None:
+                job.error = (job.result or {}).get('message') or "The job returned no result"
+            job.set_status('failed', error=job.error, result=job.result)
+
+    def _claimed_uploads(self, exclude: Job = None) -> set:
+        """Uploads used by the queued and running jobs (but exclude)."""
+        return {
+            path for job in self.jobs.values() if job is not exclude and job.status not in FINISHED for path in _uploads_in(job.params)
+        }
+
+    def _remove_uploads(self, job: Job):
+        """Delete the uploaded files a finished job was given, unless another unfinished job uses them too."""
+        claimed = self._claimed_uploads(exclude=job)
+        for path in _uploads_in(job.params):
+            if path in claimed:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.warning(f"Could not delete upload {path}: {e}")
+
+    async def _sweep_uploads(self, interval: float = 600.0):
+        """Periodically delete old uploads no queued or running job refers to."""
+        while True:
+            if os.path.isdir(upload_dir):
+                claimed = self._claimed_uploads()
+                cutoff = time.time() - self.upload_ttl
+                for entry in os.scandir(upload_dir):
+                    path = os.path.abspath(entry.path)
+                    try:
+                        if entry.is_file() and path not in claimed and entry.stat().st_mtime < cutoff:
+                            os.remove(path)
+                            logging.info(f"Deleted unclaimed upload {path}")
+                    except OSError as e:
+                        logging.warning(f"Could not delete upload {path}: {e}")
+            await asyncio.sleep(interval)
+
+
+def _uploads_in(params) -> list:
+    """Paths under uploads/ among a job's parameters, including those nested in json2video inputs."""
+    root = os.path.abspath(upload_dir) + os.sep
+    if isinstance(params, dict):
+        return [path for value in params.values() for path in _uploads_in(value)]
+    if isinstance(params, list):
+        return [path for value in params for path in _uploads_in(value)]
+    if isinstance(params, str) and os.path.abspath(params).startswith(root):
+        return [os.path.abspath(params)]
+    return []
+
+
+def _within(path: str, directory: str) -> bool:
+    return os.path.realpath(path).startswith(os.path.realpath(directory) + os.sep)
+
+
+def _check_params(engine: str, params: dict) -> dict:
+    """Validate the parameters of a job request, returning the ones to run it with.
+
+    Raises:
+        ValueError: For an unknown engine, a parameter the engine does not take, or a
+            server path that is not under uploads/.
+    """
+    if engine not in ENGINE_PARAMS:
+        raise ValueError(f"Unknown engine {engine}, expected one of {', '.join(ENGINES)}.")
+    unknown = sorted(set(params) - set(ENGINE_PARAMS[engine]))
+    if unknown:
+        raise ValueError(f"Unknown parameters for {engine}: {', '.join(unknown)}.")
+    for name in PATH_PARAMS:
+        if params.get(name):
+            _check_upload(params[name], name)
+    if engine == 'json2video':
+        params = dict(params, json_input=_check_json_input(params.get('json_input')))
+    return params
+
+
+def _check_upload(path, name: str):
+    if not isinstance(path, str) or not _within(path, upload_dir):
+        raise ValueError(f"{name} must be the path of a file sent to POST /uploads.")
+
+
+def _check_json_input(json_input) -> dict:
+    """The json2video input as a dict, once every local file it names is checked to be an upload."""
+    if isinstance(json_input, str):
+        _check_upload(json_input, 'json_input')
+        try:
+            with open(json_input) as f:
+                json_input = json.load(f)
+        except OSError as e:
+            raise ValueError(f"Could not read json_input: {e}")
+    if not isinstance(json_input, dict):
+        raise ValueError("json_input must be a JSON object or an uploaded JSON file.")
+    files = [('videos', 'video_path'), ('audio', 'audio_path'), ('images', 'source_content')]
+    for key, field in files:
+        for item in json_input.get(key) or []:
+            if not isinstance(item, dict):
+                raise ValueError(f"json_input {key} must be objects.")
+            if key != 'images' or item.get('source_type') == 'path':
+                _check_upload(item.get(field), f"json_input {key}[].{field}")
+    return json_input
+
+
+# --- Engines ---------------------------------------------------------------------------
+
+async def _run_engine(job_id: str, engine: str, params: dict) -> dict:
+    from .workspace import Workspace
+
+    async with Workspace(job_id=job_id):
+        if engine == 'reddit':
+            from .reddit_story_engine import RedditStoryGenerator
+            return await RedditStoryGenerator().generate_video(**params)
+
+        if engine == 'ready_made':
+            from .ready_made_script_engine import ReadyMadeScriptGenerator
+            return await ReadyMadeScriptGenerator().generate_video(**params)
+
+        if engine == 'storytelling':
+            from .story_telling_engine import StoryTellingEngine
+            output = await StoryTellingEngine().generate_video(**params)
+            if isinstance(output, dict):
+                return output
+            return {"status": "success", "message": "Video generated successfully.", "output_path": output}
+
+        if engine == 'json2video':
+            from .json_2_video_engine.json_2_video import convert_json_to_video
+            # The server picks the output file: results are served back, so clients must not choose where they go
+            output_path = os.path.join(os.path.abspath(result_dir), f"output_{uuid.uuid4()}.mp4")
+            output = await render_pool.run(convert_json_to_video, params['json_input'], output_path)
+            return {"status": "success", "message": "Video generated successfully.", "output_path": output}
+
+        if engine == 'translation':
+            from .translation.translation_engine import TranslationEngine
+            if params.get('languages'):
+                return await TranslationEngine().translate_video_multi(**params)
+            return await TranslationEngine().translate_video(**params)
+
+    raise ValueError(f"Unknown engine {engine}")
+
+
+# --- HTTP API ---------------------------------------------------------------------------
+
+manager = JobManager()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await manager.start()
+    try:
+        yield
+    finally:
+        await manager.stop()
+
+
+app = FastAPI(title="TurboReel job server", lifespan=lifespan)
+
+
+def _get_job(job_id: str) -> Job:
+    job = manager.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return job
+
+
+@app.post("/jobs", status_code=202)
+async def create_job(request: JobRequest):
+    try:
+        job = manager.submit(request.engine, request.params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except asyncio.QueueFull:
+        return JSONResponse(
+            status_code=429,
+            content={"detail": f"The job queue is full ({manager.max_queued} jobs), try again later."},
+            headers={"Retry-After": "30"},
+        )
+    return {"job_id": job.id, "status": job.status, "position": manager.queued()}
+
+
+@app.get("/jobs")
+async def list_jobs():
+    return [job.summary() for job in manager.jobs.values()]
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    return _get_job(job_id).summary()
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    job = _get_job(job_id)
+
+    async def stream():
+        async for event in job.follow():
+            if event is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    job = _get_job(job_id)
+    if not manager.cancel(job):
+        raise HTTPException(status_code=409, detail=f"Job {job_id} already {job.status}")
+    return {"job_id": job.id, "status": job.status}
+
+
+@app.get("/jobs/{job_id}/video")
+async def job_video(job_id: str):
+    job = _get_job(job_id)
+    result = job.result or {}
+    path = result.get('output_path') or result.get('translated_video_path')
+    if job.status != 'succeeded' or not path or not os.path.exists(path) or not _within(path, result_dir):
+        raise HTTPException(status_code=404, detail=f"Job {job_id} has no video")
+    return FileResponse(path, media_type="video/mp4", filename=os.path.basename(path))
+
+
+@app.get("/jobs/{job_id}/trace")
+async def job_trace(job_id: str):
+    job = _get_job(job_id)
+    if job.trace is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} has no trace yet")
+    return job.trace
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    counts = {status: 0 for status in ('queued', 'running') + FINISHED}
+    for job in manager.jobs.values():
+        counts[job.status] += 1
+    lines = [
+        "# HELP turboreel_jobs Jobs known to the server, by status.",
+        "# TYPE turboreel_jobs gauge",
+        *(f'turboreel_jobs{{status="{status}"}} {count}' for status, count in counts.items()),
+        "# HELP turboreel_job_queue_capacity Maximum number of queued jobs.",
+        "# TYPE turboreel_job_queue_capacity gauge",
+        f"turboreel_job_queue_capacity {manager.max_queued}",
+    ]
+    return PlainTextResponse("\n".join(lines) + "\n" + tracing.metrics.prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/uploads")
+async def upload_video(file: UploadFile = File(...)):
+    os.makedirs(upload_dir, exist_ok=True)
+    extension = os.path.splitext(file.filename or '')[1].lower()[:8]
+    path = os.path.abspath(os.path.join(upload_dir, f"{uuid.uuid4().hex}{extension}"))
+    with open(path, 'wb') as f:
+        while chunk := await file.read(1 << 20):
+            f.write(chunk)
+    return {"path": path}
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(
+        app,
+        host=os.getenv('TURBOREEL_JOB_SERVER_HOST', '127.0.0.1'),
+        port=int(os.getenv('TURBOREEL_JOB_SERVER_PORT', 8000)),
+    )
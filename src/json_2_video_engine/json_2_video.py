@@ -1,5 +1,6 @@
 import json
 import os
+import asyncio
 import logging
 import uuid
 import math
@@ -10,10 +11,22 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 from .utils.llm_calls import generate_voice
-from .utils.images_generation import search_pexels_images, search_pixabay_images, download_image, generate_image_pollinations
+from .utils.images_generation import download_image, acquire_image
+from ..image_acquisition import load_image
+from ..workspace import scratch_path, scoped
+from .. import tracing
 
 from ..captions.caption_handler import CaptionHandler
 
+def convert_json_to_video(json_input, output_video_path: str) -> str:
+    """Run a whole conversion on its own event loop; a module-level entry point for render_pool.run.
+
+    PyJson2Video builds and encodes its clips in between the voice and image fetches, so the
+    job server sends the conversion to a render worker as a whole.
+    """
+    return asyncio.run(PyJson2Video(json_input, output_video_path).convert())
+
+
 class PyJson2Video:
 
     def __init__(self, json_input, output_video_path: str):
@@ -25,18 +38,27 @@ class PyJson2Video:
         self.caption_handler = CaptionHandler()
         self.temp_files = []  # Add this to track all temporary files
 
+    @scoped
+    @tracing.traced('json2video.convert')
     async def convert(self):
         try:
-            self._load_json()
-            await self.parse_script()
-            self.parse_videos()
-            await self.parse_images()
-            self.parse_audio()
-            self.parse_text()
+            with tracing.span('json2video.load_json'):
+                self._load_json()
+            with tracing.span('json2video.script'):
+                await self.parse_script()
+            with tracing.span('json2video.videos'):
+                self.parse_videos()
+            with tracing.span('json2video.images'):
+                await self.parse_images()
+            with tracing.span('json2video.audio'):
+                self.parse_audio()
+            with tracing.span('json2video.text'):
+                self.parse_text()
             
             extra_args = self.parse_extra_args()
             
-            return await self._create_final_clip(extra_args)
+            with tracing.span('json2video.render'):
+                return await self._create_final_clip(extra_args)
         except Exception as e:
             logger.error(f"An error occurred during conversion: {str(e)}")
             raise
@@ -76,9 +98,9 @@ class PyJson2Video:
                 if not video['video_path'].lower().endswith('.mp4'):
                     raise ValueError(f"Invalid video format. Only MP4 files are supported: {video['video_path']}")
                 
-                clip = VideoFileClip(video['video_path'])
+                # ffmpeg scales while decoding, instead of a Python resize of every full-size frame
+                clip = VideoFileClip(video['video_path'], target_resolution=(int(resolution['height']), None))
                 clip = clip.subclip(float(video['start_time']), float(video['end_time']))
-                clip = clip.resize(height=int(resolution['height']))
                 
                 # Handle position
                 position = video.get('position', [50, 50])  # Default to center if not specified
@@ -119,48 +141,41 @@ class PyJson2Video:
             source_type = image.get('source_type', 'prompt')
             
             try:
+                # Handle 'full' argument and determine target dimensions
+                if image.get('max_width') == 'full':
+                    target_width = max_width
+                else:
+                    target_width = min(int(image.get('max_width', max_width)), max_width)
+
+                if image.get('max_height') == 'full':
+                    target_height = max_height
+                else:
+                    target_height = min(int(image.get('max_height', max_height)), max_height)
+
+                # On-screen box including the 10% zoom, so providers and the decoder never go bigger
+                target_size = (math.ceil(target_width * 1.1), math.ceil(target_height * 1.1))
+
                 # Get image source
                 image_source = None
-                image_urls = []
                 
                 if source_type == 'path':
                     image_source = image['source_content']
                 elif source_type == 'prompt':
                     query = image['source_content']
-                    # Try different image sources in sequence
-                    image_urls = generate_image_pollinations(query)
-                    if not image_urls:
-                        logger.info("Trying Pexels as fallback...")
-                        image_urls = search_pexels_images(query)
-                    if not image_urls:
-                        logger.info("Trying Pixabay as final fallback...")
-                        image_urls = search_pixabay_images(query)
-                    
-                    if image_urls:
-                        image_source = download_image(image_urls[0])
-                        if image_source:
-                            self.temp_files.append(image_source)  # Track downloaded image
+                    # Pollinations -> Pexels -> Pixabay, fetched once straight to disk
+                    image_source = await acquire_image(query, target_size)
+                    if image_source:
+                        self.temp_files.append(image_source)  # Track downloaded image
                     else:
                         logger.error(f"No images found for prompt: {query}")
                         continue
                 elif source_type == 'url':
-                    image_source = download_image(image['source_content'])
+                    image_source = await download_image(image['source_content'])
                     if image_source:
                         self.temp_files.append(image_source)  # Track downloaded image
 
-                # Create and process the image clip
-                clip = ImageClip(image_source)
-                
-                # Handle 'full' argument and determine target dimensions
-                if image.get('max_width') == 'full':
-                    target_width = max_width
-                else:
-                    target_width = min(int(image.get('max_width', max_width)), max_width)
-
-                if image.get('max_height') == 'full':
-                    target_height = max_height
-                else:
-                    target_height = min(int(image.get('max_height', max_height)), max_height)
+                # Create and process the image clip, decoded straight to the target size
+                clip = ImageClip(load_image(image_source, target_size))
 
                 # Calculate the scaling factor to maintain aspect ratio with 10% zoom
                 width_ratio = (target_width / clip.w) * 1.1  # 10% zoom
@@ -371,21 +386,21 @@ class PyJson2Video:
                     final_audio = concatenate_audioclips(script_audio_clips)
                     
                     # Save the concatenated audio temporarily
-                    temp_audio_path = os.path.join(os.path.dirname(__file__), 'assets', f"temp_combined_audio_{uuid.uuid4()}.wav")
+                    temp_audio_path = scratch_path(f"temp_combined_audio_{uuid.uuid4()}.wav", default_dir=os.path.join(os.path.dirname(__file__), 'assets'))
                     temp_files.append(temp_audio_path)  # Track for cleanup
                     final_audio.write_audiofile(temp_audio_path)
                     
                     # Generate captions
-                    subtitles_path, subtitle_clips = await self.caption_handler.process(
+                    _, subtitle_clips = await self.caption_handler.process(
                         temp_audio_path,
                         captions_settings.get('color', 'white'),
                         captions_settings.get('background_color', 'black'),
                         captions_settings.get('font_size', resolution['height'] * 0.05),
                         captions_settings.get('font', 'LEMONMILK-Bold.otf'),
-                        resolution['width']
+                        resolution['width'],
+                        style=captions_settings.get('style', 'chunks'),
+                        highlight_color=captions_settings.get('highlight_color', 'yellow')
                     )
-                    if subtitles_path:
-                        temp_files.append(subtitles_path)  # Track for cleanup
                     
                     self.video_clips.extend(subtitle_clips)
             
@@ -401,13 +416,16 @@ class PyJson2Video:
                 final_clip = final_clip.set_audio(final_audio)
             
             # Write the final video file
-            final_clip.write_videofile(
-                self.output_video_path,
-                fps=30,
-                codec='libx264',
-                preset='veryfast',
-                audio_codec='aac'
-            )
+            with tracing.span('encode') as span:
+                final_clip.write_videofile(
+                    self.output_video_path,
+                    fps=30,
+                    codec='libx264',
+                    preset='veryfast',
+                    audio_codec='aac',
+                    temp_audiofile=scratch_path(f"temp_final_audio_{uuid.uuid4()}.m4a", default_dir=os.path.dirname(os.path.abspath(self.output_video_path)))
+                )
+                span.add(bytes=os.path.getsize(self.output_video_path))
 
             # Close all clips to free up resources
             final_clip.close()
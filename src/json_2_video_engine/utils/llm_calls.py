@@ -2,27 +2,30 @@ import os
 import uuid
 import logging
 from dotenv import load_dotenv
-from openai import OpenAI
+
+from ...workspace import scratch_path
+from ... import tracing
+from ... import openai_session
 
 # Load environment variables from .env file
 load_dotenv()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
+@tracing.traced('openai.tts')
 async def generate_voice(script):
     try:
         unique_id = uuid.uuid4()
-        assets_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'assets', 'audios')
-        os.makedirs(assets_dir, exist_ok=True)
-        speech_file_path = os.path.join(assets_dir, f"voice_{unique_id}.mp3")
+        assets_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'assets')
+        speech_file_path = scratch_path(f"voice_{unique_id}.mp3", 'audios', default_dir=assets_dir)
         
-        response = client.audio.speech.create(
+        async with openai_session.get_client().audio.speech.with_streaming_response.create(
             model="tts-1",
             voice="echo",
             input=script
-        )
-        response.stream_to_file(speech_file_path)
+        ) as response:
+            await response.stream_to_file(speech_file_path)
+        tracing.record(bytes=os.path.getsize(speech_file_path))
         logging.info("Voice generated successfully.")
         return speech_file_path
     except Exception as e:
         logging.error(f"Error generating voice: {e}")
+        tracing.record_error(e)
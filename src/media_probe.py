@@ -0,0 +1,74 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+
+import mutagen
+
+from .ffmpeg_tools import video_info, run_ffprobe, ffprobe_exe
+
+# Probes are cached by (path, size, mtime, kind), so a rewritten file is probed again and an
+# audio probe (no size) is never returned for a video request
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+MAX_ENTRIES = 1024
+
+stats = {'hits': 0, 'misses': 0}
+
+
+def _key(path: str, kind: str) -> tuple:
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_size, stat.st_mtime_ns, kind
+
+
+def _probe_audio(path: str) -> dict:
+    # mutagen reads the duration from the headers (mp3, m4a, wav, ogg, flac...) without starting a process
+    try:
+        audio = mutagen.File(path)
+        if audio is not None and audio.info and getattr(audio.info, 'length', 0):
+            return {'duration': float(audio.info.length), 'width': 0, 'height': 0, 'fps': 0.0, 'has_video': False}
+    except Exception as e:
+        logging.debug(f"mutagen could not read {path}: {e}")
+    if ffprobe_exe():
+        probe = run_ffprobe(['-show_entries', 'format=duration', path])
+        return {'duration': float(probe.get('format', {}).get('duration') or 0.0), 'width': 0, 'height': 0, 'fps': 0.0, 'has_video': False}
+    return None
+
+
+def probe(path: str, kind: str = 'auto') -> dict:
+    """Duration, width, height, fps and has_video of a media file, from its headers only.
+
+    kind is 'audio', 'video' or 'auto' (audio first for common audio extensions).
+    Audio goes through mutagen, video through ffprobe (or moviepy's header parse).
+    """
+    if kind == 'auto':
+        kind = 'audio' if os.path.splitext(path)[1].lower() in ('.mp3', '.m4a', '.aac', '.wav', '.ogg', '.opus', '.flac') else 'video'
+    key = _key(path, kind)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            stats['hits'] += 1
+            return dict(_cache[key])
+        stats['misses'] += 1
+
+    info = _probe_audio(path) if kind == 'audio' else None
+    if info is None:
+        info = video_info(path)
+        info['has_video'] = info['width'] > 0
+
+    with _cache_lock:
+        _cache[key] = info
+        while len(_cache) > MAX_ENTRIES:
+            _cache.popitem(last=False)
+    return dict(info)
+
+
+def duration(path: str) -> float:
+    """Duration of an audio or video file in seconds."""
+    return probe(path)['duration']
+
+
+def video_size(path: str) -> tuple:
+    """(width, height) of a video file."""
+    info = probe(path, 'video')
+    return info['width'], info['height']
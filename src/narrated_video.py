@@ -0,0 +1,252 @@
+import os
+import logging
+
+from moviepy.editor import AudioFileClip, CompositeVideoClip, TextClip
+
+from .pipeline import Pipeline
+from .video_editor import VideoEditor
+from .captions.caption_handler import CaptionHandler
+from . import media_probe
+from . import render_pool
+from . import tracing
+
+
+def hook_text_clip(text: str, duration: float, video_height: int = 720) -> TextClip:
+    """The white box showing the hook (or Reddit question) over the background for duration seconds."""
+    # Calculate text clip size based on video width
+    text_width = int((video_height * 9 / 16) * 0.7)  # 90% of video width after cropped to 9/16
+    text_height = int(text_width * 0.35)  # 30% of cropped video width
+
+    return TextClip(
+        text,
+        fontsize=int(video_height * 0.03),  # 2.5% of video height for font size
+        color='black',
+        bg_color='white',
+        size=(text_width, text_height),  # Allow height to adjust automatically
+        method='caption',
+        align='center'
+    ).set_duration(duration)
+
+
+class NarratedVideo:
+    """The stages shared by the engines narrating a hook, then a story, over a background video.
+
+    The engine adds the stages that produce its texts, 'hook', 'story' and 'image_context'
+    (what the story images should be about), then add_stages() completes the graph:
+    background source and section, both voice-overs, transcription, subtitles, images
+    and render. The render gets plain data and goes through render_pool, so in the job
+    server it runs in a render worker while other jobs' stages wait on the network. Call
+    close() once the pipeline is done, ideally in a finally block: it releases the
+    background sections the stages used.
+
+    Example:
+        video = NarratedVideo(self.video_editor, self.image_handler, self.caption_handler, 'video_url', video_url=url)
+        pipeline = Pipeline('ready_made')
+        pipeline.add('hook', hook)
+        pipeline.add('story', story)
+        pipeline.add('image_context', summary)
+        results = await video.add_stages(pipeline).run()
+    """
+
+    def __init__(self, video_editor, image_handler, caption_handler,
+                 video_path_or_url: str, video_path: str = '', video_url: str = '',
+                 background_id: str = '', background_min_duration: float = 60.0,
+                 captions_settings: dict = None, add_images: bool = True):
+        self.video_editor = video_editor
+        self.image_handler = image_handler
+        self.caption_handler = caption_handler
+        self.video_path_or_url = video_path_or_url
+        self.video_path = video_path
+        self.video_url = video_url
+        self.background_id = background_id
+        self.background_min_duration = background_min_duration
+        self.captions_settings = captions_settings or {}
+        self.add_images = add_images
+        self.leases = []  # Background sections this job renders from, kept from being trimmed until it is done
+
+    def add_stages(self, pipeline: Pipeline) -> Pipeline:
+        """Add the shared stages after the engine's 'hook', 'story' and 'image_context' stages."""
+        pipeline.add('source', self.source, blocking=True)
+        pipeline.add('hook_audio', self.hook_audio, deps=['hook'])
+        pipeline.add('story_audio', self.story_audio, deps=['story'])
+        pipeline.add('background', self.background, deps=['source', 'hook_audio', 'story_audio'], blocking=True)
+        pipeline.add('words', self.words, deps=['story_audio'])
+        pipeline.add('subtitles', self.subtitles, deps=['words', 'story_audio'])
+        pipeline.add('images', self.images, deps=['subtitles', 'image_context', 'story_audio', 'source'])
+        pipeline.add('render', self.render, deps=['hook', 'hook_audio', 'story_audio', 'background', 'subtitles', 'words', 'images', 'source'])
+        return pipeline
+
+    def source(self) -> dict:
+        # Where the background comes from and its size; full downloads start right away
+        if self.video_path_or_url == 'library':
+            # Indexed backgrounds come with their metadata, no probe or download needed
+            background = self.video_editor.library_background(self.background_id, self.background_min_duration)
+            if not background:
+                raise ValueError("No matching background in the library.")
+            return {'path': background['path'], 'reused': True, 'resolved': None, 'width': background['width'], 'height': background['height']}
+        if self.video_path_or_url == 'video_url' and self.video_editor.download_mode == 'section':
+            # Metadata only; the section is downloaded once the narration length is known
+            resolved = self.video_editor.resolve_video_url(self.video_url)
+            if not resolved:
+                raise RuntimeError("Failed to resolve video URL.")
+            return {'path': None, 'reused': False, 'resolved': resolved, 'width': resolved['width'], 'height': resolved['height']}
+        if self.video_path_or_url == 'video_path':
+            path, reused = self.video_path, False
+        else:
+            entry = self.video_editor.download_video(self.video_url)
+            path, reused = (entry['path'], entry['reused']) if entry else (None, False)
+        if not path:
+            raise RuntimeError("Failed to download video.")
+        # Get video dimensions from the headers, without starting a decoder
+        width, height = media_probe.video_size(path)
+        return {'path': path, 'reused': reused, 'resolved': None, 'width': width, 'height': height}
+
+    async def voice(self, text: str) -> dict:
+        audio_path = await self.video_editor.generate_voice(text)
+        if not audio_path:
+            raise RuntimeError("Failed to generate audio.")
+        # The clip itself is only opened for the render
+        return {'path': audio_path, 'duration': media_probe.duration(audio_path)}
+
+    async def hook_audio(self, hook: str) -> dict:
+        return await self.voice(hook)
+
+    async def story_audio(self, story: str) -> dict:
+        return await self.voice(story)
+
+    def background(self, source: dict, hook_audio: dict, story_audio: dict) -> dict:
+        duration = hook_audio['duration'] + story_audio['duration']
+        path, reused = source['path'], source['reused']
+        if source['resolved']:
+            section = self.video_editor.download_video_section(source['resolved'], duration)
+            if not section:
+                raise RuntimeError("Failed to download video.")
+            path, reused = section['path'], section['reused']
+            self.leases.append(section['lease_id'])
+        # Reused backgrounds are read from their 9:16 proxy at output size and one-shot ones have only
+        # this section cropped and scaled by ffmpeg (in the render), so no frame is cropped or scaled in Python
+        path = self.video_editor.vertical_background(path, source['height'], reused)
+        # Keyframe-aligned start; backgrounds shorter than the narration are looped
+        start_time = self.video_editor.pick_background_start(path, self.video_editor.background_library.duration_of(path), duration)
+        return {'path': path, 'start': start_time, 'end': start_time + duration, 'vertical_height': None if reused else source['height']}
+
+    async def words(self, story_audio: dict) -> list:
+        # One transcription for both the subtitles and the karaoke captions
+        try:
+            return await self.caption_handler.subtitle_generator.transcribe_words(story_audio['path'])
+        except Exception as e:
+            logging.error(f"Error transcribing the story: {e}")
+            tracing.record_error(e)
+            return []
+
+    async def subtitles(self, words: list, story_audio: dict):
+        return await self.caption_handler.subtitle_generator.generate_subtitles(story_audio['path'], words=words)
+
+    async def images(self, subtitles: str, image_context: str, story_audio: dict, source: dict) -> list:
+        if not self.add_images:
+            return []
+        image_box = self.video_editor.image_box(*self.video_editor.vertical_size(source['height']))
+        return await self.image_handler.get_images_from_subtitles(subtitles, image_context, story_audio['duration'], image_box)
+
+    async def render(self, hook: str, hook_audio: dict, story_audio: dict, background: dict, subtitles, words: list,
+                     images: list, source: dict) -> str:
+        # Plain data only: the render may run in a render worker process, where it opens every clip itself
+        spec = {
+            'hook': hook,
+            'hook_audio': hook_audio,
+            'story_audio': story_audio,
+            'background': background,
+            'subtitles': subtitles,
+            'words': words,
+            'images': images,
+            'width': source['width'],
+            'height': source['height'],
+            'captions_settings': self.captions_settings,
+        }
+        return await render_pool.run(render_narrated_video, spec)
+
+    def cleanup(self, results: dict):
+        """Remove the voice-overs and images of a finished run; the render removes its background cut."""
+        self.video_editor.cleanup_files([
+            results['story_audio']['path'],
+            results['hook_audio']['path']
+        ], [path for path in results['images'] if path])  # None for failed image searches
+
+    def close(self):
+        """Release the background sections the stages used."""
+        for lease_id in self.leases:
+            self.video_editor.background_library.release(lease_id)
+        self.leases = []
+
+
+def render_narrated_video(spec: dict) -> str:
+    """Cut the background, build the hook, caption and image clips and encode the video.
+
+    spec is built by NarratedVideo.render. Every clip is opened and closed here, so that
+    render_pool can run this in a render worker. Returns the path of the video.
+    """
+    video_editor = VideoEditor()
+    background = spec['background']
+    background_clip, cut_path = video_editor.cut_background(
+        background['path'], background['start'], background['end'], vertical_height=background['vertical_height']
+    )
+    hook_audio_duration = spec['hook_audio']['duration']
+    hook_audio_clip = AudioFileClip(spec['hook_audio']['path'])
+    story_audio_clip = AudioFileClip(spec['story_audio']['path'])
+    try:
+        hook_clip = hook_text_clip(spec['hook'], hook_audio_duration, spec['height'])
+        captions = _caption_clips(spec)
+
+        """ Handle hook video """
+        hook_video = background_clip.subclip(0, hook_audio_duration)
+        hook_video = hook_video.set_audio(hook_audio_clip)
+        hook_video = video_editor.crop_video_9_16(hook_video)
+
+        # Add the text clip to the video
+        hook_video = CompositeVideoClip([
+            hook_video,
+            hook_clip.set_position(('center', 'center'))
+        ])
+
+        """ Handle story video """
+        story_video = background_clip.subclip(hook_audio_duration)
+        story_video = story_video.set_audio(story_audio_clip)
+        story_video = video_editor.crop_video_9_16(story_video)
+        story_video = video_editor.add_images_to_video(story_video, spec['images'])
+        story_video = video_editor.add_captions_to_video(story_video, captions)
+
+        # Combine clips
+        combined_clips = CompositeVideoClip([
+            hook_video,
+            story_video.set_start(hook_audio_duration)
+        ])
+        return video_editor.render_final_video(combined_clips)
+    finally:
+        for clip in (background_clip, hook_audio_clip, story_audio_clip):
+            clip.close()
+        if cut_path and os.path.exists(cut_path):
+            os.remove(cut_path)
+
+
+def _caption_clips(spec: dict) -> list:
+    captions_settings = spec['captions_settings']
+    caption_handler = CaptionHandler()
+    font_size = spec['width'] * 0.025
+    if captions_settings.get('style') == 'karaoke':
+        # The subtitles' own word timings; lines wrap to the 9:16 frame
+        return caption_handler.word_highlight(
+            spec['words'],
+            captions_settings.get('color', 'white'),
+            captions_settings.get('shadow_color', 'black'),
+            captions_settings.get('font_size', font_size),
+            captions_settings.get('font', 'LEMONMILK-Bold.otf'),
+            width=VideoEditor.vertical_size(spec['height'])[0],
+            highlight_color=captions_settings.get('highlight_color', 'yellow')
+        )
+    return caption_handler.render(
+        spec['subtitles'],
+        captions_settings.get('color', 'white'),
+        captions_settings.get('shadow_color', 'black'),
+        captions_settings.get('font_size', font_size),
+        captions_settings.get('font', 'LEMONMILK-Bold.otf')
+    )
@@ -0,0 +1,23 @@
+import os
+import asyncio
+import weakref
+
+from openai import AsyncOpenAI
+
+from . import tracing
+
+# AsyncOpenAI pools httpx connections, which are bound to the loop that opened them, so keep
+# one client per running loop (a second asyncio.run() must not reuse the first loop's pool)
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_client(api_key: str = None) -> AsyncOpenAI:
+    """Return the AsyncOpenAI client for the running event loop and API key."""
+    loop = asyncio.get_running_loop()
+    clients = _clients.setdefault(loop, {})
+    api_key = api_key or os.getenv('OPENAI_API_KEY')
+    client = clients.get(api_key)
+    if client is None or client.is_closed():
+        client = AsyncOpenAI(api_key=api_key, http_client=tracing.openai_http_client())
+        clients[api_key] = client
+    return client
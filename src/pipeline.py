@@ -0,0 +1,122 @@
+import time
+import asyncio
+import logging
+
+from . import tracing
+
+
+class Stage:
+    """One step of a Pipeline: func is called with the results of its deps as keyword arguments."""
+
+    def __init__(self, name: str, func, deps: tuple = (), blocking: bool = False):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.blocking = blocking  # Run in a worker thread (moviepy, ffmpeg, yt-dlp...) instead of on the event loop
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def duration(self) -> float:
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+
+class Pipeline:
+    """A small dependency graph of stages, run by asyncio.
+
+    Every stage starts as soon as all the stages it depends on have finished, so
+    independent stages (e.g. two TTS calls and a download) run concurrently. Stages must
+    be added after their dependencies. If a stage fails, the others are cancelled and
+    the error is raised from run().
+
+    Example:
+        pipeline = Pipeline('reddit')
+        pipeline.add('script', generate_script)
+        pipeline.add('voice', lambda script: generate_voice(script['story']), deps=['script'])
+        results = await pipeline.run()
+    """
+
+    def __init__(self, name: str = 'pipeline'):
+        self.name = name
+        self.stages = {}
+        self.results = {}
+        self.started_at = None
+        self.finished_at = None
+        self.critical_path = []
+
+    def add(self, name: str, func, deps: list = (), blocking: bool = False) -> 'Pipeline':
+        if name in self.stages:
+            raise ValueError(f"Stage {name} is already defined.")
+        unknown = [dep for dep in deps if dep not in self.stages]
+        if unknown:
+            raise ValueError(f"Stage {name} depends on undefined stages: {unknown}")
+        self.stages[name] = Stage(name, func, deps, blocking)
+        return self
+
+    async def _run_stage(self, stage: Stage, tasks: dict):
+        inputs = {dep: await tasks[dep] for dep in stage.deps}
+        stage.started_at = time.monotonic()
+        logging.info(f"[{self.name}] {stage.name} started")
+        # Stage progress reaches the job server's clients as this span's start and end events
+        with tracing.span(f"{self.name}.{stage.name}", pipeline=self.name, stage=stage.name):
+            if stage.blocking:
+                result = await asyncio.to_thread(stage.func, **inputs)
+            else:
+                result = await stage.func(**inputs)
+        stage.finished_at = time.monotonic()
+        logging.info(f"[{self.name}] {stage.name} finished in {stage.duration:.2f}s")
+        return result
+
+    async def run(self) -> dict:
+        """Run every stage and return their results by stage name."""
+        self.started_at = time.monotonic()
+        tasks = {}
+        for name, stage in self.stages.items():
+            tasks[name] = asyncio.create_task(self._run_stage(stage, tasks), name=f"{self.name}:{name}")
+        try:
+            results = await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        finally:
+            self.finished_at = time.monotonic()
+
+        self.results = dict(zip(tasks, results))
+        self.critical_path = self._critical_path()
+        logging.info(f"[{self.name}] finished in {self.finished_at - self.started_at:.2f}s, critical path: "
+                     + " -> ".join(f"{name} ({duration:.2f}s)" for name, duration in self.critical_path))
+        return self.results
+
+    def _critical_path(self) -> list:
+        """The chain of stages that determined the total run time, as (name, duration) pairs.
+
+        Walks back from the last stage to finish, each time through the dependency that
+        finished last, i.e. the one the stage was waiting on.
+        """
+        finished = [stage for stage in self.stages.values() if stage.finished_at is not None]
+        if not finished:
+            return []
+        stage = max(finished, key=lambda s: s.finished_at)
+        path = [stage]
+        while stage.deps:
+            stage = max((self.stages[dep] for dep in stage.deps), key=lambda s: s.finished_at)
+            path.append(stage)
+        return [(stage.name, stage.duration) for stage in reversed(path)]
+
+    def timings(self) -> dict:
+        """When each stage's inputs were ready, when it started and how long it took, in seconds from the start of the run."""
+        timings = {}
+        for stage in self.stages.values():
+            if stage.started_at is None:
+                continue
+            ready_at = max((self.stages[dep].finished_at for dep in stage.deps), default=self.started_at)
+            timings[stage.name] = {
+                'ready': ready_at - self.started_at,
+                'start': stage.started_at - self.started_at,
+                'duration': stage.duration,
+            }
+        return timings
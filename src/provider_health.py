@@ -0,0 +1,174 @@
+import os
+import time
+import logging
+from collections import deque
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class ProviderHealth:
+    """Rolling success rate, latency and circuit breaker state for one provider."""
+
+    def __init__(self, name, window=50):
+        self.name = name
+        self.outcomes = deque(maxlen=window)
+        # (seconds, completed): a cancelled request is a censored sample, it only says the
+        # answer would have taken longer than that
+        self.latencies = deque(maxlen=window)
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.trips = 0
+
+    @property
+    def success_rate(self) -> float:
+        if not self.outcomes:
+            return 1.0
+        return sum(self.outcomes) / len(self.outcomes)
+
+    def latency_percentile(self, pct):
+        """Kaplan-Meier estimate of the latency percentile.
+
+        Dropping cancelled requests (typically the slow ones a hedge overtook) would leave
+        only the fast completions and bias the estimate low, so they stay at risk up to
+        their elapsed time instead.
+        """
+        samples = sorted(self.latencies)
+        if not samples:
+            return None
+        survival = 1.0
+        at_risk = len(samples)
+        for seconds, completed in samples:
+            if completed:
+                survival *= 1 - 1 / at_risk
+                if 1 - survival >= pct - 1e-9:
+                    return seconds
+            at_risk -= 1
+        # Too many requests were cut short to reach pct, the longest wait is a lower bound
+        return samples[-1][0]
+
+    def as_dict(self) -> dict:
+        return {
+            'state': self.state,
+            'success_rate': self.success_rate,
+            'samples': len(self.outcomes),
+            'latency_p50': self.latency_percentile(0.5),
+            'latency_p90': self.latency_percentile(0.9),
+            'consecutive_failures': self.consecutive_failures,
+            'trips': self.trips,
+        }
+
+
+class ProviderRegistry:
+    """Tracks provider health and decides which providers are worth calling, in which order.
+
+    After failure_threshold consecutive failures a provider's circuit opens and it is
+    skipped entirely. Once reset_timeout seconds have passed a single half-open probe is
+    let through; success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=60.0, window=50, degraded_success_rate=0.5):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.window = window
+        self.degraded_success_rate = degraded_success_rate
+        self.providers = {}
+
+    def health(self, name) -> ProviderHealth:
+        if name not in self.providers:
+            self.providers[name] = ProviderHealth(name, self.window)
+        return self.providers[name]
+
+    def allow(self, name) -> bool:
+        """Whether a request to the provider may go out now. Claims the probe slot when half-open."""
+        health = self.health(name)
+        if health.state == OPEN and time.monotonic() - health.opened_at >= self.reset_timeout:
+            health.state = HALF_OPEN
+            health.probe_in_flight = False
+        if health.state == CLOSED:
+            return True
+        if health.state == HALF_OPEN and not health.probe_in_flight:
+            health.probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self, name, latency):
+        health = self.health(name)
+        health.latencies.append((latency, True))
+        if health.state != CLOSED:
+            # Forget the outage, or its failures would keep the provider ranked as degraded
+            # for the rest of the window after it came back
+            logging.info(f"Provider {name} recovered, closing circuit")
+            health.outcomes.clear()
+        health.outcomes.append(True)
+        health.consecutive_failures = 0
+        health.state = CLOSED
+        health.probe_in_flight = False
+
+    def record_failure(self, name):
+        health = self.health(name)
+        health.outcomes.append(False)
+        health.consecutive_failures += 1
+        health.probe_in_flight = False
+        if health.state == HALF_OPEN or health.consecutive_failures >= self.failure_threshold:
+            if health.state != OPEN:
+                health.trips += 1
+                logging.warning(f"Provider {name} failed {health.consecutive_failures} times, opening circuit for {self.reset_timeout}s")
+            health.state = OPEN
+            health.opened_at = time.monotonic()
+
+    def release(self, name):
+        """Give back a probe slot without an outcome, e.g. when the request was cancelled."""
+        self.health(name).probe_in_flight = False
+
+    def record_cancelled(self, name, elapsed):
+        """A request cancelled after elapsed seconds, e.g. a hedge loser: no outcome, but a
+        censored latency sample (the answer would have taken at least that long)."""
+        self.health(name).latencies.append((elapsed, False))
+        self.release(name)
+
+    def rank(self, providers: list) -> list:
+        """Order providers for a request, leaving out those whose circuit is open.
+
+        The first configured provider stays first unless its circuit is open: outages are
+        the circuit breaker's business, and demoting it on its success rate would mean it
+        is never called, so never recovers. Its half-open probe therefore runs before any
+        fallback. Fallbacks due a probe come next, then the others by expected time to a
+        success (median latency / success rate), degraded providers last.
+        """
+        def expected_latency(provider):
+            health = self.health(provider.name)
+            latency = health.latency_percentile(0.5)
+            if latency is None:
+                return 0.0
+            return latency / max(health.success_rate, 0.01)
+
+        def degraded(provider):
+            return self.health(provider.name).success_rate < self.degraded_success_rate
+
+        def probing(provider):
+            return self.health(provider.name).state != CLOSED
+
+        available = [provider for provider in providers if self.health(provider.name).state != OPEN or self._reset_due(provider.name)]
+        if not available:
+            return []
+        primary = available[0] if available[0] is providers[0] else None
+        fallbacks = sorted((p for p in available if p is not primary), key=lambda p: (not probing(p), degraded(p), expected_latency(p)))
+        return ([primary] if primary else []) + fallbacks
+
+    def _reset_due(self, name) -> bool:
+        health = self.health(name)
+        return time.monotonic() - health.opened_at >= self.reset_timeout
+
+    def snapshot(self) -> dict:
+        return {name: health.as_dict() for name, health in self.providers.items()}
+
+
+# Shared by every engine in the process, so one job discovering an outage spares the others
+registry = ProviderRegistry(
+    failure_threshold=int(os.getenv('TURBOREEL_PROVIDER_FAILURE_THRESHOLD', 3)),
+    reset_timeout=float(os.getenv('TURBOREEL_PROVIDER_RESET_TIMEOUT', 60)),
+)
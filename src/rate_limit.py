@@ -0,0 +1,20 @@
+import os
+import asyncio
+import weakref
+
+# Max in-flight requests per API, shared by every engine in the process
+limits = {
+    'openai': int(os.getenv('TURBOREEL_OPENAI_CONCURRENCY', 8)),
+}
+
+# asyncio primitives are bound to one event loop, so keep a set of semaphores per loop
+_semaphores = weakref.WeakKeyDictionary()
+
+
+def limit(name: str) -> asyncio.Semaphore:
+    """Semaphore bounding concurrent calls to the named API, e.g. `async with limit('openai'):`."""
+    loop = asyncio.get_running_loop()
+    semaphores = _semaphores.setdefault(loop, {})
+    if name not in semaphores:
+        semaphores[name] = asyncio.Semaphore(limits.get(name, 8))
+    return semaphores[name]
@@ -1,8 +1,6 @@
 import yaml
 import logging
 from moviepy.editor import VideoFileClip, AudioFileClip, CompositeVideoClip, TextClip, CompositeAudioClip, ColorClip
-import random
-from openai import OpenAI
 import os
 
 # Set up logging
@@ -11,6 +9,12 @@ logging.basicConfig(level=logging.INFO)
 from .image_handler import ImageHandler
 from .video_editor import VideoEditor
 from .captions.caption_handler import CaptionHandler
+from .workspace import scoped
+from . import tracing
+from . import openai_session
+from .pipeline import Pipeline
+from .narrated_video import NarratedVideo, hook_text_clip
+from . import media_probe
 
 # Update the config loading to use the correct path
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -19,17 +23,16 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 openai_api_key = os.getenv('OPENAI_API_KEY')
 pexels_api_key = os.getenv('PEXELS_API_KEY')
 
-openai = OpenAI(api_key=openai_api_key)
-
 class ReadyMadeScriptGenerator:
     def __init__(self):
         self.video_editor: VideoEditor = VideoEditor()
         self.image_handler: ImageHandler = ImageHandler(pexels_api_key, openai_api_key)
         self.caption_handler: CaptionHandler = CaptionHandler()
 
-    def gpt_summary_of_script(self, video_script: str) -> str:
+    @tracing.traced('openai.summary')
+    async def gpt_summary_of_script(self, video_script: str) -> str:
         try:
-            completion = openai.chat.completions.create(
+            completion = await openai_session.get_client(openai_api_key).chat.completions.create(
                 model="gpt-3.5-turbo-0125",
                 temperature=0.25,
                 max_tokens=250,
@@ -41,6 +44,7 @@ class ReadyMadeScriptGenerator:
             return completion.choices[0].message.content
         except Exception as e:
             logging.error(f"Error generating script summary: {e}")
+            tracing.record_error(e)
             return ""  # Return an empty string on error
 
     async def create_hook_text_clip(self, hook: str, video_height: int = 720) -> tuple[TextClip, str]:
@@ -49,35 +53,25 @@ class ReadyMadeScriptGenerator:
             # Generate audio for the hook
             hook_audio_path: str = await self.video_editor.generate_voice(hook)
 
-            hook_audio_clip: AudioFileClip = AudioFileClip(hook_audio_path)
-            hook_audio_duration: float = hook_audio_clip.duration
-            hook_audio_clip.close()
-
-            # Calculate text clip size based on video width
-            text_width = int((video_height * 9 / 16) * 0.7)  # 90% of video width after cropped to 9/16
-            text_height = int(text_width * 0.35)  # 30% of cropped video width
-
-            # Create a text clip for the Reddit question
-            hook_text_clip = TextClip(
-                hook,
-                fontsize=int(video_height * 0.03),  # 2.5% of video height for font size
-                color='black',
-                bg_color='white',
-                size=(text_width, text_height),  # Allow height to adjust automatically
-                method='caption',
-                align='center'
-            ).set_duration(hook_audio_duration)
+            hook_audio_duration: float = media_probe.duration(hook_audio_path)
+
+            hook_text_clip = self.create_hook_text(hook, hook_audio_duration, video_height)
 
             return hook_text_clip, hook_audio_path
         except Exception as e:
             logging.error(f"Error creating hook clip: {e}")
             return None, None
         
+    def create_hook_text(self, hook: str, duration: float, video_height: int = 720) -> TextClip:
+        """Create the text clip showing the hook for duration seconds."""
+        return hook_text_clip(hook, duration, video_height)
+
+    @tracing.traced('openai.hook')
     async def generate_hook(self, video_script: str) -> str:
         """Generate a hook for the video script."""
         try:
 
-            response = openai.chat.completions.create(
+            response = await openai_session.get_client(openai_api_key).chat.completions.create(
                 model="gpt-3.5-turbo-0125",
                 temperature=0.25,
                 max_tokens=250,
@@ -90,36 +84,46 @@ class ReadyMadeScriptGenerator:
             return hook
         except Exception as e:
             logging.error(f"Error generating hook: {e}")
+            tracing.record_error(e)
             return ""
 
+    @scoped
+    @tracing.traced('ready_made.generate_video')
     async def generate_video(self, video_path_or_url: str = '', 
                             video_path: str = '', 
                             video_url: str = '', 
                             video_script: str = '',
                             video_hook: str = '',
+                            background_id: str = '',
+                            background_min_duration: float = 60.0,
                             captions_settings: dict = {}, # font, color, font_size, shadow_color
                             add_images: bool = True
                             ) -> dict:
         """Generate a video based on the provided topic or ready-made script.
 
         Args:
-            video_path_or_url (str): 'video_path' or 'video_url', depending on which one is provided.
+            video_path_or_url (str): 'video_path', 'video_url' or 'library', depending on which one is provided.
             video_path (str): The path of the video if provided.
             video_url (str): The URL of the video to download.
+            background_id (str): With 'library', the ID of an indexed background (e.g. 'youtube:<id>').
+            background_min_duration (float): With 'library' and no ID, pick any background at least this long.
             video_script (str): The script of the video.        
             captions_settings (dict): The settings for the captions. (font, color, etc)
 
         Returns:
             dict: A dictionary with the status of the video generation and a message.
         """
-        clips_to_close = []
+        narrated = NarratedVideo(
+            self.video_editor, self.image_handler, self.caption_handler,
+            video_path_or_url, video_path, video_url, background_id, background_min_duration, captions_settings, add_images
+        )
         try:
             if not video_path_or_url:
                 logging.error("video_path_or_url cannot be empty.")
                 return {"status": "error", "message": "video_path_or_url cannot be empty."}
                 
 
-            if not video_path and not video_url:
+            if not video_path and not video_url and video_path_or_url != 'library':
                 logging.error("Either video_path or video_url must be provided.")
                 return {"status": "error", "message": "Either video_path or video_url must be provided."}
 
@@ -135,15 +139,6 @@ class ReadyMadeScriptGenerator:
                 logging.error("The video hook should not be longer than 80 characters.")
                 return {"status": "error", "message": "The video hook should not be longer than 80 characters."}
 
-            """ Download or getting video """
-            video_path: str = video_path if video_path_or_url == 'video_path' else self.video_editor.download_video(video_url)
-            if not video_path:
-                logging.error("No video path provided.")
-                return {"status": "error", "message": "No video path provided."}
-            # Get video dimensions
-            with VideoFileClip(video_path) as video:
-                video_width, video_height = video.w, video.h
-
             """ Handle Script Generation and Process """
             # Load prompt template
             current_dir = os.path.dirname(os.path.abspath(__file__))   
@@ -151,94 +146,39 @@ class ReadyMadeScriptGenerator:
             if not os.path.exists(prompt_template_path):
                 logging.error(f"Prompt template file {prompt_template_path} not found.")
                 raise FileNotFoundError(f"Prompt template file {prompt_template_path} not found.")
-            # Generate the script or use the provided script
-            hook = video_hook if video_hook else await self.generate_hook(video_script)
             youtube_short_story = video_script
-            if not youtube_short_story:
-                logging.error("Failed to generate script.")
-                return {"status": "error", "message": "Failed to generate script."}
-
-            """ Define video length for each clip (question and story) """
-            # Initialize Reddit clips
-            # Create the Reddit question clip with the actual video width
-            hook_text_clip, hook_audio_path = await self.create_hook_text_clip(hook, video_height)
-            hook_audio_clip = AudioFileClip(hook_audio_path)
-            hook_audio_duration = hook_audio_clip.duration
-            clips_to_close.append(hook_audio_clip)
-            # Initialize Background video
-            background_video_clip = VideoFileClip(video_path)
-            clips_to_close.append(background_video_clip)
-            background_video_length = background_video_clip.duration
-            ## Initialize Story Audio
-            story_audio_path = await self.video_editor.generate_voice(youtube_short_story)
-            if not story_audio_path:
-                logging.error("Failed to generate audio.")
-                return {"status": "error", "message": "Failed to generate audio."}
-
-            story_audio_clip = AudioFileClip(story_audio_path)
-            clips_to_close.append(story_audio_clip)
-            story_audio_length = story_audio_clip.duration
-        
-            # Calculate video times to cut clips
-            max_start_time: float = background_video_length - story_audio_length - hook_audio_duration
-            start_time: float = random.uniform(0, max_start_time)
-            end_time: float = start_time + hook_audio_duration + story_audio_length
-            
-            """ Cut video once """
-            cut_video_path: str = self.video_editor.cut_video(video_path, start_time, end_time)
-            cut_video_clip = VideoFileClip(cut_video_path)
-            clips_to_close.append(cut_video_clip)
-
-            """ Handle hook video """
-            hook_video = cut_video_clip.subclip(0, hook_audio_duration)
-            hook_video = hook_video.set_audio(hook_audio_clip)
-            hook_video = self.video_editor.crop_video_9_16(hook_video)
-
-            # Add the text clip to the video
-            hook_video = CompositeVideoClip([
-                hook_video,
-                hook_text_clip.set_position(('center', 'center'))
-            ])
-
-            """ Handle story video """
-            story_video = cut_video_clip.subclip(hook_audio_duration)
-            story_video = story_video.set_audio(story_audio_clip)
-            story_video = self.video_editor.crop_video_9_16(story_video)
-
-            font_size = video_width * 0.025
-
-            # Generate subtitles
-            story_subtitles_path, story_subtitles_clips = await self.caption_handler.process(
-                story_audio_path,
-                captions_settings.get('color', 'white'),
-                captions_settings.get('shadow_color', 'black'),
-                captions_settings.get('font_size', font_size),
-                captions_settings.get('font', 'LEMONMILK-Bold.otf')
-            )
 
-            video_context = self.gpt_summary_of_script(youtube_short_story)
-            story_image_paths = self.image_handler.get_images_from_subtitles(story_subtitles_path, video_context, story_audio_length) if add_images else []
-            story_video = self.video_editor.add_images_to_video(story_video, story_image_paths)
-            
-            story_video = self.video_editor.add_captions_to_video(story_video, story_subtitles_clips)
-            # Combine clips
-            combined_clips = CompositeVideoClip([
-                hook_video,
-                story_video.set_start(hook_audio_duration)
-            ])
-
-            final_video_output_path = self.video_editor.render_final_video(combined_clips)
-            
+            """ Stage graph: each stage starts as soon as the stages it needs are done """
+            async def hook() -> str:
+                # Generate the hook or use the provided one
+                hook = video_hook if video_hook else await self.generate_hook(video_script)
+                if not hook:
+                    raise RuntimeError("Failed to generate hook.")
+                return hook
+
+            async def story():
+                return youtube_short_story
+
+            async def summary():
+                return await self.gpt_summary_of_script(youtube_short_story)
+
+            pipeline = Pipeline('ready_made')
+            pipeline.add('hook', hook)
+            pipeline.add('story', story)
+            # The story images are searched for what the summary says the script is about
+            pipeline.add('image_context', summary)
+            results = await narrated.add_stages(pipeline).run()
+            final_video_output_path = results['render']
+
             # Cleanup: Ensure temporary files are removed
-            self.video_editor.cleanup_files([story_audio_path, cut_video_path, story_subtitles_path, hook_audio_path], story_image_paths)
+            narrated.cleanup(results)
             
             logging.info(f"FINAL OUTPUT PATH: {final_video_output_path}")
-            return {"status": "success", "message": "Video generated successfully.", "output_path": final_video_output_path}
+            return {"status": "success", "message": "Video generated successfully.", "output_path": final_video_output_path, "critical_path": pipeline.critical_path}
         
         except Exception as e:
             logging.error(f"Error in video generation: {e}")
             return {"status": "error", "message": f"Error in video generation: {str(e)}"}
         finally:
-            # Close all clips
-            for clip in clips_to_close:
-                clip.close()
+            # Close all clips and release the background
+            narrated.close()
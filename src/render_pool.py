@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import multiprocessing
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+
+from .workspace import Workspace, current_workspace
+from . import tracing
+
+# Set by start(): the processes renders are sent to. None runs them in a thread of the caller
+_executor = None
+_workers = 0
+# Per event loop: one slot per worker. The executor hands calls to its workers ahead of time,
+# and those can no longer be cancelled, so renders wait for a free worker here instead
+_slots = weakref.WeakKeyDictionary()
+
+
+def start(workers: int) -> bool:
+    """Send the renders of this process to a pool of workers processes from now on.
+
+    The job server calls it at startup: its event loop runs every job's network stages,
+    and the CPU-bound moviepy/ffmpeg calls go to the pool, so they neither hold the
+    server's GIL nor take a render slot while a job waits on the network. With
+    workers < 1 renders keep running in threads. Returns whether a pool is running.
+    """
+    global _executor, _workers
+    if _executor is None and workers > 0:
+        _workers = workers
+        _executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'), initializer=_init_worker)
+        logging.info(f"Render pool started with {workers} processes")
+    return _executor is not None
+
+
+def shutdown():
+    """Stop the pool; renders not started yet are dropped."""
+    global _executor
+    executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+    _slots.clear()
+
+
+def _init_worker():
+    logging.basicConfig(level=logging.INFO)
+
+
+def _call(job_id: str, workspace_path: str, func, args: tuple, kwargs: dict):
+    # Runs in a render worker: scratch files go to the job's workspace, spans are sent back with the result
+    token = current_workspace.set(Workspace.borrowed(workspace_path, job_id)) if workspace_path else None
+    trace = tracing.Trace(job_id, func.__name__, export=False)
+    try:
+        with trace:
+            result = func(*args, **kwargs)
+    finally:
+        if token is not None:
+            current_workspace.reset(token)
+    return result, [span.to_dict() for span in trace.spans]
+
+
+async def run(func, *args, **kwargs):
+    """Run a CPU-bound render call (moviepy composition, ffmpeg encode) and return its result.
+
+    In a render worker when start() was called, in a thread otherwise. func must be a
+    module-level function and its arguments picklable (paths, numbers, plain data):
+    moviepy clips cannot cross processes, so the call opens the clips it needs itself.
+    It sees the caller's workspace, and its spans join the caller's trace. Cancelling
+    the caller drops a render that has not started yet.
+    """
+    executor = _executor
+    if executor is None:
+        return await asyncio.to_thread(func, *args, **kwargs)
+    workspace = current_workspace.get()
+    trace = tracing.current_trace.get()
+    job_id = workspace.job_id if workspace else trace.job_id if trace else None
+    loop = asyncio.get_running_loop()
+    slots = _slots.get(loop)
+    if slots is None:
+        slots = _slots[loop] = asyncio.Semaphore(_workers)
+    async with slots:
+        result, spans = await asyncio.wrap_future(executor.submit(_call, job_id, workspace.path if workspace else None, func, args, kwargs))
+    tracing.adopt(spans)
+    return result
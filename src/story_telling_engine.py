@@ -4,8 +4,11 @@ import os
 import uuid
 import logging
 
-from .json_2_video_engine.json_2_video import PyJson2Video
+from .json_2_video_engine.json_2_video import convert_json_to_video
 from .video_editor import VideoEditor
+from .workspace import scoped
+from . import tracing
+from . import render_pool
 
 logging.basicConfig(level=logging.INFO)
 
@@ -21,6 +24,8 @@ class StoryTellingEngine:
         with open(prompt_template_generate_script, 'r') as file:
             self.prompt_template_generate_script = yaml.safe_load(file)
 
+    @scoped
+    @tracing.traced('storytelling.generate_video')
     async def generate_video(self, is_instructions:bool, script:str = None, instructions:str = None):
         if script and len(script) > 1300:
             logging.error("The video script should not be longer than 1300 characters.")
@@ -47,11 +52,14 @@ class StoryTellingEngine:
             }
         }
 
+        # One round trip for all scene prompts instead of one per scene
+        image_prompts = await self.video_editor.gpt_image_prompts_from_scenes(scenes, script_summary)
+
         for index, scene in enumerate(scenes):
             scene_bg_image = {
                 "image_id": f"image_{index}",
                 "source_type": "prompt",
-                "source_content": await self.video_editor.gpt_image_prompt_from_scene(scene, script_summary),
+                "source_content": image_prompts[index],
                 "start_time": f"scr_{index}.start_time",
                 "end_time": f"scr_{index}.end_time",
                 "max_width": "full",
@@ -72,7 +80,8 @@ class StoryTellingEngine:
 
             json_data["script"].append(scene_script)
             
-        json2video = PyJson2Video(json_data, os.path.join(os.path.dirname(__file__), '..', 'result', f'storytelling_video_{uuid.uuid4()}.mp4'))
-        output_video_path = await json2video.convert()
+        output_video_path = os.path.join(os.path.dirname(__file__), '..', 'result', f'storytelling_video_{uuid.uuid4()}.mp4')
+        # The clips are built and encoded in a render worker when the job server runs one
+        output_video_path = await render_pool.run(convert_json_to_video, json_data, output_video_path)
 
         return output_video_path
\ No newline at end of file
@@ -0,0 +1,364 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import threading
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# The span and trace of the code running in the current task; asyncio tasks and to_thread calls inherit them
+current_span = ContextVar('current_span', default=None)
+current_trace = ContextVar('current_trace', default=None)
+
+# Called with an event dict whenever a span starts or ends in this context; the job server
+# sets it to stream the progress of every engine (pipeline stages are spans too)
+span_listener = ContextVar('span_listener', default=None)
+
+COUNTERS = ('bytes', 'cache_hits', 'cache_misses', 'retries', 'hedged', 'hedges', 'hedge_wins')
+
+# Upper bounds (seconds) of the duration histogram buckets, from API calls to full renders
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+trace_dir = os.getenv('TURBOREEL_TRACE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'traces'))
+
+
+class Span:
+    """One timed operation: a pipeline stage, a provider call, an encode...
+
+    Counters (bytes, cache_hits, cache_misses, retries, and hedged/hedges/hedge_wins for
+    hedged image requests) are added with add(), free-form
+    attributes (model, provider, path...) with set().
+    """
+
+    def __init__(self, name: str, parent: 'Span' = None, attributes: dict = None):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.duration = None
+        self.status = 'ok'
+        self.error = None
+        self.attributes = dict(attributes or {})
+        self.counters = dict.fromkeys(COUNTERS, 0)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add(self, **counters):
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def finish(self, error: BaseException = None):
+        self.duration = time.perf_counter() - self._start
+        if isinstance(error, asyncio.CancelledError):
+            self.status = 'cancelled'
+        elif error is not None:
+            self.status = 'error'
+            self.error = str(error) or type(error).__name__
+
+    def event(self) -> dict:
+        """Progress event for span_listener; state is 'started', then 'finished', 'failed' or 'cancelled'."""
+        if self.duration is None:
+            state = 'started'
+        else:
+            state = {'ok': 'finished', 'error': 'failed'}.get(self.status, self.status)
+        event = {'type': 'span', 'name': self.name, 'span_id': self.span_id, 'parent_id': self.parent_id,
+                 'state': state, 'attributes': dict(self.attributes)}
+        if self.duration is not None:
+            event['duration'] = self.duration
+            event['error'] = self.error
+        return event
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Span':
+        """Rebuild a finished span from to_dict(), e.g. one sent back by a render worker."""
+        span = cls(data['name'], attributes=data.get('attributes'))
+        span.span_id = data['span_id']
+        span.parent_id = data.get('parent_id')
+        span.started_at = data.get('started_at')
+        span.duration = data.get('duration')
+        span.status = data.get('status', 'ok')
+        span.error = data.get('error')
+        span.counters = {key: data.get(key, 0) for key in COUNTERS}
+        return span
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'started_at': self.started_at,
+            'duration': self.duration,
+            'status': self.status,
+            'error': self.error,
+            'attributes': self.attributes,
+            **self.counters,
+        }
+
+
+class Trace:
+    """All the spans of one job.
+
+    Use it as a context manager around the job; spans opened inside are collected, and on
+    exit the trace is written to TURBOREEL_TRACE_DIR/<job_id>.json. The first span opened
+    in a job workspace with no trace active starts one of its own, so engines called
+    directly (not through the job server) are traced too.
+    """
+
+    def __init__(self, job_id: str = None, name: str = 'job', export: bool = True):
+        self.job_id = job_id or uuid.uuid4().hex[:12]
+        self.name = name
+        self.export = export
+        self.spans = []
+        self.started_at = None
+        self.duration = None
+        self._start = None
+        self._token = None
+        self._lock = threading.Lock()
+
+    def record(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def summary(self) -> dict:
+        """Count, total time and counters of the finished spans, by span name."""
+        summary = {}
+        for span in self.spans:
+            if span.duration is None:
+                continue
+            entry = summary.setdefault(span.name, {'count': 0, 'errors': 0, 'seconds': 0.0, **dict.fromkeys(COUNTERS, 0)})
+            entry['count'] += 1
+            entry['errors'] += span.status == 'error'
+            entry['seconds'] += span.duration
+            for key in COUNTERS:
+                entry[key] += span.counters.get(key, 0)
+        return summary
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = [span.to_dict() for span in self.spans]
+        return {
+            'job_id': self.job_id,
+            'name': self.name,
+            'started_at': self.started_at,
+            'duration': self.duration,
+            'spans': spans,
+            'summary': self.summary(),
+        }
+
+    def save(self, directory: str = None) -> str:
+        directory = directory or trace_dir
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{self.job_id}.json")
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, default=str)
+        return path
+
+    def __enter__(self):
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._token = current_trace.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        current_trace.reset(self._token)
+        self.duration = time.perf_counter() - self._start
+        if self.export:
+            try:
+                path = self.save()
+                logging.info(f"Trace of job {self.job_id} written to {path}")
+            except OSError as e:
+                logging.warning(f"Could not write the trace of job {self.job_id}: {e}")
+        return False
+
+
+class Metrics:
+    """Aggregates of finished spans by name, exported in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spans = {}
+
+    def observe(self, name: str, duration: float, status: str = 'ok', counters: dict = None):
+        with self._lock:
+            entry = self._spans.get(name)
+            if entry is None:
+                entry = self._spans[name] = {
+                    'count': 0, 'errors': 0, 'seconds': 0.0, 'buckets': [0] * len(BUCKETS), **dict.fromkeys(COUNTERS, 0)
+                }
+            entry['count'] += 1
+            entry['errors'] += status == 'error'
+            entry['seconds'] += duration
+            for index, bound in enumerate(BUCKETS):
+                if duration <= bound:
+                    entry['buckets'][index] += 1
+            for key in COUNTERS:
+                entry[key] += (counters or {}).get(key, 0)
+
+    def merge(self, trace: dict):
+        """Add the spans of an exported trace (e.g. one sent back by a job process)."""
+        for span in trace.get('spans', []):
+            if span.get('duration') is not None:
+                self.observe(span['name'], span['duration'], span.get('status', 'ok'), span)
+
+    def prometheus(self, prefix: str = 'turboreel_span') -> str:
+        with self._lock:
+            spans = {name: dict(entry, buckets=list(entry['buckets'])) for name, entry in sorted(self._spans.items())}
+
+        lines = [
+            f"# HELP {prefix}_duration_seconds Time spent in each span.",
+            f"# TYPE {prefix}_duration_seconds histogram",
+        ]
+        for name, entry in spans.items():
+            label = _label(name)
+            for bound, count in zip(BUCKETS, entry['buckets']):
+                lines.append(f'{prefix}_duration_seconds_bucket{{span="{label}",le="{bound}"}} {count}')
+            lines.append(f'{prefix}_duration_seconds_bucket{{span="{label}",le="+Inf"}} {entry["count"]}')
+            lines.append(f'{prefix}_duration_seconds_sum{{span="{label}"}} {entry["seconds"]:.6f}')
+            lines.append(f'{prefix}_duration_seconds_count{{span="{label}"}} {entry["count"]}')
+
+        for key, help_text in (
+            ('errors', 'Spans that ended with an error.'),
+            ('bytes', 'Bytes downloaded, uploaded or written by each span.'),
+            ('cache_hits', 'Cache hits recorded by each span.'),
+            ('cache_misses', 'Cache misses recorded by each span.'),
+            ('retries', 'Retries and provider fallbacks recorded by each span.'),
+            ('hedged', 'Requests that started at least one hedge.'),
+            ('hedges', 'Hedge requests launched alongside a slow provider.'),
+            ('hedge_wins', 'Hedge requests that answered before the provider they hedged.'),
+        ):
+            lines.append(f"# HELP {prefix}_{key}_total {help_text}")
+            lines.append(f"# TYPE {prefix}_{key}_total counter")
+            for name, entry in spans.items():
+                lines.append(f'{prefix}_{key}_total{{span="{_label(name)}"}} {entry[key]}')
+        return "\n".join(lines) + "\n"
+
+
+def _notify(event: dict):
+    listener = span_listener.get()
+    if listener is None:
+        return
+    try:
+        listener(event)
+    except Exception as e:
+        # Progress reporting never fails the job
+        logging.debug(f"Span listener failed: {e}")
+
+
+def _label(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time the enclosed block as a span, child of the current one.
+
+    Works in sync and async code alike. Yields the Span so the block can add counters
+    (span.add(bytes=...)) and attributes (span.set(model=...)).
+    """
+    trace = current_trace.get()
+    own_trace = None
+    if trace is None:
+        # The first span of a job starts its trace; helpers used outside a job only feed the metrics
+        from .workspace import current_workspace
+        workspace = current_workspace.get()
+        if workspace is not None:
+            own_trace = trace = Trace(workspace.job_id, name)
+            trace.__enter__()
+
+    new_span = Span(name, current_span.get(), attributes)
+    if trace is not None:
+        trace.record(new_span)
+    token = current_span.set(new_span)
+    _notify(new_span.event())
+    error = None
+    try:
+        yield new_span
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        current_span.reset(token)
+        new_span.finish(error)
+        metrics.observe(new_span.name, new_span.duration, new_span.status, new_span.counters)
+        _notify(new_span.event())
+        if own_trace is not None:
+            own_trace.__exit__(None, None, None)
+
+
+def adopt(spans: list):
+    """Add spans finished in another process (see Span.from_dict) under the current span.
+
+    They join the current trace and the metrics, and reach the span listener as
+    finished, like spans of this process.
+    """
+    parent = current_span.get()
+    trace = current_trace.get()
+    for data in spans:
+        span = Span.from_dict(data)
+        if span.parent_id is None and parent is not None:
+            span.parent_id = parent.span_id
+        if trace is not None:
+            trace.record(span)
+        if span.duration is not None:
+            metrics.observe(span.name, span.duration, span.status, span.counters)
+            _notify(span.event())
+
+
+def traced(name: str, **attributes):
+    """Decorator running a function or coroutine function inside span(name)."""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name, **attributes):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, **attributes):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record(**counters):
+    """Add counters (see COUNTERS) to the current span, if any."""
+    active = current_span.get()
+    if active is not None:
+        active.add(**counters)
+
+
+def record_error(error: BaseException):
+    """Mark the current span as failed, for calls that catch their errors and return a default."""
+    active = current_span.get()
+    if active is not None:
+        active.status = 'error'
+        active.error = str(error) or type(error).__name__
+
+
+def annotate(**attributes):
+    """Set attributes on the current span, if any."""
+    active = current_span.get()
+    if active is not None:
+        active.set(**attributes)
+
+
+async def _count_retries(request):
+    # The OpenAI SDK retries internally and numbers each attempt in this header
+    if int(request.headers.get('x-stainless-retry-count', 0) or 0) > 0:
+        record(retries=1)
+
+
+def openai_http_client():
+    """httpx client for AsyncOpenAI that counts the SDK's own retries on the current span."""
+    from openai import DefaultAsyncHttpxClient
+    return DefaultAsyncHttpxClient(event_hooks={'request': [_count_retries]})
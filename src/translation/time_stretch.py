@@ -0,0 +1,67 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def wsola(samples: np.ndarray, rate: float, sample_rate: int, frame_ms: float = 40, search_ms: float = 10) -> np.ndarray:
+    """Pitch-preserving time-stretch of mono samples with WSOLA.
+
+    rate > 1 speeds the audio up (shorter output), rate < 1 slows it down. Each output
+    frame is taken from around its nominal input position, shifted by up to search_ms
+    to the offset whose waveform best continues the previous frame; frames are then
+    overlap-added with a Hann window at 50% overlap.
+
+    The frame loop is sequential by nature, but the similarity search of each frame is
+    a single matrix-vector product over all candidate offsets, and the overlap-add is
+    done for all frames at once.
+    """
+    samples = np.asarray(samples, dtype=np.float32)
+    if len(samples) == 0 or abs(rate - 1.0) < 1e-3:
+        return samples.copy()
+
+    frame = max(int(sample_rate * frame_ms / 1000) // 2 * 2, 64)
+    hop = frame // 2
+    tolerance = int(sample_rate * search_ms / 1000)
+    window = np.hanning(frame + 1)[:-1].astype(np.float32)  # Periodic Hann sums to 1 at 50% overlap
+
+    # Pad so every search window stays in range
+    offset = tolerance + frame
+    padded = np.concatenate([
+        np.zeros(offset, dtype=np.float32),
+        samples,
+        np.zeros(tolerance + 2 * frame + int(np.ceil(hop * rate)), dtype=np.float32),
+    ])
+    windows = sliding_window_view(padded, frame)
+
+    output_length = int(round(len(samples) / rate))
+    n_frames = output_length // hop + 1
+    last_start = len(windows) - 1
+    positions = np.empty(n_frames, dtype=np.int64)
+    positions[0] = offset
+    for k in range(1, n_frames):
+        nominal = min(offset + int(round(k * hop * rate)), last_start - tolerance)
+        # The natural continuation of the previous frame is what the next frame should look like
+        template = padded[positions[k - 1] + hop:positions[k - 1] + hop + frame]
+        candidates = windows[nominal - tolerance:nominal + tolerance + 1]
+        positions[k] = nominal - tolerance + int(np.argmax(candidates @ template))
+
+    frames = windows[positions] * window
+    output = np.zeros((n_frames + 1, hop), dtype=np.float32)
+    output[:-1] += frames[:, :hop]
+    output[1:] += frames[:, hop:]
+    return output.ravel()[:output_length]
+
+
+def fit_to_duration(samples: np.ndarray, sample_rate: int, duration: float, min_rate: float = 0.5, max_rate: float = 4.0) -> np.ndarray:
+    """Time-stretch samples to exactly duration seconds.
+
+    The stretch rate is clamped to [min_rate, max_rate] to avoid audible artifacts; the
+    remainder is padded with silence or trimmed.
+    """
+    target_length = max(int(round(duration * sample_rate)), 0)
+    if len(samples) == 0 or target_length == 0:
+        return np.zeros(target_length, dtype=np.float32)
+    rate = min(max(len(samples) / target_length, min_rate), max_rate)
+    stretched = wsola(samples, rate, sample_rate)
+    if len(stretched) < target_length:
+        stretched = np.pad(stretched, (0, target_length - len(stretched)))
+    return stretched[:target_length]
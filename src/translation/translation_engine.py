@@ -20,16 +20,24 @@ NOT READY YET, STILL WORKING ON IT.
 
 import os
 import logging
-from openai import OpenAI
-from moviepy.editor import AudioFileClip, VideoFileClip, concatenate_audioclips, CompositeAudioClip
+from openai import AsyncOpenAI
+import numpy as np
 import pysrt
 from typing import List
 import json
+import asyncio
+import re
+import uuid
 
 from src.video_editor import VideoEditor
+from src import rate_limit
 from src.captions.subtitle_generator import SubtitleGenerator
-from moviepy.audio.fx.all import audio_fadein, audio_fadeout
-from moviepy.video.fx.all import speedx
+from src.ffmpeg_tools import encode_pcm, demux_audio, remux_audio, mux_audio_tracks
+from src.translation.time_stretch import fit_to_duration
+from src.workspace import scratch_path, scoped
+from src import tracing
+from src import render_pool
+from src import openai_session
 
 
 openai_api_key = os.getenv("OPENAI_API_KEY")
@@ -38,10 +46,19 @@ openai_api_key = os.getenv("OPENAI_API_KEY")
 class TranslationEngine:
     def __init__(self):
         self.base_dir = os.path.dirname(os.path.abspath(__file__))
-        self.openai_client = OpenAI(api_key=openai_api_key)
         self.video_editor = VideoEditor()
         self.subtitle_generator = SubtitleGenerator()
+        self.window_size = 12  # Subtitle lines translated per request
+        self.window_context = 2  # Lines shown on either side of a window as context only
+        self.tts_sample_rate = 24000  # Sample rate of OpenAI's raw 'pcm' TTS output
 
+    @property
+    def openai_client(self) -> AsyncOpenAI:
+        # Looked up per call: clients are bound to the event loop that first used them
+        return openai_session.get_client(openai_api_key)
+
+    @scoped
+    @tracing.traced('translation.translate_video')
     async def translate_video(self, video_path, target_language):
         """
         Translate the video script and generate a new audio file.
@@ -54,146 +71,279 @@ class TranslationEngine:
             dict: A dictionary containing the status and the path to the translated video.
         """
         try:
-            # Extract audio from the video
-            video = VideoFileClip(video_path)
-            audio = video.audio
-            # Save audio path
-            audio_path = os.path.join(self.base_dir, '..', '..', 'assets', 'extracted_audio.mp3')
-            audio.write_audiofile(audio_path)
-
-            # Generate subtitles from the audio
-            subtitles_path = await self.subtitle_generator.generate_subtitles_for_translation(audio_path)
-
-            translated_script = await self._translate_subtitles(subtitles_path, target_language)
-            
-            # Generate new audio for the translated script
-            translated_audio_path = await self.generate_voice(translated_script)
-            
-            # Add translated audio to the video
-            translated_video = self.video_editor.add_audio_to_video(
-                video_path,
-                translated_audio_path
-            )
-
-            # Generate a path for the output video
-            output_dir = os.path.join(self.base_dir, '..', 'assets')
-            os.makedirs(output_dir, exist_ok=True)
-            translated_video_path = os.path.join(output_dir, 'translated_video.mp4')
-
-            logging.info(f"Rendering the translated video: {translated_video_path}")
-            translated_video.write_videofile(translated_video_path, codec='libx264', audio_codec='aac')
-
+            subtitles_path = await self._transcribe(video_path)
+            translated_video_path = await self._dub_and_remux(video_path, subtitles_path, target_language, f'translated_video_{uuid.uuid4()}.mp4')
             return {"status": "success", "translated_video_path": translated_video_path}
 
         except Exception as e:
             logging.error(f"Error in video translation: {e}")
             return {"status": "error", "message": f"Error in video translation: {str(e)}"}
 
+    @scoped
+    @tracing.traced('translation.translate_video_multi')
+    async def translate_video_multi(self, video_path, languages: List[str], multi_track: bool = False):
+        """
+        Translate a video into several languages, demuxing and transcribing it only once.
+
+        Every language is translated, dubbed and muxed concurrently from the same
+        transcription and the same (copied) video stream. Spellings of one language that
+        give the same file name slug (e.g. 'pt-BR' and 'pt_br') are translated once, under
+        the first spelling.
+
+        Args:
+            video_path (str): Path to the original video file.
+            languages (list): The target languages.
+            multi_track (bool): Output one MP4 with an audio track per language instead of one MP4 per language.
+
+        Returns:
+            dict: The status, and either 'translated_video_paths' ({language: path}) or 'translated_video_path'.
+            Languages that failed are listed in 'errors'.
+        """
+        try:
+            if not languages:
+                raise ValueError("At least one target language must be provided.")
+            # The slug names the dubbed audio and the output files, so duplicates would overwrite each other
+            unique_languages = {}
+            for language in languages:
+                unique_languages.setdefault(self._language_slug(language), language)
+            if len(unique_languages) < len(languages):
+                logging.warning(f"Translating {list(unique_languages.values())} once each, duplicates dropped from {languages}")
+            languages = list(unique_languages.values())
+
+            subtitles_path = await self._transcribe(video_path)
+
+            output_dir = self._result_dir()
+            unique_id = uuid.uuid4()
+
+            async def dub(language):
+                translated_script = await self._translate_subtitles(subtitles_path, language)
+                return await self.generate_voice(translated_script, f'full_generated_speech_{self._language_slug(language)}.m4a')
+
+            results = await asyncio.gather(*(dub(language) for language in languages), return_exceptions=True)
+            audio_paths = {}
+            errors = {}
+            for language, result in zip(languages, results):
+                if isinstance(result, Exception):
+                    logging.error(f"Error translating video to {language}: {result}")
+                    errors[language] = str(result)
+                else:
+                    audio_paths[language] = result
+            if not audio_paths:
+                raise RuntimeError(f"All translations failed: {errors}")
+
+            if multi_track:
+                translated_video_path = os.path.join(output_dir, f'translated_video_multi_{unique_id}.mp4')
+                logging.info(f"Muxing {len(audio_paths)} audio tracks into: {translated_video_path}")
+                await render_pool.run(mux_audio_tracks, video_path, [(path, language) for language, path in audio_paths.items()], translated_video_path)
+                return {"status": "success", "translated_video_path": translated_video_path, "errors": errors}
+
+            async def remux(language, audio_path):
+                translated_video_path = os.path.join(output_dir, f'translated_video_{self._language_slug(language)}_{unique_id}.mp4')
+                logging.info(f"Muxing the {language} video: {translated_video_path}")
+                return await render_pool.run(remux_audio, video_path, audio_path, translated_video_path)
+
+            translated_video_paths = await asyncio.gather(*(remux(language, path) for language, path in audio_paths.items()))
+            return {"status": "success", "translated_video_paths": dict(zip(audio_paths, translated_video_paths)), "errors": errors}
+
+        except Exception as e:
+            logging.error(f"Error in multi-language video translation: {e}")
+            return {"status": "error", "message": f"Error in multi-language video translation: {str(e)}"}
+
+    @tracing.traced('translation.transcribe')
+    async def _transcribe(self, video_path) -> str:
+        """Copy the audio stream out of the video (no decode) and transcribe it. Returns the SRT path."""
+        audio_path = scratch_path('extracted_audio.m4a', default_dir=os.path.join(self.base_dir, '..', '..', 'assets'))
+        await render_pool.run(demux_audio, video_path, audio_path)
+
+        # Generate subtitles from the audio
+        return await self.subtitle_generator.generate_subtitles_for_translation(audio_path)
+
+    async def _dub_and_remux(self, video_path, subtitles_path, target_language, output_filename) -> str:
+        translated_script = await self._translate_subtitles(subtitles_path, target_language)
+
+        # Generate new audio for the translated script
+        translated_audio_path = await self.generate_voice(translated_script)
+
+        # Generate a path for the output video, outside the job workspace so it outlives the job
+        translated_video_path = os.path.join(self._result_dir(), output_filename)
+
+        # Mux the dubbed audio next to the original video stream, which is copied unchanged
+        logging.info(f"Muxing the translated video: {translated_video_path}")
+        with tracing.span('translation.remux') as span:
+            await render_pool.run(remux_audio, video_path, translated_audio_path, translated_video_path)
+            span.add(bytes=os.path.getsize(translated_video_path))
+        return translated_video_path
+
+    def _result_dir(self) -> str:
+        result_dir = os.path.abspath(os.path.join(self.base_dir, '..', '..', 'result'))
+        os.makedirs(result_dir, exist_ok=True)
+        return result_dir
+
+    @staticmethod
+    def _language_slug(language: str) -> str:
+        return re.sub(r'[^a-zA-Z0-9]+', '_', language).strip('_').lower() or 'language'
+
+    @tracing.traced('translation.translate')
+    async def _translate_subtitles(self, subtitles_path: str, target_language: str, mode: str = 'windowed') -> List[pysrt.SubRipItem]:
+        """Translate the subtitles in the SRT file using OpenAI's API.
 
-    async def _translate_subtitles(self, subtitles_path: str, target_language: str) -> List[pysrt.SubRipItem]:
-        """Translate each subtitle in the SRT file using OpenAI's API."""
+        Args:
+            subtitles_path (str): Path to the SRT file.
+            target_language (str): The target language for translation.
+            mode (str): 'windowed' sends overlapping windows of numbered lines per request and
+                runs the windows concurrently; 'per_line' makes one request per subtitle.
+        """
         try:
             # Read subtitles from the file
             subs = pysrt.open(subtitles_path)
-            
-            translated_subs = []
-            for i, sub in enumerate(subs):
-                # Get previous and next subtitle texts
-                prev_text = subs[i-1].text if i > 0 else ""
-                next_text = subs[i+1].text if i < len(subs) - 1 else ""
-
-                json_response = '''{
-                    "current_translated_subtitle": ""
-                }'''
-                
-                # Translate the text with context
-                response = self.openai_client.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    response_format={"type": "json_object"},
-                    messages=[
-                        {"role": "system", "content": f"You are a professional translator. Translate the current subtitle to {target_language}. Use the previous and next subtitles as context to ensure the translation is coherent. Answer in the JSON format: {json_response}"},
-                        {"role": "user", "content": f"Previous subtitle: {prev_text}\nCurrent subtitle: {sub.text}\nNext subtitle: {next_text}"}
-                    ]
-                )
-                response_json = response.choices[0].message.content
-                
-                # Parse the JSON response
-                translated_sub_data = json.loads(response_json)
-                translated_text = translated_sub_data.get("current_translated_subtitle", "")
-                # Create a new SubRipItem with translated text
-                translated_sub = pysrt.SubRipItem(
-                    index=sub.index,
-                    start=sub.start,
-                    end=sub.end,
-                    text=translated_text
-                )
-                translated_subs.append(translated_sub)
-            
-            return translated_subs
+
+            if mode == 'per_line':
+                translated_texts = [await self._translate_line(subs, i, target_language) for i in range(len(subs))]
+            else:
+                translated_texts = await self._translate_windows(subs, target_language)
+
+            # Create new SubRipItems with translated text
+            return [
+                pysrt.SubRipItem(index=sub.index, start=sub.start, end=sub.end, text=translated_text)
+                for sub, translated_text in zip(subs, translated_texts)
+            ]
         except Exception as e:
             logging.error(f"Error translating subtitles: {e}")
             raise
 
+    @tracing.traced('openai.translate')
+    async def _translate_line(self, subs, i: int, target_language: str) -> str:
+        """Translate one subtitle, using the previous and next subtitles as context."""
+        # Get previous and next subtitle texts
+        prev_text = subs[i-1].text if i > 0 else ""
+        next_text = subs[i+1].text if i < len(subs) - 1 else ""
+
+        json_response = '''{
+            "current_translated_subtitle": ""
+        }'''
+
+        # Translate the text with context
+        async with rate_limit.limit('openai'):
+            response = await self.openai_client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                response_format={"type": "json_object"},
+                messages=[
+                    {"role": "system", "content": f"You are a professional translator. Translate the current subtitle to {target_language}. Use the previous and next subtitles as context to ensure the translation is coherent. Answer in the JSON format: {json_response}"},
+                    {"role": "user", "content": f"Previous subtitle: {prev_text}\nCurrent subtitle: {subs[i].text}\nNext subtitle: {next_text}"}
+                ]
+            )
+        response_json = response.choices[0].message.content
+
+        # Parse the JSON response
+        translated_sub_data = json.loads(response_json)
+        return translated_sub_data.get("current_translated_subtitle", "")
+
+    async def _translate_windows(self, subs, target_language: str) -> List[str]:
+        """Translate subtitles in overlapping windows of numbered lines, all windows at once.
+
+        Each window translates window_size lines and shows window_context lines on either
+        side as context only. Lines missing from a window's answer are retried one by one.
+        """
+        translated_texts = [None] * len(subs)
+
+        async def translate_window(start):
+            end = min(start + self.window_size, len(subs))
+            try:
+                translated_texts[start:end] = await self._translate_window(subs, start, end, target_language)
+            except Exception as e:
+                logging.error(f"Error translating subtitle window {start}-{end - 1}: {e}")
+
+        await asyncio.gather(*(translate_window(start) for start in range(0, len(subs), self.window_size)))
+
+        # Validate that every line came back
+        missing = [i for i, text in enumerate(translated_texts) if not text]
+        if missing:
+            logging.warning(f"{len(missing)} subtitle lines missing from windowed translation, translating them one by one.")
+            retried = await asyncio.gather(*(self._translate_line(subs, i, target_language) for i in missing))
+            for i, text in zip(missing, retried):
+                translated_texts[i] = text
+        return translated_texts
+
+    @tracing.traced('openai.translate')
+    async def _translate_window(self, subs, start: int, end: int, target_language: str) -> List[str]:
+        """Translate lines start..end-1, returning their texts in order (None where missing)."""
+        context_start = max(start - self.window_context, 0)
+        context_end = min(end + self.window_context, len(subs))
+        lines = [
+            {"id": i, "text": subs[i].text, "translate": start <= i < end}
+            for i in range(context_start, context_end)
+        ]
+
+        json_response = '''{
+            "translations": [{"id": 0, "text": ""}]
+        }'''
+
+        async with rate_limit.limit('openai'):
+            response = await self.openai_client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                response_format={"type": "json_object"},
+                messages=[
+                    {"role": "system", "content": f"You are a professional translator. Translate subtitles to {target_language}. You receive numbered subtitle lines in order; translate every line marked \"translate\": true, one entry per line with the same id, and use the other lines only as context so the translation is coherent. Keep each translation about as long as the original line. Answer in the JSON format: {json_response}"},
+                    {"role": "user", "content": json.dumps(lines, ensure_ascii=False)}
+                ]
+            )
+        translated_window = json.loads(response.choices[0].message.content)
+
+        texts = {}
+        for item in translated_window.get("translations", []):
+            if isinstance(item, dict) and isinstance(item.get("id"), int) and start <= item["id"] < end and item.get("text"):
+                texts[item["id"]] = item["text"]
+        return [texts.get(i) for i in range(start, end)]
+
+    @tracing.traced('openai.tts')
+    async def _synthesize_line(self, text: str) -> np.ndarray:
+        """TTS one line as raw PCM and return it as float samples at tts_sample_rate."""
+        if not text.strip():
+            return np.zeros(0, dtype=np.float32)
+        async with rate_limit.limit('openai'):
+            async with self.openai_client.audio.speech.with_streaming_response.create(
+                model="tts-1",
+                voice="echo",
+                input=text,
+                response_format="pcm"  # 24kHz 16-bit mono, no decoding needed
+            ) as response:
+                pcm = await response.read()
+        tracing.record(bytes=len(pcm))
+        return np.frombuffer(pcm, dtype='<i2').astype(np.float32) / 32768.0
+
     # Common function
-    async def generate_voice(self, translated_subtitles):
-        """Generate a new audio file for each translated subtitle line and match with timing."""
+    @tracing.traced('translation.voice')
+    async def generate_voice(self, translated_subtitles, output_filename: str = 'full_generated_speech.m4a'):
+        """Generate a new audio file for the translated subtitles, matching each line's timing.
+
+        All lines are synthesized concurrently, then each one is time-stretched (WSOLA, pitch
+        preserved) to its subtitle duration and mixed into one buffer at its start offset.
+        """
         try:
-            speech_file_dir = os.path.join(self.base_dir, '..', 'assets')
-            os.makedirs(speech_file_dir, exist_ok=True)
-            
-            audio_clips = []
-            
-            for i, subtitle in enumerate(translated_subtitles):
-                speech_file_path = os.path.join(speech_file_dir, f'generated_speech_{i}.mp3')
-                response = self.openai_client.audio.speech.create(
-                    model="tts-1",
-                    voice="echo",
-                    input=subtitle.text
-                )
-                response.stream_to_file(speech_file_path)
-                
-                # Load the generated audio
-                audio_clip = AudioFileClip(speech_file_path)
-                
-                # Calculate the desired duration based on subtitle timing
-                desired_duration = (subtitle.end.seconds + subtitle.end.milliseconds / 1000) - (subtitle.start.seconds + subtitle.start.milliseconds / 1000)
-                
-                # if audio duration is longer than desired duration, speed up the audio
-                if audio_clip.duration > desired_duration:
-                    speed_factor = audio_clip.duration / desired_duration
-                    audio_clip = CompositeAudioClip([audio_clip]).set_duration(audio_clip.duration)
-                    audio_clip = speedx(audio_clip, factor=speed_factor)
-                # if audio duration is shorter than desired duration, slow down the audio
-                elif audio_clip.duration < desired_duration:
-                    speed_factor = desired_duration / audio_clip.duration
-                    audio_clip = CompositeAudioClip([audio_clip]).set_duration(audio_clip.duration)
-                    audio_clip = speedx(audio_clip, factor=speed_factor)
-
-                # Ensure the audio clip duration matches the desired duration
-                audio_clip = audio_clip.set_duration(desired_duration)
-
-                # Set the start time for the audio clip
-                audio_clip = audio_clip.set_start(subtitle.start.seconds + subtitle.start.milliseconds / 1000)
-                
-                audio_clips.append(audio_clip)
-                
-                # Remove the temporary audio file
-                os.remove(speech_file_path)
-            
-            # Combine all audio clips
-            final_audio = CompositeAudioClip(audio_clips)
-            final_audio.fps = 44100
-            
-            # Export the full audio
-            full_audio_path = os.path.join(speech_file_dir, 'full_generated_speech.mp3')
-            final_audio.write_audiofile(full_audio_path)
-            
+            line_samples = await asyncio.gather(*(self._synthesize_line(subtitle.text) for subtitle in translated_subtitles))
+
+            def mix():
+                sample_rate = self.tts_sample_rate
+                end_time = max((subtitle.end.ordinal / 1000 for subtitle in translated_subtitles), default=0)
+                buffer = np.zeros(int(np.ceil(end_time * sample_rate)) + 1, dtype=np.float32)
+                for subtitle, samples in zip(translated_subtitles, line_samples):
+                    # Calculate the desired duration based on subtitle timing
+                    start_time = subtitle.start.ordinal / 1000
+                    desired_duration = subtitle.end.ordinal / 1000 - start_time
+                    fitted = fit_to_duration(samples, sample_rate, desired_duration)
+                    start = int(round(start_time * sample_rate))
+                    buffer[start:start + len(fitted)] += fitted[:len(buffer) - start]
+                return buffer
+
+            with tracing.span('translation.time_stretch'):
+                final_audio = await asyncio.to_thread(mix)
+
+            # Export the full audio as AAC, so it can be muxed into the MP4 without another encode
+            full_audio_path = scratch_path(output_filename, default_dir=os.path.join(self.base_dir, '..', 'assets'))
+            await render_pool.run(encode_pcm, final_audio, self.tts_sample_rate, full_audio_path)
+
             logging.info("Voice generated successfully for all subtitle lines.")
             return full_audio_path
         except Exception as e:
             logging.error(f"Error generating voice: {e}")
             raise
-
-
-
-
@@ -1,15 +1,23 @@
 import os
+import random
+import asyncio
 import logging
-import requests
-from moviepy.editor import VideoFileClip, AudioFileClip, TextClip, CompositeVideoClip, ImageClip
-from openai import OpenAI
+from moviepy.editor import VideoFileClip, AudioFileClip, TextClip, CompositeVideoClip, ImageClip, vfx
+from openai import AsyncOpenAI
 import pysrt
-from yt_dlp import YoutubeDL
 from pathlib import Path
 import uuid
 import re  # Added import for regular expression operations
 import json  # Added import for JSON operations
 
+from .image_acquisition import load_image
+from .workspace import scratch_path
+from .ffmpeg_tools import stream_copy_cut, vertical_cut
+from .background_library import default_library
+from . import rate_limit
+from . import tracing
+from . import openai_session
+
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -22,58 +30,182 @@ openai_api_key = os.getenv('OPENAI_API_KEY')
 
 class VideoEditor:
     def __init__(self):
-        self.openai = OpenAI(api_key=openai_api_key)
         self.base_dir = os.path.dirname(os.path.abspath(__file__))
-
+        # How backgrounds are cut: 'lazy' (subclip of the source reader, no file), 'copy' (keyframe-aligned stream copy) or 'encode'
+        self.cut_mode = os.getenv('TURBOREEL_CUT_MODE', 'lazy')
+        self.background_library = default_library()
+        # 'section' downloads only the part of a URL a video needs, 'full' downloads the whole video
+        self.download_mode = os.getenv('TURBOREEL_DOWNLOAD_MODE', 'section')
+        # Render backgrounds pre-cropped to 9:16 by ffmpeg (proxies, or just the needed section of one-shot ones) instead of cropping every frame in Python
+        self.use_proxies = os.getenv('TURBOREEL_BACKGROUND_PROXIES', '1') == '1'
+
+    @property
+    def openai(self) -> AsyncOpenAI:
+        # Looked up per call: clients are bound to the event loop that first used them
+        return openai_session.get_client(openai_api_key)
+
+    @tracing.traced('background.download')
     def download_video(self, youtube_url):
-        try:
-            downloads_dir = os.path.join(self.base_dir, '..', 'downloads')
-            os.makedirs(downloads_dir, exist_ok=True)
-            ydl_opts = {
-                'format': 'bestvideo[height<=720]+bestaudio',
-                'outtmpl': os.path.join(downloads_dir, '%(title)s.%(ext)s'),
-                'postprocessors': [{
-                    'key': 'FFmpegVideoConvertor',
-                    'preferedformat': 'mp4',
-                }]
-            }
-            
-            with YoutubeDL(ydl_opts) as ydl:
-                ydl.download([youtube_url])
-                info_dict = ydl.extract_info(youtube_url, download=False)
-                video_path = ydl.prepare_filename(info_dict)
-                # Ensure the video path is in mp4 format
-                if not video_path.endswith('.mp4'):
-                    video_path = video_path.rsplit('.', 1)[0] + '.mp4'
+        """Return the library entry of a background video, downloading it only if the library does not have it yet.
 
+        None on error. entry['reused'] tells whether it was already in the library.
+        """
+        try:
+            entry = self.background_library.fetch(youtube_url)
             logging.info("Video downloaded successfully.")
-            return video_path
+            return entry
         except Exception as e:
             logging.error(f"Error downloading video: {e}")
+            tracing.record_error(e)
+            return None
+
+    @tracing.traced('background.resolve')
+    def resolve_video_url(self, video_url):
+        """Duration and size of a URL's video, before deciding what to download. None on error."""
+        try:
+            return self.background_library.resolve(video_url)
+        except Exception as e:
+            logging.error(f"Error resolving video URL: {e}")
+            tracing.record_error(e)
+            return None
+
+    @tracing.traced('background.download_section')
+    def download_video_section(self, resolved, duration):
+        """Download (or reuse) only duration seconds of a resolved URL. Returns the library entry, or None."""
+        try:
+            entry = self.background_library.fetch_section(resolved, duration)
+            logging.info("Video section downloaded successfully.")
+            return entry
+        except Exception as e:
+            logging.error(f"Error downloading video section: {e}")
+            tracing.record_error(e)
             return None
 
-    def cut_video(self, video_path, start_time, end_time):
+    def library_background(self, background_id: str = '', min_duration: float = 0.0) -> dict:
+        """Pick an indexed background by ID, or any one lasting at least min_duration seconds. None if there is none."""
+        entry = self.background_library.get(background_id) if background_id else self.background_library.pick(min_duration)
+        if not entry:
+            logging.error(f"No library background found (id={background_id!r}, min_duration={min_duration}).")
+        return entry
+
+    @staticmethod
+    def vertical_size(video_height) -> tuple:
+        """Size of the 9:16 output cut from a video of this height, rounded down to even numbers for H.264."""
+        height = int(video_height) // 2 * 2
+        return int(height * 9 / 16) // 2 * 2, height
+
+    def vertical_background(self, video_path, video_height, reused=False) -> str:
+        """Path of the 9:16 proxy of a background at its output resolution, or video_path if proxies are off or fail.
+
+        Building a proxy is a full encode, which only pays off for backgrounds rendered
+        again and again: library picks and reused downloads. One-shot uploads and fresh
+        downloads (reused=False) only have the section they need cropped, see vertical_section.
+        """
+        if not self.use_proxies or not reused:
+            return video_path
+        try:
+            width, height = self.vertical_size(video_height)
+            return self.background_library.proxy(video_path, width, height)
+        except Exception as e:
+            logging.error(f"Error building background proxy, cropping per frame instead: {e}")
+            return video_path
+
+    def vertical_section(self, video_path, video_height, start_time, end_time) -> str:
+        """Cut start_time..end_time of a one-shot background, cropped and scaled to 9:16 by ffmpeg.
+
+        Returns the path of the cut, or None if proxies are off or the cut fails (the
+        background is then cropped per frame during the render).
+        """
+        if not self.use_proxies:
+            return None
+        try:
+            width, height = self.vertical_size(video_height)
+            output_path = scratch_path(f"background_{uuid.uuid4()}.mp4", default_dir=os.path.join(self.base_dir, '..', 'assets'))
+            loop = end_time > self.background_library.duration_of(video_path)
+            return vertical_cut(video_path, start_time, end_time - start_time, output_path, width, height, loop=loop)
+        except Exception as e:
+            logging.error(f"Error cutting the vertical background section, cropping per frame instead: {e}")
+            return None
+
+    def cut_video(self, video_path, start_time, end_time, mode='encode'):
+        """Cut a video to a new file, either re-encoding it ('encode') or with a keyframe-aligned stream copy ('copy')."""
         if not os.path.exists(video_path):
             logging.error(f"Video file does not exist, {video_path}")
             return
         try:
             unique_id = uuid.uuid4()
             assets_dir = os.path.join(self.base_dir, '..', 'assets')
-            os.makedirs(assets_dir, exist_ok=True)
-            output_path = os.path.join(assets_dir, f"cut_video_{unique_id}.mp4")
-            
+            output_path = scratch_path(f"cut_video_{unique_id}.mp4", default_dir=assets_dir)
+
+            if mode == 'copy':
+                loop = end_time > self.background_library.duration_of(video_path)
+                stream_copy_cut(video_path, start_time, end_time - start_time, output_path, loop=loop)
+                logging.info("Video cut successfully (stream copy).")
+                return output_path
+
             clip = VideoFileClip(video_path)
-            cut_clip = clip.subclip(start_time, end_time)
+            cut_clip = self._section(clip, start_time, end_time)
             cut_clip.write_videofile(output_path)
+            clip.close()
             logging.info("Video cut successfully.")
             return output_path
         except Exception as e:
             logging.error(f"Error cutting video: {e}")
 
+    def cut_background(self, video_path, start_time, end_time, source_clip=None, vertical_height=None):
+        """Cut the background section used by a video, following self.cut_mode.
+
+        In 'lazy' mode no file is written: the section is a subclip of source_clip (or of a
+        new reader on video_path), decoded on demand while the final video is rendered, so
+        the render is the only encode. 'copy' and 'encode' go through cut_video.
+        With vertical_height (one-shot backgrounds, which have no proxy) the section is
+        cropped and scaled to the 9:16 size of that height by ffmpeg instead.
+
+        Returns:
+            tuple: (clip, cut_video_path); cut_video_path is None when no file was written.
+        """
+        if vertical_height:
+            cut_video_path = self.vertical_section(video_path, vertical_height, start_time, end_time)
+            if cut_video_path:
+                return VideoFileClip(cut_video_path), cut_video_path
+        if self.cut_mode in ('copy', 'encode'):
+            cut_video_path = self.cut_video(video_path, start_time, end_time, mode=self.cut_mode)
+            if cut_video_path:
+                return VideoFileClip(cut_video_path), cut_video_path
+            logging.warning(f"Falling back to a lazy cut after '{self.cut_mode}' failed.")
+        source_clip = source_clip if source_clip is not None else VideoFileClip(video_path)
+        return self._section(source_clip, start_time, end_time), None
+
+    @staticmethod
+    def _section(clip, start_time, end_time):
+        """clip between start_time and end_time, looping the clip when it ends too early."""
+        if end_time <= clip.duration:
+            return clip.subclip(start_time, end_time)
+        logging.info(f"Background is {clip.duration:.1f}s, looping it to {end_time - start_time:.1f}s")
+        # Time wraps back to the first frame, which is a keyframe, so the loop point costs no seek
+        return clip.fx(vfx.loop, duration=end_time).subclip(start_time, end_time)
+
+    def pick_background_start(self, video_path, background_duration, needed_duration) -> float:
+        """Random start for a needed_duration section of a background, on a keyframe.
+
+        Seeking to a keyframe needs no decoding of earlier frames, and keyframe starts
+        make stream-copy cuts exact. Backgrounds shorter than needed_duration start at 0
+        and are looped by cut_background.
+        """
+        max_start = background_duration - needed_duration
+        if max_start <= 0:
+            return 0.0
+        keyframes = self.background_library.keyframes(video_path) or []
+        candidates = [time for time in keyframes if time <= max_start]
+        if candidates:
+            return random.choice(candidates)
+        return random.uniform(0, max_start)
+
     # Create antoher class to handle ai generation
+    @tracing.traced('openai.script')
     async def generate_script(self, topic, prompt_template):
         try:
-            completion = self.openai.chat.completions.create(  # Async call to create chat completion
+            completion = await self.openai.chat.completions.create(  # Async call to create chat completion
                 model="gpt-3.5-turbo-0125",
                 max_tokens=400,
                 response_format={ "type": "json_object" },
@@ -92,14 +224,17 @@ class VideoEditor:
 
         except json.JSONDecodeError as json_err:
             logging.error(f"Error decoding JSON: {json_err}")
+            tracing.record_error(json_err)
             return {}  # Return an empty dictionary on JSON decode error
         except Exception as e:
             logging.error(f"Error generating script: {e}")  # Log the error message
+            tracing.record_error(e)
             return {}  # Return an empty dictionary on error
 
+    @tracing.traced('openai.summary')
     async def gpt_summary_of_script(self, video_script: str) -> str:
         try:
-            completion = self.openai.chat.completions.create(
+            completion = await self.openai.chat.completions.create(
                 model="gpt-3.5-turbo-0125",
                 temperature=0.25,
                 max_tokens=250,
@@ -111,50 +246,120 @@ class VideoEditor:
             return completion.choices[0].message.content
         except Exception as e:
             logging.error(f"Error generating script summary: {e}")
+            tracing.record_error(e)
             return ""  # Return an empty string on error
     
+    @tracing.traced('openai.image_prompt')
     async def gpt_image_prompt_from_scene(self, scene, script_summary):
         try:
-            completion = self.openai.chat.completions.create( 
-                model="gpt-3.5-turbo",  # Updated model name
-                temperature=0.25,
-                messages = [
-                    {
-                        'role': 'system',
-                        'content': """ You are a specialized prompt generation system for video automation, tasked with generating image prompts that are visually engaging and suited to the provided scene text. Focus on capturing vibrant, lively details to make each image compelling and relatable.
-
-                        **Guidelines:**
-                        1. Write concise prompts that prioritize the details in the scene text, adding any vivid or relevant elements to enhance the scene.
-                        2. Use specific sensory details (like lighting, atmosphere, or motion) to bring each image to life, avoiding overly corporate or static imagery.
-                        3. Keep prompts engaging by emphasizing emotions, actions, or vivid backgrounds that match the scene.
-                        4. Avoid including any text within the image; focus solely on describing the visual content.
-
-                        **Example outputs:**
-                        - "Three friends laughing and dancing on a beach at sunset in California, waves in the background"
-                        - "Kids in fun Halloween costumes, smiling and posing excitedly at a colorful McDonald's"
-                        - "Friends chatting and laughing in a lively bar, while a dramatic argument unfolds nearby" 
-
-
-                        **Output Format:**
-                        Return the result as a JSON object structured as follows:
+            async with rate_limit.limit('openai'):
+                completion = await self.openai.chat.completions.create(
+                    model="gpt-3.5-turbo",  # Updated model name
+                    temperature=0.25,
+                    messages = [
                         {
-                            "image_prompt": "image prompt here"
+                            'role': 'system',
+                            'content': """ You are a specialized prompt generation system for video automation, tasked with generating image prompts that are visually engaging and suited to the provided scene text. Focus on capturing vibrant, lively details to make each image compelling and relatable.
+
+                            **Guidelines:**
+                            1. Write concise prompts that prioritize the details in the scene text, adding any vivid or relevant elements to enhance the scene.
+                            2. Use specific sensory details (like lighting, atmosphere, or motion) to bring each image to life, avoiding overly corporate or static imagery.
+                            3. Keep prompts engaging by emphasizing emotions, actions, or vivid backgrounds that match the scene.
+                            4. Avoid including any text within the image; focus solely on describing the visual content.
+
+                            **Example outputs:**
+                            - "Three friends laughing and dancing on a beach at sunset in California, waves in the background"
+                            - "Kids in fun Halloween costumes, smiling and posing excitedly at a colorful McDonald's"
+                            - "Friends chatting and laughing in a lively bar, while a dramatic argument unfolds nearby" 
+
+
+                            **Output Format:**
+                            Return the result as a JSON object structured as follows:
+                            {
+                                "image_prompt": "image prompt here"
+                            }
+                            """
+                        },
+                        {
+                            'role': 'user',
+                            'content': f'Scene script: "{scene}"\nScript summary: {script_summary}'
                         }
-                        """
-                    },
-                    {
-                        'role': 'user',
-                        'content': f'Scene script: "{scene}"\nScript summary: {script_summary}'
-                    }
-                ],
-                max_tokens=200
-            )
+                    ],
+                    max_tokens=200
+                )
             response_json = json.loads(completion.choices[0].message.content)
             return response_json["image_prompt"]
-        except requests.exceptions.RequestException as e:
+        except Exception as e:
             logging.error(f"Error calling OpenAI API: {e}")
+            tracing.record_error(e)
             return scene  
-        
+
+    @tracing.traced('openai.image_prompts')
+    async def gpt_image_prompts_from_scenes(self, scenes, script_summary):
+        """Generate the image prompt for every scene in one request.
+
+        Returns a list of prompts aligned by index with scenes. Scenes the batched answer
+        leaves out are filled in with concurrent gpt_image_prompt_from_scene calls.
+        """
+        numbered_scenes = [{"id": index, "scene": scene} for index, scene in enumerate(scenes)]
+        prompts = [None] * len(scenes)
+        try:
+            async with rate_limit.limit('openai'):
+                completion = await self.openai.chat.completions.create(
+                    model="gpt-3.5-turbo",
+                    temperature=0.25,
+                    response_format={"type": "json_object"},
+                    messages = [
+                        {
+                            'role': 'system',
+                            'content': """ You are a specialized prompt generation system for video automation, tasked with generating image prompts that are visually engaging and suited to each provided scene text. Focus on capturing vibrant, lively details to make each image compelling and relatable.
+
+                            **Guidelines:**
+                            1. Write one concise prompt per scene that prioritizes the details in that scene's text, adding any vivid or relevant elements to enhance the scene.
+                            2. Use specific sensory details (like lighting, atmosphere, or motion) to bring each image to life, avoiding overly corporate or static imagery.
+                            3. Keep prompts engaging by emphasizing emotions, actions, or vivid backgrounds that match the scene.
+                            4. Avoid including any text within the image; focus solely on describing the visual content.
+                            5. Keep the look consistent across scenes, since they belong to the same video.
+
+                            **Example outputs:**
+                            - "Three friends laughing and dancing on a beach at sunset in California, waves in the background"
+                            - "Kids in fun Halloween costumes, smiling and posing excitedly at a colorful McDonald's"
+                            - "Friends chatting and laughing in a lively bar, while a dramatic argument unfolds nearby" 
+
+
+                            **Output Format:**
+                            Return one entry per scene, keeping its id, as a JSON object structured as follows:
+                            {
+                                "image_prompts": [
+                                    {"id": 0, "image_prompt": "image prompt here"}
+                                ]
+                            }
+                            """
+                        },
+                        {
+                            'role': 'user',
+                            'content': f'Script summary: {script_summary}\nScenes: {json.dumps(numbered_scenes)}'
+                        }
+                    ],
+                    max_tokens=120 * len(scenes) + 100
+                )
+            response_json = json.loads(completion.choices[0].message.content)
+            for item in response_json.get("image_prompts", []):
+                if isinstance(item, dict) and isinstance(item.get("id"), int) and 0 <= item["id"] < len(scenes) and item.get("image_prompt"):
+                    prompts[item["id"]] = item["image_prompt"]
+        except Exception as e:
+            logging.error(f"Error generating batched image prompts: {e}")
+
+        missing = [index for index, prompt in enumerate(prompts) if prompt is None]
+        if missing:
+            logging.warning(f"Generating {len(missing)} missing image prompts one scene at a time.")
+            tracing.record(retries=len(missing))
+            fallback_prompts = await asyncio.gather(*(self.gpt_image_prompt_from_scene(scenes[index], script_summary) for index in missing))
+            for index, prompt in zip(missing, fallback_prompts):
+                prompts[index] = prompt
+        return prompts
+
+    @tracing.traced('openai.scenes')
     async def create_scenes_from_script(self, script):
         system_prompt = """ You are a scene creation system for a video automation tool. Your task is to break down a given script into a sequence of concise, well-structured scenes to be used for generating images and audio in the video.
 
@@ -181,7 +386,7 @@ class VideoEditor:
             }
         """
         try:
-            completion = self.openai.chat.completions.create(
+            completion = await self.openai.chat.completions.create(
                 model="gpt-3.5-turbo",
                 temperature=0.25,
                 response_format={ "type": "json_object" },
@@ -195,25 +400,28 @@ class VideoEditor:
             return response_json["scenes"]
         except Exception as e:
             logging.error(f"Error creating scenes from script: {e}")
+            tracing.record_error(e)
             return script
     # Create antoher class to handle ai generation
+    @tracing.traced('openai.tts')
     async def generate_voice(self, script):
         try:
             unique_id = uuid.uuid4()
             assets_dir = os.path.join(self.base_dir, '..', 'assets')
-            os.makedirs(assets_dir, exist_ok=True)
-            speech_file_path = os.path.join(assets_dir, f"voice_{unique_id}.mp3")
+            speech_file_path = scratch_path(f"voice_{unique_id}.mp3", default_dir=assets_dir)
             
-            response = self.openai.audio.speech.create(
+            async with self.openai.audio.speech.with_streaming_response.create(
                 model="tts-1",
                 voice="echo",
                 input=script
-            )
-            response.stream_to_file(speech_file_path)
+            ) as response:
+                await response.stream_to_file(speech_file_path)
+            tracing.record(bytes=os.path.getsize(speech_file_path))
             logging.info("Voice generated successfully.")
             return speech_file_path
         except Exception as e:
             logging.error(f"Error generating voice: {e}")
+            tracing.record_error(e)
 
     def load_subtitles(self, subtitles_path):
         try:
@@ -273,16 +481,26 @@ class VideoEditor:
             logging.error(f"Error adding captions to video: {e}")
             return None
 
+    def image_box(self, video_width, video_height) -> tuple:
+        """On-screen box of the images placed by add_images_to_video.
+
+        Images are resized to one third of the video height whatever their width, so only
+        the height is constrained: (None, height), as load_image and the providers expect.
+        """
+        return None, int(video_height / 3)
+
     def add_images_to_video(self, video_clip, images):
         """Add images to the video at specified intervals throughout the entire video duration."""
         clips = [video_clip]
         image_duration = 5  # Display each image for 5 seconds
         video_duration = video_clip.duration
+        image_box = self.image_box(video_clip.w, video_clip.h)
         
         for i, image_path in enumerate(images):
             if image_path is not None:
                 try:
-                    image_clip = ImageClip(image_path).set_duration(image_duration)
+                    # Decode at display size (JPEG draft mode) instead of the full-resolution file
+                    image_clip = ImageClip(load_image(image_path, image_box)).set_duration(image_duration)
                     image_clip = image_clip.set_position(('center', 70)).resize(height=video_clip.h / 3)
                     
                     # Calculate start time for each image
@@ -299,6 +517,7 @@ class VideoEditor:
         
         return CompositeVideoClip(clips)
 
+    @tracing.traced('encode')
     def render_final_video(self, final_clip) -> str:
         """Render the final video with all components added."""
         unique_id = uuid.uuid4()
@@ -306,14 +525,10 @@ class VideoEditor:
         os.makedirs(result_dir, exist_ok=True)
         output_path = os.path.join(result_dir, f"final_video_{unique_id}.mp4")
         
-        # Ensure even dimensions
-        width, height = final_clip.w, final_clip.h
-        if width % 2 != 0:
-            width -= 1
-        if height % 2 != 0:
-            height -= 1
-        
-        final_clip = final_clip.resize(newsize=(width, height))
+        # Ensure even dimensions; trimming the odd row/column is a slice, a resize would resample every frame
+        width, height = final_clip.w // 2 * 2, final_clip.h // 2 * 2
+        if (width, height) != (final_clip.w, final_clip.h):
+            final_clip = final_clip.crop(x1=0, y1=0, width=width, height=height)
         
         final_clip.write_videofile(
             output_path,
@@ -322,10 +537,12 @@ class VideoEditor:
             ffmpeg_params=['-crf', '10', '-pix_fmt', 'yuv420p'],
             audio_codec='aac',
             audio_bitrate='128k',
+            temp_audiofile=scratch_path(f"final_video_{unique_id}_audio.m4a", default_dir=result_dir),
             fps=30
 
         )
         
+        tracing.record(bytes=os.path.getsize(output_path))
         logging.info("Final video rendered successfully.")
         return output_path
     
@@ -333,6 +550,8 @@ class VideoEditor:
         """Delete temporary files and generated images to clean up the workspace."""
         # Clean up temporary files
         for file_path in file_paths:
+            if not file_path:
+                continue  # e.g. no cut file in lazy cut mode
             try:
                 if os.path.exists(file_path):
                     os.remove(file_path)
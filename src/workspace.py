@@ -0,0 +1,157 @@
+import os
+import uuid
+import atexit
+import signal
+import shutil
+import asyncio
+import logging
+import tempfile
+import threading
+import functools
+from contextvars import ContextVar
+
+# The workspace of the job running in the current task; asyncio tasks and to_thread calls inherit it
+current_workspace = ContextVar('current_workspace', default=None)
+
+# Workspaces still on disk, removed at interpreter exit if a job never got to clean up
+_live_workspaces = set()
+
+
+def scratch_root(use_tmpfs: bool = None) -> str:
+    """Where job workspaces are created.
+
+    TURBOREEL_SCRATCH_DIR wins; otherwise TURBOREEL_SCRATCH_TMPFS=1 (or use_tmpfs=True)
+    selects /dev/shm when it exists, so intermediates never touch the persistent disk.
+    """
+    if os.getenv('TURBOREEL_SCRATCH_DIR'):
+        return os.getenv('TURBOREEL_SCRATCH_DIR')
+    if use_tmpfs is None:
+        use_tmpfs = os.getenv('TURBOREEL_SCRATCH_TMPFS', '0') == '1'
+    if use_tmpfs:
+        if os.path.isdir('/dev/shm'):
+            return '/dev/shm'
+        logging.warning("tmpfs requested but /dev/shm is not available, using the system temp dir.")
+    return tempfile.gettempdir()
+
+
+class Workspace:
+    """An isolated scratch directory for one job's intermediate files.
+
+    Use it as a (async) context manager: it becomes the current workspace for everything
+    the job runs, and the directory is removed on every exit path, including errors
+    and cancellation.
+    """
+
+    def __init__(self, job_id: str = None, root: str = None, use_tmpfs: bool = None, keep: bool = False):
+        self.job_id = job_id or uuid.uuid4().hex[:12]
+        root = root or scratch_root(use_tmpfs)
+        os.makedirs(root, exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix=f"turboreel_{self.job_id}_", dir=root)
+        self.keep = keep
+        self._tokens = []
+        _live_workspaces.add(self)
+        install_termination_cleanup()
+
+    @classmethod
+    def borrowed(cls, path: str, job_id: str = None) -> 'Workspace':
+        """The existing workspace at path, created by another process (e.g. for a job a render worker renders).
+
+        Make it current with current_workspace.set(); it is never removed from here.
+        """
+        workspace = cls.__new__(cls)
+        workspace.job_id = job_id or uuid.uuid4().hex[:12]
+        workspace.path = path
+        workspace.keep = True
+        workspace._tokens = []
+        return workspace
+
+    def dir(self, *parts) -> str:
+        """Return (and create) a subdirectory of the workspace."""
+        path = os.path.join(self.path, *parts)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def file(self, filename: str, subdir: str = None) -> str:
+        """Return the path of a file inside the workspace."""
+        return os.path.join(self.dir(subdir) if subdir else self.path, filename)
+
+    def cleanup(self):
+        _live_workspaces.discard(self)
+        if self.keep:
+            logging.info(f"Keeping workspace {self.path}")
+            return
+        shutil.rmtree(self.path, ignore_errors=True)
+        logging.info(f"Removed workspace {self.path}")
+
+    async def acleanup(self):
+        """cleanup() in a thread, a large workspace takes a while to delete."""
+        await asyncio.to_thread(self.cleanup)
+
+    def __enter__(self):
+        self._tokens.append(current_workspace.set(self))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        current_workspace.reset(self._tokens.pop())
+        self.cleanup()
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        current_workspace.reset(self._tokens.pop())
+        await self.acleanup()
+        return False
+
+
+def scratch_path(filename: str, subdir: str = None, default_dir: str = None) -> str:
+    """Path for an intermediate file.
+
+    Inside a job it lives in the job's workspace; outside one (e.g. a component used on its
+    own) it falls back to default_dir, the module's old shared assets folder.
+    """
+    workspace = current_workspace.get()
+    if workspace is not None:
+        return workspace.file(filename, subdir)
+    directory = os.path.join(default_dir, subdir) if subdir else default_dir
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, filename)
+
+
+def scoped(func):
+    """Run an async engine entry point inside its own workspace, unless a job workspace is already active."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if current_workspace.get() is not None:
+            return await func(*args, **kwargs)
+        async with Workspace():
+            return await func(*args, **kwargs)
+    return wrapper
+
+
+@atexit.register
+def cleanup_leftovers():
+    """Remove every workspace still on disk (at exit, or when the process is terminated)."""
+    for workspace in list(_live_workspaces):
+        workspace.cleanup()
+
+
+def _terminated(signum, frame):
+    cleanup_leftovers()
+    os._exit(128 + signum)
+
+
+def install_termination_cleanup() -> bool:
+    """Remove the live workspaces on SIGTERM as well, where atexit handlers do not run.
+
+    The process then exits at once with 128 + SIGTERM. Called when a workspace is
+    created; a SIGTERM handler installed by someone else (e.g. uvicorn) is left alone,
+    and handlers can only be installed from the main thread. Returns whether it is installed.
+    """
+    if signal.getsignal(signal.SIGTERM) is _terminated:
+        return True
+    if threading.current_thread() is not threading.main_thread() or signal.getsignal(signal.SIGTERM) != signal.SIG_DFL:
+        return False
+    signal.signal(signal.SIGTERM, _terminated)
+    return True
@@ -0,0 +1,21 @@
+import pytest
+
+
+@pytest.fixture
+def make_video(tmp_path):
+    """Factory writing short synthetic test videos with moviepy's ffmpeg (skips without moviepy)."""
+    pytest.importorskip('moviepy')
+    from src.ffmpeg_tools import run_ffmpeg
+
+    def make(name='clip.mp4', seconds=2, size=(320, 180), fps=25, gop=25, audio=True):
+        path = str(tmp_path / name)
+        width, height = size
+        args = ['-f', 'lavfi', '-i', f'testsrc=size={width}x{height}:rate={fps}:duration={seconds}']
+        if audio:
+            args += ['-f', 'lavfi', '-i', f'sine=frequency=440:duration={seconds}']
+        args += ['-c:v', 'libx264', '-preset', 'ultrafast', '-g', gop, '-pix_fmt', 'yuv420p']
+        if audio:
+            args += ['-c:a', 'aac', '-shortest']
+        run_ffmpeg(args + [path])
+        return path
+    return make
@@ -0,0 +1,167 @@
+import os
+import time
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip('yt_dlp')
+pytest.importorskip('moviepy')
+pytest.importorskip('mutagen')
+
+from src import background_library
+from src.background_library import BackgroundLibrary
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    monkeypatch.setattr(background_library, 'keyframe_times', lambda path: [0.0, 1.0])
+
+    def no_network(*args, **kwargs):
+        raise AssertionError("the library went to the network")
+
+    monkeypatch.setattr(background_library, 'YoutubeDL', no_network)
+    return BackgroundLibrary(str(tmp_path / 'library'))
+
+
+@pytest.fixture
+def videos(make_video):
+    return {'short': make_video('short.mp4', seconds=1, audio=False), 'long': make_video('long.mp4', seconds=3, audio=False)}
+
+
+def test_add_file_indexes_headers_and_keyframes(library, videos):
+    entry = library.add_file(videos['long'], video_id='youtube:abcdefghijk', source_url='https://youtu.be/abcdefghijk')
+    assert entry['path'] == os.path.abspath(videos['long'])
+    assert entry['duration'] == pytest.approx(3.0, abs=0.1)
+    assert (entry['width'], entry['height']) == (320, 180)
+    assert entry['fps'] == pytest.approx(25)
+    assert entry['keyframes'] == [0.0, 1.0]
+    assert library.get('youtube:abcdefghijk') == entry
+    assert library.lookup_path(videos['long']) == entry
+
+
+def test_index_persists_across_instances(library, videos):
+    library.add_file(videos['long'], video_id='vimeo:1', source_url='https://vimeo.com/1')
+    reopened = BackgroundLibrary(library.root)
+    assert reopened.get('vimeo:1')['path'] == os.path.abspath(videos['long'])
+    # The URL was recorded, so its ID is known without asking the network
+    assert reopened.canonical_id('https://vimeo.com/1') == 'vimeo:1'
+
+
+def test_youtube_ids_are_read_from_the_url(library):
+    assert library.canonical_id('https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=10') == 'youtube:dQw4w9WgXcQ'
+    assert library.canonical_id('https://youtu.be/a_b-c_d-e_f') == 'youtube:a_b-c_d-e_f'
+    assert library.canonical_id('https://youtube.com/shorts/dQw4w9WgXcQ') == 'youtube:dQw4w9WgXcQ'
+
+
+def test_pick_respects_the_minimum_duration(library, videos):
+    library.add_file(videos['short'], video_id='file:short')
+    library.add_file(videos['long'], video_id='file:long')
+    assert library.pick(2.0)['video_id'] == 'file:long'
+    assert library.pick(10.0) is None
+    assert [entry['video_id'] for entry in library.list()] == ['file:short', 'file:long']
+
+
+def test_missing_files_are_dropped(library, videos):
+    library.add_file(videos['short'], video_id='file:short')
+    os.remove(videos['short'])
+    assert library.get('file:short') is None
+    assert library.list() == []
+
+
+def test_fetch_hits_the_library_without_downloading(library, videos):
+    library.add_file(videos['long'], video_id='youtube:dQw4w9WgXcQ')
+    entry = library.fetch('https://www.youtube.com/watch?v=dQw4w9WgXcQ')
+    assert entry['path'] == os.path.abspath(videos['long'])
+    assert entry['reused'] is True
+
+
+def test_duration_of_reads_the_index(library, videos, monkeypatch):
+    library.add_file(videos['long'], video_id='file:long')
+    monkeypatch.setattr(background_library.media_probe, 'duration', lambda path: pytest.fail("probed again"))
+    assert library.duration_of(videos['long']) == pytest.approx(3.0, abs=0.1)
+
+
+def add_sections(library, make_video, video_id, count):
+    return [
+        library.add_file(make_video(f'section{i}.mp4', seconds=1, audio=False), video_id=f'{video_id}#{i}-{i + 1}')
+        for i in range(count)
+    ]
+
+
+def test_sections_do_not_treat_underscores_as_wildcards(library, make_video):
+    add_sections(library, make_video, 'youtube:a_b', 1)
+    library.add_file(make_video('other.mp4', seconds=1, audio=False), video_id='youtube:aXb#0-1')
+    assert [entry['video_id'] for entry in library.sections('youtube:a_b')] == ['youtube:a_b#0-1']
+
+
+def test_trim_keeps_leased_sections(library, make_video):
+    library.section_pool = 1
+    oldest, newest = add_sections(library, make_video, 'youtube:abcdefghijk', 2)
+    lease_id = library.lease(oldest['path'])
+    library._trim_sections('youtube:abcdefghijk')
+    # The section in use survives; the pool is trimmed from the next one instead
+    assert os.path.exists(oldest['path'])
+    assert not os.path.exists(newest['path'])
+    library.release(lease_id)
+    library.add_file(make_video('section2.mp4', seconds=1, audio=False), video_id='youtube:abcdefghijk#2-3')
+    library._trim_sections('youtube:abcdefghijk')
+    assert [entry['video_id'] for entry in library.sections('youtube:abcdefghijk')] == ['youtube:abcdefghijk#2-3']
+
+
+def test_stale_leases_do_not_protect_sections(library, make_video):
+    library.section_pool = 1
+    library.lease_timeout = 0
+    oldest, newest = add_sections(library, make_video, 'youtube:abcdefghijk', 2)
+    library.lease(oldest['path'])
+    library._trim_sections('youtube:abcdefghijk')
+    assert not os.path.exists(oldest['path'])
+    assert os.path.exists(newest['path'])
+
+
+def test_reused_sections_are_leased(library, make_video):
+    library.section_pool = 1
+    library.lease_timeout = 3600
+    section, = add_sections(library, make_video, 'youtube:abcdefghijk', 1)
+    resolved = {'entry': None, 'video_id': 'youtube:abcdefghijk', 'url': 'https://youtu.be/abcdefghijk', 'duration': 60.0, 'info': None}
+    entry = library.fetch_section(resolved, 0.5)
+    assert entry['path'] == section['path'] and entry['reused'] is True
+    library.add_file(make_video('section1.mp4', seconds=1, audio=False), video_id='youtube:abcdefghijk#1-2')
+    library._trim_sections('youtube:abcdefghijk')
+    assert os.path.exists(section['path'])
+    library.release(entry['lease_id'])
+    library.add_file(make_video('section2.mp4', seconds=1, audio=False), video_id='youtube:abcdefghijk#2-3')
+    library._trim_sections('youtube:abcdefghijk')
+    assert not os.path.exists(section['path'])
+
+
+def test_concurrent_fetches_download_once(library, make_video, monkeypatch):
+    source = make_video('download.mp4', seconds=1, audio=False)
+    downloads = []
+
+    class FakeYoutubeDL:
+        def __init__(self, opts):
+            self.outtmpl = opts['outtmpl']
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def extract_info(self, url, download=False):
+            downloads.append(url)
+            time.sleep(0.2)  # Long enough for the other thread to ask for the same video
+            info = {'extractor_key': 'Youtube', 'id': 'abcdefghijk', 'ext': 'mp4'}
+            shutil.copy(source, self.prepare_filename(info))
+            return info
+
+        def prepare_filename(self, info):
+            return self.outtmpl % info
+
+    monkeypatch.setattr(background_library, 'YoutubeDL', FakeYoutubeDL)
+    with ThreadPoolExecutor(2) as pool:
+        entries = list(pool.map(library.fetch, ['https://youtu.be/abcdefghijk'] * 2))
+    assert len(downloads) == 1
+    assert entries[0]['path'] == entries[1]['path']
+    assert sorted(entry['reused'] for entry in entries) == [False, True]
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('httpx')
+
+from src import http_session
+
+
+def test_client_is_shared_within_a_loop():
+    async def main():
+        first = http_session.get_client()
+        second = http_session.get_client()
+        await http_session.close()
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert first is second
+
+
+def test_each_loop_gets_its_own_client():
+    async def main():
+        client = http_session.get_client()
+        await http_session.close()
+        return client
+
+    # A client bound to a finished loop must not be handed to the next one
+    assert asyncio.run(main()) is not asyncio.run(main())
+
+
+def test_closed_client_is_replaced():
+    async def main():
+        client = http_session.get_client()
+        await client.aclose()
+        replacement = http_session.get_client()
+        replacement_open = not replacement.is_closed
+        await http_session.close()
+        return client, replacement, replacement_open
+
+    client, replacement, replacement_open = asyncio.run(main())
+    assert replacement is not client
+    assert replacement_open
+
+
+def test_host_limits(monkeypatch):
+    monkeypatch.setitem(http_session.settings, 'host_limits', {'image.pollinations.ai': 2})
+    monkeypatch.setitem(http_session.settings, 'max_per_host', 5)
+
+    async def main():
+        session = http_session._session()
+        limited = session.host_semaphore('https://Image.Pollinations.ai/prompt/cat')
+        same_host = session.host_semaphore('https://image.pollinations.ai/prompt/dog')
+        other = session.host_semaphore('https://pixabay.com/api/')
+        await http_session.close()
+        return limited, same_host, other
+
+    limited, same_host, other = asyncio.run(main())
+    assert limited is same_host
+    assert limited._value == 2
+    assert other._value == 5
+
+
+def test_parse_host_limits_skips_invalid_items():
+    assert http_session._parse_host_limits('a.com=3, B.com=4,bad=x,,') == {'a.com': 3, 'b.com': 4}
@@ -0,0 +1,109 @@
+import os
+import asyncio
+
+import pytest
+
+pytest.importorskip('httpx')
+pytest.importorskip('PIL')
+
+from src import tracing
+from src.image_acquisition import ImageAcquisition, ImageProvider
+from src.provider_health import ProviderRegistry
+
+
+class FakeProvider(ImageProvider):
+    """Writes its name into the output file after delay seconds; records cancellation."""
+
+    def __init__(self, name, delay, result=True):
+        self.name = name
+        self.delay = delay
+        self.result = result
+        self.started_at = None
+        self.cancelled = False
+
+    async def fetch(self, query, output_path, target_size=None):
+        self.started_at = asyncio.get_running_loop().time()
+        # A partial file, as a download cut short would leave
+        with open(output_path, 'w') as f:
+            f.write('partial')
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if not self.result:
+            os.remove(output_path)
+            return None
+        with open(output_path, 'w') as f:
+            f.write(self.name)
+        return output_path
+
+
+def acquire(acquisition, output_path):
+    async def main():
+        started = asyncio.get_running_loop().time()
+        with tracing.Trace(export=False) as trace:
+            path = await acquisition.acquire('a cat', output_path)
+        return path, started, trace
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def output_path(tmp_path):
+    return str(tmp_path / 'images' / 'scene.jpg')
+
+
+def test_slow_primary_is_hedged_and_cancelled(output_path):
+    slow, fast = FakeProvider('pollinations', 5), FakeProvider('pexels', 0.01)
+    acquisition = ImageAcquisition([slow, fast], hedge=True, initial_hedge_delay=0.05, registry=ProviderRegistry())
+    path, started, trace = acquire(acquisition, output_path)
+
+    assert path == output_path
+    assert open(path).read() == 'pexels'
+    # The hedge starts after the hedge delay, not at once and not after the primary gives up
+    assert 0.04 <= fast.started_at - started < 1
+    assert slow.cancelled
+    # No candidate file is left behind, only the winner under its final name
+    assert os.listdir(os.path.dirname(output_path)) == ['scene.jpg']
+    assert acquisition.hedge_stats()['hedge_rate'] == 1.0
+    assert acquisition.stats['hedge_wins'] == 1
+
+    summary = trace.summary()['images.acquire']
+    assert (summary['hedged'], summary['hedges'], summary['hedge_wins']) == (1, 1, 1)
+    assert 'turboreel_span_hedge_wins_total{span="images.acquire"}' in tracing.metrics.prometheus()
+
+    # The cancelled primary leaves a censored latency sample of at least the hedge delay
+    assert acquisition.registry.health('pollinations').latencies[0] >= (0.04, False)
+
+
+def test_fast_primary_is_not_hedged(output_path):
+    primary, fallback = FakeProvider('pollinations', 0.01), FakeProvider('pexels', 0.01)
+    acquisition = ImageAcquisition([primary, fallback], hedge=True, initial_hedge_delay=1, registry=ProviderRegistry())
+    path, _, trace = acquire(acquisition, output_path)
+
+    assert open(path).read() == 'pollinations'
+    assert fallback.started_at is None
+    assert acquisition.stats['hedged_requests'] == 0
+    assert trace.summary()['images.acquire']['hedges'] == 0
+
+
+def test_primary_win_over_a_hedge_cancels_the_hedge(output_path):
+    primary, hedge = FakeProvider('pollinations', 0.1), FakeProvider('pexels', 5)
+    acquisition = ImageAcquisition([primary, hedge], hedge=True, initial_hedge_delay=0.02, registry=ProviderRegistry())
+    path, _, trace = acquire(acquisition, output_path)
+
+    assert open(path).read() == 'pollinations'
+    assert hedge.cancelled
+    assert os.listdir(os.path.dirname(output_path)) == ['scene.jpg']
+    summary = trace.summary()['images.acquire']
+    assert (summary['hedged'], summary['hedges'], summary['hedge_wins']) == (1, 1, 0)
+
+
+def test_empty_result_falls_back_without_waiting(output_path):
+    empty, fallback = FakeProvider('pollinations', 0.01, result=False), FakeProvider('pexels', 0.01)
+    acquisition = ImageAcquisition([empty, fallback], hedge=True, initial_hedge_delay=5, registry=ProviderRegistry())
+    path, started, _ = acquire(acquisition, output_path)
+
+    assert open(path).read() == 'pexels'
+    assert fallback.started_at - started < 1
+    assert acquisition.stats['hedges_launched'] == 0
@@ -0,0 +1,86 @@
+import json
+import types
+import asyncio
+
+import pytest
+
+pytest.importorskip('openai')
+pytest.importorskip('httpx')
+pytest.importorskip('PIL')
+pytest.importorskip('pysrt')
+pytest.importorskip('dotenv')
+
+from src import image_handler
+from src.image_handler import ImageHandler
+
+
+class FakeCompletions:
+    """Answers chat completions with the given contents, in order; records the requests."""
+
+    def __init__(self, *contents):
+        self.contents = list(contents)
+        self.requests = []
+
+    async def create(self, **kwargs):
+        self.requests.append(kwargs)
+        message = types.SimpleNamespace(content=self.contents.pop(0))
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+
+@pytest.fixture
+def handler(monkeypatch, tmp_path):
+    completions = FakeCompletions()
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=completions))
+    monkeypatch.setattr(ImageHandler, 'openai', property(lambda self: client))
+    monkeypatch.setattr(image_handler, 'scratch_path', lambda filename, *args, **kwargs: str(tmp_path / filename))
+    handler = ImageHandler('pexels-key', 'openai-key')
+    handler.completions = completions
+    return handler
+
+
+def queries(*items):
+    return json.dumps({'queries': [{'id': index, 'query': query} for index, query in items]})
+
+
+def test_batch_response_is_aligned_by_id(handler):
+    handler.completions.contents.append(queries((1, ' Rainy street '), (0, 'Sunset beach')))
+    refined = asyncio.run(handler.refine_keywords_batch(['the sun set', 'it rained'], 'a summer story'))
+    assert refined == ['Sunset beach', 'Rainy street']
+
+    request = handler.completions.requests[0]
+    assert request['response_format'] == {'type': 'json_object'}
+    assert json.loads(request['messages'][1]['content'].split('Phrases: ')[1]) == [
+        {'id': 0, 'phrase': 'the sun set'}, {'id': 1, 'phrase': 'it rained'}
+    ]
+
+
+def test_missing_and_invalid_items_keep_the_original_phrase(handler):
+    handler.completions.contents.append(json.dumps({'queries': [
+        {'id': 0, 'query': 'Sunset beach'},
+        {'id': 7, 'query': 'Out of range'},
+        {'id': '2', 'query': 'Not an int'},
+        {'id': 1, 'query': ''},
+        'not an object',
+    ]}))
+    refined = asyncio.run(handler.refine_keywords_batch(['a', 'b', 'c'], 'topic'))
+    assert refined == ['Sunset beach', 'b', 'c']
+
+
+def test_malformed_json_falls_back_to_the_original_phrases(handler, monkeypatch):
+    handler.keywords_per_request = 2
+    handler.completions.contents += ['{"queries": [', queries((0, 'Query C'), (1, 'Query D'))]
+    monkeypatch.setattr(handler, 'extract_keywords_from_subtitles', lambda subtitles, duration: ['a', 'b', 'c', 'd'])
+    searched = []
+
+    async def acquire(query, output_path, target_size=None):
+        searched.append(query)
+        return None if query == 'b' else output_path
+
+    monkeypatch.setattr(handler.image_acquisition, 'acquire', acquire)
+    paths = asyncio.run(handler.get_images_from_subtitles(None, 'topic', 20))
+
+    # One request per chunk; the malformed one keeps its phrases, the other is refined
+    assert len(handler.completions.requests) == 2
+    assert sorted(searched) == ['Query C', 'Query D', 'a', 'b']
+    assert paths[1] is None
+    assert all(paths[index] for index in (0, 2, 3))
@@ -0,0 +1,66 @@
+import json
+import types
+import asyncio
+
+import pytest
+
+pytest.importorskip('openai')
+pytest.importorskip('moviepy')
+pytest.importorskip('pysrt')
+pytest.importorskip('PIL')
+pytest.importorskip('dotenv')
+
+from src.video_editor import VideoEditor
+
+SCENES = ['A dog runs on the beach', 'The dog finds a shell', 'Sunset over the sea']
+
+
+class FakeCompletions:
+    """Answers the batched request with batch_content and single-scene requests with a prompt per scene."""
+
+    def __init__(self, batch_content):
+        self.batch_content = batch_content
+        self.requests = []
+
+    async def create(self, **kwargs):
+        self.requests.append(kwargs)
+        if 'response_format' in kwargs:
+            content = self.batch_content
+        else:
+            scene = kwargs['messages'][1]['content'].split('"')[1]
+            content = json.dumps({'image_prompt': f"single: {scene}"})
+        message = types.SimpleNamespace(content=content)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+
+def prompts_for(batch_content, monkeypatch):
+    completions = FakeCompletions(batch_content)
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=completions))
+    monkeypatch.setattr(VideoEditor, 'openai', property(lambda self: client))
+    editor = VideoEditor.__new__(VideoEditor)  # No background library needed
+    prompts = asyncio.run(editor.gpt_image_prompts_from_scenes(SCENES, 'A dog at the beach'))
+    return prompts, completions.requests
+
+
+def batch(*items):
+    return json.dumps({'image_prompts': [{'id': index, 'image_prompt': prompt} for index, prompt in items]})
+
+
+def test_all_prompts_in_one_request(monkeypatch):
+    prompts, requests = prompts_for(batch((2, 'sunset'), (0, 'dog running'), (1, 'shell')), monkeypatch)
+    assert prompts == ['dog running', 'shell', 'sunset']
+    assert len(requests) == 1
+    scenes = json.loads(requests[0]['messages'][1]['content'].split('Scenes: ')[1])
+    assert [scene['id'] for scene in scenes] == [0, 1, 2]
+
+
+def test_missing_scenes_fall_back_one_at_a_time(monkeypatch):
+    prompts, requests = prompts_for(batch((0, 'dog running'), (9, 'out of range'), (2, '')), monkeypatch)
+    assert prompts == ['dog running', f"single: {SCENES[1]}", f"single: {SCENES[2]}"]
+    assert len(requests) == 3
+
+
+def test_malformed_json_falls_back_for_every_scene(monkeypatch):
+    prompts, requests = prompts_for('{"image_prompts": [{"id": 0,', monkeypatch)
+    assert prompts == [f"single: {scene}" for scene in SCENES]
+    assert len(requests) == 1 + len(SCENES)
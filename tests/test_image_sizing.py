@@ -0,0 +1,90 @@
+import pytest
+
+pytest.importorskip('httpx')
+Image = pytest.importorskip('PIL.Image')
+
+from src.image_acquisition import PexelsProvider, PixabayProvider, PollinationsProvider, fitted_size, load_image
+
+PEXELS_PHOTO = {
+    'width': 4000, 'height': 6000,
+    'src': {'original': 'original', 'large2x': 'large2x', 'large': 'large', 'medium': 'medium'},
+}
+
+
+def test_fitted_size_with_an_unconstrained_side():
+    assert fitted_size((4000, 6000), (None, 350)) == (234, 350)
+    assert fitted_size((4000, 6000), (940, 650)) == (434, 650)
+
+
+@pytest.mark.parametrize('target_size, variant', [
+    (None, 'original'),
+    ((None, 300), 'medium'),
+    ((None, 600), 'large'),
+    ((None, 1200), 'large2x'),
+    ((None, 5000), 'original'),
+])
+def test_pexels_picks_the_smallest_covering_variant(target_size, variant):
+    assert PexelsProvider('key').pick_variant(PEXELS_PHOTO, target_size) == variant
+
+
+def test_pexels_without_dimensions_uses_the_original():
+    photo = dict(PEXELS_PHOTO, width=None)
+    assert PexelsProvider('key').pick_variant(photo, (None, 300)) == 'original'
+
+
+@pytest.mark.parametrize('hit, target_size, url', [
+    ({'imageWidth': 4000, 'imageHeight': 3000, 'webformatWidth': 640, 'webformatHeight': 480}, (None, 400), 'web'),
+    ({'imageWidth': 4000, 'imageHeight': 3000, 'webformatWidth': 640, 'webformatHeight': 480}, (None, 900), 'large'),
+    ({'imageWidth': 0, 'imageHeight': 3000, 'webformatWidth': 640, 'webformatHeight': 480}, (None, 400), 'large'),
+    ({'webformatWidth': 640, 'webformatHeight': 480}, (None, 400), 'large'),
+    ({'imageWidth': 4000, 'imageHeight': 3000, 'webformatWidth': 640, 'webformatHeight': 480}, None, 'large'),
+])
+def test_pixabay_variant(hit, target_size, url):
+    hit = dict(hit, webformatURL='web', largeImageURL='large')
+    assert PixabayProvider('key').pick_variant(hit, target_size) == url
+
+
+def test_pollinations_generation_size():
+    provider = PollinationsProvider(width=1024, height=768)
+    assert provider.generation_size() == (1024, 768)
+    # Width derived from the configured aspect ratio, rounded up to a multiple of 8
+    assert provider.generation_size((None, 640)) == (856, 640)
+    assert provider.generation_size((100, 100)) == (256, 256)
+
+
+@pytest.fixture
+def jpeg(tmp_path):
+    path = tmp_path / 'photo.jpg'
+    Image.new('RGB', (3200, 1600), (200, 40, 40)).save(path, quality=90)
+    return str(path)
+
+
+def test_load_image_decodes_jpegs_in_draft_mode(jpeg, monkeypatch):
+    from PIL import JpegImagePlugin
+    drafts = []
+    draft = JpegImagePlugin.JpegImageFile.draft
+
+    def spy(self, mode, size, *args, **kwargs):
+        drafts.append(size)
+        return draft(self, mode, size, *args, **kwargs)
+
+    monkeypatch.setattr(JpegImagePlugin.JpegImageFile, 'draft', spy)
+    image = load_image(jpeg, (None, 300))
+    assert drafts == [(600, 300)]
+    assert image.shape == (300, 600, 3)
+
+
+def test_load_image_does_not_upscale(tmp_path):
+    path = tmp_path / 'small.png'
+    Image.new('RGBA', (100, 50)).save(path)
+    assert load_image(str(path), (None, 300)).shape == (50, 100, 4)
+
+
+def test_load_image_without_target_keeps_the_full_size(jpeg):
+    assert load_image(jpeg).shape == (1600, 3200, 3)
+
+
+def test_load_image_converts_palette_images(tmp_path):
+    path = tmp_path / 'palette.gif'
+    Image.new('P', (40, 20)).save(path)
+    assert load_image(str(path), (None, 10)).shape == (10, 20, 3)
@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip('fastapi')
+pytest.importorskip('httpx')
+pytest.importorskip('multipart')
+
+from fastapi.testclient import TestClient
+
+from src import job_server, tracing
+from src.job_server import JobManager
+
+# Released by the tests to let the fake engine finish
+release = threading.Event()
+
+
+async def fake_engine(job_id, engine, params):
+    with tracing.span('fake.stage', engine=engine):
+        while not release.is_set():
+            await asyncio.sleep(0.01)
+    return {'status': 'success', 'message': 'done', 'output_path': None}
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    release.clear()
+    monkeypatch.setattr(job_server, '_run_engine', fake_engine)
+    monkeypatch.setattr(job_server, 'upload_dir', str(tmp_path / 'uploads'))
+    monkeypatch.setattr(tracing, 'trace_dir', str(tmp_path / 'traces'))
+    # One job at a time, renders in threads, room for one queued job
+    monkeypatch.setattr(job_server, 'manager', JobManager(concurrency=1, render_workers=0, max_queued=1))
+    with TestClient(job_server.app) as client:
+        yield client
+    release.set()
+
+
+def submit(client, engine='reddit', **params):
+    return client.post('/jobs', json={'engine': engine, 'params': params or {'video_topic': 'cats'}})
+
+
+def wait_for(client, job_id, status, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f'/jobs/{job_id}').json()
+        if job['status'] == status:
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} is {job['status']}, not {status}")
+
+
+def test_submit_runs_the_job(client):
+    response = submit(client)
+    assert response.status_code == 202
+    job_id = response.json()['job_id']
+    wait_for(client, job_id, 'running')
+    release.set()
+    job = wait_for(client, job_id, 'succeeded')
+    assert job['result']['message'] == 'done'
+    trace = client.get(f'/jobs/{job_id}/trace').json()
+    assert [span['name'] for span in trace['spans']] == ['fake.stage']
+
+
+def test_full_queue_is_answered_with_429(client):
+    running = submit(client).json()['job_id']
+    wait_for(client, running, 'running')
+    assert submit(client).status_code == 202
+    response = submit(client)
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '30'
+
+
+def test_cancelling_a_queued_job_frees_its_slot(client):
+    running = submit(client).json()['job_id']
+    wait_for(client, running, 'running')
+    queued = submit(client).json()['job_id']
+    assert client.delete(f'/jobs/{queued}').json()['status'] == 'cancelled'
+    assert submit(client).status_code == 202
+    # A finished job cannot be cancelled again
+    assert client.delete(f'/jobs/{queued}').status_code == 409
+
+
+def test_cancelling_a_running_job(client):
+    job_id = submit(client).json()['job_id']
+    wait_for(client, job_id, 'running')
+    assert client.delete(f'/jobs/{job_id}').status_code == 200
+    wait_for(client, job_id, 'cancelled')
+    # The slot is free again
+    next_job = submit(client).json()['job_id']
+    wait_for(client, next_job, 'running')
+
+
+def test_events_stream_status_and_spans(client):
+    job_id = submit(client).json()['job_id']
+    wait_for(client, job_id, 'running')
+    release.set()
+    events = []
+    with client.stream('GET', f'/jobs/{job_id}/events') as response:
+        assert response.headers['content-type'].startswith('text/event-stream')
+        for line in response.iter_lines():
+            if line.startswith('data: '):
+                events.append(json.loads(line[len('data: '):]))
+    assert [event['status'] for event in events if event['type'] in ('status', 'done')] == ['queued', 'running', 'succeeded']
+    spans = [(event['name'], event['state']) for event in events if event['type'] == 'span']
+    assert spans == [('fake.stage', 'started'), ('fake.stage', 'finished')]
+    assert events[-1]['type'] == 'done'
+
+
+@pytest.mark.parametrize('engine, params', [
+    ('reddit', {'video_topic': 'cats', 'output_path': '/tmp/x.mp4'}),
+    ('reddit', {'video_path_or_url': 'video_path', 'video_path': '/etc/passwd'}),
+    ('translation', {'video_path': '../uploads/../secret.mp4', 'target_language': 'fr'}),
+    ('json2video', {'json_input': {'videos': [{'video_path': '/home/me/clip.mp4'}]}}),
+    ('json2video', {'json_input': '/etc/hosts'}),
+    ('nope', {}),
+])
+def test_invalid_params_are_answered_with_422(client, engine, params):
+    assert submit(client, engine, **params).status_code == 422
+
+
+def test_uploaded_paths_are_accepted(client):
+    path = client.post('/uploads', files={'file': ('clip.mp4', b'data')}).json()['path']
+    response = submit(client, 'reddit', video_path_or_url='video_path', video_path=path, video_topic='cats')
+    assert response.status_code == 202
+
+
+def test_uploads_shared_by_unfinished_jobs_are_kept(client):
+    path = client.post('/uploads', files={'file': ('clip.mp4', b'data')}).json()['path']
+    first = submit(client, 'translation', video_path=path, target_language='fr').json()['job_id']
+    wait_for(client, first, 'running')
+    second = submit(client, 'translation', video_path=path, target_language='de').json()['job_id']
+    client.delete(f'/jobs/{first}')
+    wait_for(client, first, 'cancelled')
+    # The second job still needs the file
+    assert wait_for(client, second, 'running')
+    assert os.path.exists(path)
+    release.set()
+    wait_for(client, second, 'succeeded')
+    assert not os.path.exists(path)
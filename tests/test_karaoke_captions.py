@@ -0,0 +1,79 @@
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+pytest.importorskip('moviepy')
+pytest.importorskip('openai')
+pytest.importorskip('PIL')
+pytest.importorskip('pysrt')
+pytest.importorskip('dotenv')
+
+from src.captions.caption_handler import CaptionHandler
+from src.captions.video_captioner import VideoCaptioner
+from src.captions.subtitle_generator import SubtitleGenerator
+from src.captions.utils import convert_seconds_to_srt_time
+
+WORDS = [
+    SimpleNamespace(word=' one', start=0.0, end=0.4),
+    SimpleNamespace(word=' two', start=0.5, end=0.9),
+    SimpleNamespace(word=' three', start=1.0, end=1.4),
+    # After a pause: a new line
+    SimpleNamespace(word=' four', start=2.5, end=3.0),
+]
+
+
+@pytest.fixture
+def handler():
+    handler = CaptionHandler.__new__(CaptionHandler)
+    handler.video_captioner = VideoCaptioner()
+
+    async def transcribe_words(audio_file):
+        pytest.fail("the words were transcribed again")
+
+    handler.subtitle_generator = SimpleNamespace(transcribe_words=transcribe_words)
+    return handler
+
+
+def yellow_pixels(frame):
+    return int(np.sum((frame[..., 0] > 200) & (frame[..., 1] > 200) & (frame[..., 2] < 80)))
+
+
+def yellow_columns(frame):
+    columns = np.nonzero((frame[..., 0] > 200) & (frame[..., 1] > 200) & (frame[..., 2] < 80))[1]
+    return columns.min(), columns.max()
+
+
+def test_karaoke_renders_the_given_words(handler):
+    clips = asyncio.run(handler.render_word_highlight(WORDS, font_size=40, width=540))
+    assert len(clips) == 2
+    assert [clip.start for clip in clips] == [0.0, 2.5]
+    assert clips[0].duration == pytest.approx(1.4)
+    assert clips[1].duration == pytest.approx(0.5)
+
+
+def test_karaoke_highlights_the_spoken_word(handler):
+    line = asyncio.run(handler.render_word_highlight(WORDS, font_size=40, width=540))[0]
+    first, second = line.get_frame(0.1), line.get_frame(0.6)
+    assert first.shape == second.shape
+    assert yellow_pixels(first) > 0 and yellow_pixels(second) > 0
+    # The highlight moves right, from 'ONE' to 'TWO'
+    assert yellow_columns(first)[1] < yellow_columns(second)[0]
+
+
+def test_process_transcribes_once_for_subtitles_and_karaoke(handler):
+    calls = []
+
+    async def transcribe_words(audio_file):
+        calls.append(audio_file)
+        return WORDS
+
+    generator = SubtitleGenerator.__new__(SubtitleGenerator)
+    generator.convert_seconds_to_srt_time = convert_seconds_to_srt_time
+    generator.transcribe_words = transcribe_words
+    handler.subtitle_generator = generator
+    subtitles, clips = asyncio.run(handler.process('story.mp3', font_size=40, style='karaoke'))
+    assert calls == ['story.mp3']
+    assert [text for _, _, text in subtitles] == ['one two', 'three four']
+    assert len(clips) == 2
@@ -0,0 +1,63 @@
+import pytest
+
+pytest.importorskip('moviepy')
+pytest.importorskip('yt_dlp')
+pytest.importorskip('mutagen')
+pytest.importorskip('openai')
+pytest.importorskip('pysrt')
+pytest.importorskip('PIL')
+pytest.importorskip('dotenv')
+
+import numpy as np
+from moviepy.editor import VideoFileClip
+
+from src import background_library, ffmpeg_tools, video_editor
+from src.background_library import BackgroundLibrary
+from src.video_editor import VideoEditor
+
+
+@pytest.fixture
+def no_ffprobe(monkeypatch):
+    # The imageio-ffmpeg build moviepy installs ships ffmpeg only
+    monkeypatch.setattr(ffmpeg_tools, 'ffprobe_exe', lambda: None)
+
+
+@pytest.fixture
+def editor(tmp_path):
+    editor = VideoEditor.__new__(VideoEditor)
+    editor.background_library = BackgroundLibrary(str(tmp_path / 'library'))
+    return editor
+
+
+def test_keyframes_without_ffprobe(make_video, no_ffprobe):
+    video = make_video(seconds=4, gop=25, audio=False)
+    assert ffmpeg_tools.keyframe_times(video) == [0.0, 1.0, 2.0, 3.0]
+
+
+def test_keyframe_index_is_cached(make_video, editor, no_ffprobe, monkeypatch):
+    video = make_video(seconds=4, gop=50, audio=False)
+    assert editor.background_library.keyframes(video) == [0.0, 2.0]
+    monkeypatch.setattr(background_library, 'keyframe_times', lambda path: pytest.fail("probed again"))
+    assert editor.background_library.keyframes(video) == [0.0, 2.0]
+
+
+def test_background_starts_on_a_keyframe(make_video, editor, no_ffprobe, monkeypatch):
+    video = make_video(seconds=6, gop=25, audio=False)
+    monkeypatch.setattr(video_editor.random, 'uniform', lambda *args: pytest.fail("random start instead of a keyframe"))
+    starts = {editor.pick_background_start(video, 6.0, 2.5) for _ in range(30)}
+    assert starts <= {0.0, 1.0, 2.0, 3.0}
+    assert len(starts) > 1
+
+
+def test_short_background_is_looped(make_video, editor):
+    video = make_video(seconds=1, audio=False)
+    assert editor.pick_background_start(video, 1.0, 2.5) == 0.0
+
+    clip = VideoFileClip(video)
+    try:
+        looped = VideoEditor._section(clip, 0.0, 2.5)
+        assert looped.duration == pytest.approx(2.5)
+        # The second pass shows the same frames as the first
+        assert np.array_equal(looped.get_frame(1.5), clip.get_frame(0.5))
+    finally:
+        clip.close()
@@ -0,0 +1,81 @@
+import os
+
+import pytest
+
+pytest.importorskip('mutagen')
+pytest.importorskip('moviepy')
+
+from src import media_probe
+
+
+@pytest.fixture
+def probes(monkeypatch):
+    """Replace the actual probing with a counter; returns the list of probed paths."""
+    calls = []
+
+    def fake_video_info(path):
+        calls.append(path)
+        return {'duration': os.path.getsize(path) / 100, 'width': 1280, 'height': 720, 'fps': 30.0}
+
+    monkeypatch.setattr(media_probe, 'video_info', fake_video_info)
+    monkeypatch.setattr(media_probe, '_cache', media_probe.OrderedDict())
+    return calls
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / 'background.mp4'
+    path.write_bytes(b'\0' * 1000)
+    return str(path)
+
+
+def test_repeated_probes_hit_the_cache(probes, video):
+    assert media_probe.probe(video, 'video')['duration'] == 10.0
+    assert media_probe.video_size(video) == (1280, 720)
+    assert media_probe.duration(video) == 10.0
+    assert len(probes) == 1
+
+
+def test_size_change_invalidates(probes, video):
+    media_probe.probe(video, 'video')
+    with open(video, 'ab') as f:
+        f.write(b'\0' * 500)
+    assert media_probe.probe(video, 'video')['duration'] == 15.0
+    assert len(probes) == 2
+
+
+def test_mtime_change_invalidates(probes, video):
+    media_probe.probe(video, 'video')
+    stat = os.stat(video)
+    os.utime(video, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    media_probe.probe(video, 'video')
+    assert len(probes) == 2
+
+
+def test_cached_info_is_a_copy(probes, video):
+    media_probe.probe(video, 'video')['duration'] = 0
+    assert media_probe.probe(video, 'video')['duration'] == 10.0
+
+
+def test_cache_is_bounded(probes, tmp_path, monkeypatch):
+    monkeypatch.setattr(media_probe, 'MAX_ENTRIES', 2)
+    paths = []
+    for index in range(3):
+        path = tmp_path / f"{index}.mp4"
+        path.write_bytes(b'\0' * 100)
+        paths.append(str(path))
+        media_probe.probe(str(path), 'video')
+    media_probe.probe(paths[0], 'video')  # Evicted, probed again
+    assert len(probes) == 4
+
+
+def test_kind_is_part_of_the_key(probes, monkeypatch, tmp_path):
+    monkeypatch.setattr(media_probe, '_probe_audio', lambda path: {'duration': 3.0, 'width': 0, 'height': 0, 'fps': 0.0, 'has_video': False})
+    path = tmp_path / 'clip.mp4'
+    path.write_bytes(b'\0' * 1000)
+    assert media_probe.probe(str(path), 'audio')['width'] == 0
+    # A video request after an audio one must not get the audio probe's zero size
+    assert media_probe.video_size(str(path)) == (1280, 720)
+    # 'auto' resolves to the same entry as the explicit kind
+    assert media_probe.probe(str(path))['width'] == 1280
+    assert len(probes) == 1
@@ -0,0 +1,46 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('moviepy')
+pytest.importorskip('mutagen')
+
+from src.narrated_video import NarratedVideo
+from src.pipeline import Pipeline
+
+
+async def text():
+    return 'text'
+
+
+def narrated_video(released):
+    library = SimpleNamespace(release=released.append)
+    return NarratedVideo(SimpleNamespace(background_library=library), None, None, 'video_url', video_url='https://youtu.be/abcdefghijk')
+
+
+def test_shared_stages_follow_the_engine_stages():
+    pipeline = Pipeline('test')
+    for name in ('hook', 'story', 'image_context'):
+        pipeline.add(name, text)
+    narrated_video([]).add_stages(pipeline)
+    assert list(pipeline.stages)[3:] == ['source', 'hook_audio', 'story_audio', 'background', 'words', 'subtitles', 'images', 'render']
+    assert pipeline.stages['hook_audio'].deps == ('hook',)
+    assert pipeline.stages['story_audio'].deps == ('story',)
+    assert 'image_context' in pipeline.stages['images'].deps
+    assert [name for name, stage in pipeline.stages.items() if stage.blocking] == ['source', 'background']
+
+
+def test_shared_stages_need_the_engine_stages():
+    with pytest.raises(ValueError, match='undefined stages'):
+        narrated_video([]).add_stages(Pipeline('test'))
+
+
+def test_close_releases_leases():
+    released = []
+    video = narrated_video(released)
+    video.leases.extend(['lease', None])
+    video.close()
+    assert released == ['lease', None]
+    # Closing again does nothing
+    video.close()
+    assert released == ['lease', None]
@@ -0,0 +1,135 @@
+import asyncio
+
+import pytest
+
+from src import tracing
+from src.pipeline import Pipeline
+
+
+def run(pipeline):
+    return asyncio.run(pipeline.run())
+
+
+def test_stages_get_their_dependencies_results():
+    order = []
+
+    async def script():
+        order.append('script')
+        return 'story'
+
+    async def voice(script):
+        order.append('voice')
+        return f"voice of {script}"
+
+    def background():
+        order.append('background')
+        return 'clip'
+
+    def render(voice, background):
+        order.append('render')
+        return (voice, background)
+
+    pipeline = Pipeline('test')
+    pipeline.add('script', script)
+    pipeline.add('voice', voice, deps=['script'])
+    pipeline.add('background', background, blocking=True)
+    pipeline.add('render', render, deps=['voice', 'background'], blocking=True)
+    results = run(pipeline)
+
+    assert results['render'] == ('voice of story', 'clip')
+    assert order.index('script') < order.index('voice') < order.index('render')
+    assert order.index('background') < order.index('render')
+
+
+def test_independent_stages_run_concurrently():
+    running = set()
+    peak = []
+
+    async def stage(name):
+        running.add(name)
+        peak.append(len(running))
+        await asyncio.sleep(0.02)
+        running.discard(name)
+
+    pipeline = Pipeline('test')
+    pipeline.add('a', lambda: stage('a'))
+    pipeline.add('b', lambda: stage('b'))
+    run(pipeline)
+
+    assert max(peak) == 2
+
+
+def test_failure_cancels_the_other_stages():
+    cancelled = []
+    started = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append('slow')
+            raise
+
+    async def broken():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def dependent(broken):
+        started.append('dependent')
+
+    pipeline = Pipeline('test')
+    pipeline.add('slow', slow)
+    pipeline.add('broken', broken)
+    pipeline.add('dependent', dependent, deps=['broken'])
+    with pytest.raises(RuntimeError, match='boom'):
+        run(pipeline)
+
+    assert cancelled == ['slow']
+    assert started == []
+
+
+def test_critical_path_follows_the_slowest_dependency():
+    async def wait(seconds, **inputs):
+        await asyncio.sleep(seconds)
+
+    pipeline = Pipeline('test')
+    pipeline.add('fast', lambda: wait(0.01))
+    pipeline.add('slow', lambda: wait(0.08))
+    pipeline.add('join', lambda fast, slow: wait(0.01), deps=['fast', 'slow'])
+    run(pipeline)
+
+    assert [name for name, _ in pipeline.critical_path] == ['slow', 'join']
+    assert pipeline.critical_path[0][1] >= 0.07
+    timings = pipeline.timings()
+    assert timings['join']['ready'] >= timings['slow']['start'] + 0.07
+
+
+def test_stages_report_span_events():
+    events = []
+
+    async def broken(a):
+        raise RuntimeError("boom")
+
+    async def main():
+        tracing.span_listener.set(events.append)
+        pipeline = Pipeline('test')
+        pipeline.add('a', lambda: asyncio.sleep(0))
+        pipeline.add('b', broken, deps=['a'])
+        await pipeline.run()
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(main())
+    assert [(event['attributes']['stage'], event['state']) for event in events] == [
+        ('a', 'started'), ('a', 'finished'), ('b', 'started'), ('b', 'failed')
+    ]
+    assert events[1]['name'] == 'test.a' and events[1]['duration'] >= 0
+    assert events[3]['error'] == 'boom'
+
+
+def test_add_rejects_duplicate_and_undefined_stages():
+    pipeline = Pipeline('test')
+    pipeline.add('a', lambda: None)
+    with pytest.raises(ValueError):
+        pipeline.add('a', lambda: None)
+    with pytest.raises(ValueError):
+        pipeline.add('b', lambda c: None, deps=['c'])
@@ -0,0 +1,127 @@
+import types
+
+import pytest
+
+from src import provider_health
+from src.provider_health import ProviderRegistry, CLOSED, OPEN, HALF_OPEN
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(provider_health.time, 'monotonic', clock)
+    return clock
+
+
+def providers(*names):
+    return [types.SimpleNamespace(name=name) for name in names]
+
+
+def names(ranked):
+    return [provider.name for provider in ranked]
+
+
+def test_trip_cooldown_and_recovery(clock):
+    registry = ProviderRegistry(failure_threshold=3, reset_timeout=60)
+    ordered = providers('pollinations', 'pexels', 'pixabay')
+    for _ in range(20):
+        registry.record_success('pollinations', 1.0)
+        registry.record_success('pexels', 0.5)
+        registry.record_success('pixabay', 1.5)
+
+    for _ in range(3):
+        assert registry.allow('pollinations')
+        registry.record_failure('pollinations')
+    assert registry.health('pollinations').state == OPEN
+    assert names(registry.rank(ordered)) == ['pexels', 'pixabay']
+    assert not registry.allow('pollinations')
+
+    # Cool-down over: the primary's half-open probe goes before the fallbacks
+    clock.now += 60
+    assert names(registry.rank(ordered)) == ['pollinations', 'pexels', 'pixabay']
+    assert registry.allow('pollinations')
+    assert registry.health('pollinations').state == HALF_OPEN
+    assert not registry.allow('pollinations')  # A single probe at a time
+
+    registry.record_success('pollinations', 1.0)
+    health = registry.health('pollinations')
+    assert health.state == CLOSED
+    assert health.success_rate == 1.0
+    assert names(registry.rank(ordered)) == ['pollinations', 'pexels', 'pixabay']
+
+
+def test_failed_probe_reopens_circuit(clock):
+    registry = ProviderRegistry(failure_threshold=2, reset_timeout=30)
+    for _ in range(2):
+        registry.record_failure('pollinations')
+    clock.now += 30
+    assert registry.allow('pollinations')
+    registry.record_failure('pollinations')
+
+    health = registry.health('pollinations')
+    assert health.state == OPEN
+    assert health.trips == 2
+    assert not registry.allow('pollinations')
+
+
+def test_cancelled_probe_releases_slot(clock):
+    registry = ProviderRegistry(failure_threshold=1, reset_timeout=10)
+    registry.record_failure('pexels')
+    clock.now += 10
+    assert registry.allow('pexels')
+    registry.release('pexels')
+    assert registry.allow('pexels')
+
+
+def test_cancelled_requests_are_censored_latency_samples(clock):
+    registry = ProviderRegistry()
+    for latency in (1.0, 1.0, 1.0, 1.0, 1.0):
+        registry.record_success('pollinations', latency)
+    assert registry.health('pollinations').latency_percentile(0.9) == 1.0
+
+    # Slow requests overtaken by a hedge never complete; ignoring them would keep p90 at 1s
+    for _ in range(5):
+        registry.record_cancelled('pollinations', 6.0)
+    health = registry.health('pollinations')
+    assert health.latency_percentile(0.5) == 1.0
+    assert health.latency_percentile(0.9) == 6.0
+    assert health.outcomes.count(True) == 5  # No outcome recorded for the cancellations
+
+
+def test_percentile_without_censoring():
+    health = provider_health.ProviderHealth('pexels')
+    for latency in (5, 1, 4, 2, 3, 6, 7, 8, 9, 10):
+        health.latencies.append((latency, True))
+    assert health.latency_percentile(0.5) == 5
+    assert health.latency_percentile(0.9) == 9
+    assert health.latency_percentile(1.0) == 10
+
+
+def test_primary_is_not_demoted_by_isolated_failures(clock):
+    registry = ProviderRegistry(failure_threshold=3)
+    ordered = providers('pollinations', 'pexels', 'pixabay')
+    registry.record_failure('pollinations')
+    registry.record_success('pexels', 0.5)
+    assert names(registry.rank(ordered))[0] == 'pollinations'
+
+
+def test_fallbacks_ranked_by_health(clock):
+    registry = ProviderRegistry(failure_threshold=10)
+    ordered = providers('pollinations', 'pexels', 'pixabay')
+    for _ in range(5):
+        registry.record_success('pexels', 2.0)
+        registry.record_success('pixabay', 0.5)
+    assert names(registry.rank(ordered)) == ['pollinations', 'pixabay', 'pexels']
+
+    # A degraded fallback goes last whatever its latency
+    for _ in range(6):
+        registry.record_failure('pixabay')
+    assert names(registry.rank(ordered)) == ['pollinations', 'pexels', 'pixabay']
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('moviepy')
+
+from src.ffmpeg_tools import encode_pcm, mux_audio_tracks, remux_audio, run_ffmpeg
+
+
+def stream_md5(path, stream):
+    """MD5 of a stream's packets, unchanged by a stream copy."""
+    return run_ffmpeg(['-i', path, '-map', f'0:{stream}', '-c', 'copy', '-f', 'md5', '-'])
+
+
+def dubbed_audio(tmp_path, frequency, name):
+    t = np.arange(2 * 24000) / 24000
+    return encode_pcm((0.3 * np.sin(2 * np.pi * frequency * t)).astype(np.float32), 24000, str(tmp_path / name))
+
+
+def test_remux_copies_the_video_stream(make_video, tmp_path):
+    video = make_video()
+    audio = dubbed_audio(tmp_path, 880, 'dub.m4a')
+    output = remux_audio(video, audio, str(tmp_path / 'translated.mp4'))
+
+    assert stream_md5(output, 'v:0') == stream_md5(video, 'v:0')
+    # The AAC dub is muxed as is, not re-encoded
+    assert stream_md5(output, 'a:0') == stream_md5(audio, 'a:0')
+    assert stream_md5(output, 'a:0') != stream_md5(video, 'a:0')
+
+
+def test_remux_can_encode_the_audio(make_video, tmp_path):
+    video = make_video()
+    wav = str(tmp_path / 'dub.wav')
+    encode_pcm(np.zeros(24000, dtype=np.float32), 24000, wav)
+    output = remux_audio(video, wav, str(tmp_path / 'translated.mp4'), audio_codec='aac')
+    assert stream_md5(output, 'v:0') == stream_md5(video, 'v:0')
+
+
+def test_mux_audio_tracks(make_video, tmp_path):
+    video = make_video()
+    tracks = [(dubbed_audio(tmp_path, 500, 'fr.m4a'), 'fr'), (dubbed_audio(tmp_path, 700, 'de.m4a'), 'de')]
+    output = mux_audio_tracks(video, tracks, str(tmp_path / 'multi.mp4'))
+
+    assert stream_md5(output, 'v:0') == stream_md5(video, 'v:0')
+    assert stream_md5(output, 'a:0') == stream_md5(tracks[0][0], 'a:0')
+    assert stream_md5(output, 'a:1') == stream_md5(tracks[1][0], 'a:0')
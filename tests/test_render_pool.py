@@ -0,0 +1,76 @@
+import os
+import time
+import asyncio
+
+import pytest
+
+from src import render_pool, tracing
+from src.workspace import Workspace, scratch_path
+
+
+def write_scratch(text):
+    with tracing.span('child.write') as span:
+        path = scratch_path('render.txt', default_dir=os.devnull)
+        with open(path, 'w') as f:
+            f.write(text)
+        span.add(bytes=len(text))
+    with open(path) as f:
+        return path, f.read(), os.getpid()
+
+
+def slow_touch(path, seconds):
+    time.sleep(seconds)
+    with open(path, 'w'):
+        pass
+
+
+@pytest.fixture
+def pool():
+    assert render_pool.start(1)
+    yield
+    render_pool.shutdown()
+
+
+def render_in_job(root):
+    async def main():
+        with Workspace(job_id='job', root=root) as workspace, tracing.Trace('job', export=False) as trace:
+            with tracing.span('render') as parent:
+                result = await render_pool.run(write_scratch, 'frames')
+            return workspace.path, result, trace, parent
+    return asyncio.run(main())
+
+
+def test_renders_run_in_a_worker_inside_the_callers_workspace(pool, tmp_path):
+    workspace_path, (path, text, pid), trace, parent = render_in_job(str(tmp_path))
+    assert pid != os.getpid()
+    assert os.path.dirname(path) == workspace_path
+    assert text == 'frames'
+    # The worker's spans join the caller's trace, under the span that waited for them
+    child, = [span for span in trace.spans if span.name == 'child.write']
+    assert child.parent_id == parent.span_id
+    assert child.counters['bytes'] == len('frames')
+    assert trace.summary()['child.write']['count'] == 1
+
+
+def test_without_a_pool_renders_run_in_a_thread(tmp_path):
+    render_pool.shutdown()
+    _, (path, text, pid), trace, _ = render_in_job(str(tmp_path))
+    assert pid == os.getpid()
+    assert text == 'frames'
+    assert [span.name for span in trace.spans] == ['render', 'child.write']
+
+
+def test_cancelled_renders_that_did_not_start_are_dropped(pool, tmp_path):
+    first, second = tmp_path / 'first', tmp_path / 'second'
+
+    async def main():
+        running = asyncio.create_task(render_pool.run(slow_touch, str(first), 0.5))
+        waiting = asyncio.create_task(render_pool.run(slow_touch, str(second), 0))
+        await asyncio.sleep(0.1)
+        waiting.cancel()
+        await running
+
+    asyncio.run(main())
+    time.sleep(0.2)
+    assert first.exists()
+    assert not second.exists()
@@ -0,0 +1,51 @@
+import pytest
+
+pytest.importorskip('pysrt')
+
+from src.captions.subtitles import Subtitles
+
+
+@pytest.fixture
+def subtitles():
+    return Subtitles.from_cues([
+        (0.0, 1.5, 'one'),
+        (2.0, 3.0, 'two'),
+        (3.0, 4.5, 'three'),
+        (11.0, 12.0, 'four'),
+        (25.0, 26.0, 'five'),
+    ])
+
+
+@pytest.mark.parametrize('t, expected', [
+    (0.0, 0),
+    (1.49, 0),
+    (1.5, None),  # Between cues
+    (2.0, 1),
+    (3.0, 2),  # A cue ending where the next starts gives way to it
+    (4.5, None),
+    (11.5, 3),
+    (-1.0, None),
+    (30.0, None),
+])
+def test_index_at(subtitles, t, expected):
+    assert subtitles.index_at(t) == expected
+
+
+def test_windows_group_cues_by_start(subtitles):
+    assert subtitles.windows(10, 30) == [['one', 'two', 'three'], ['four'], ['five']]
+
+
+def test_windows_put_late_cues_in_the_last_window(subtitles):
+    # The narration can run slightly past the nominal duration
+    assert subtitles.windows(10, 20) == [['one', 'two', 'three'], ['four', 'five']]
+
+
+def test_windows_of_empty_subtitles():
+    assert Subtitles().windows(5, 12) == [[], [], []]
+    assert Subtitles().windows(5, 0) == [[]]
+
+
+def test_srt_round_trip(subtitles, tmp_path):
+    path = subtitles.save(str(tmp_path / 'captions.srt'))
+    loaded = Subtitles.from_srt(path)
+    assert list(loaded) == list(subtitles)
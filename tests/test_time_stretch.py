@@ -0,0 +1,50 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from src.translation.time_stretch import fit_to_duration, wsola
+
+SAMPLE_RATE = 24000
+
+
+def tone(frequency, seconds):
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    return (0.5 * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+
+
+def dominant_frequency(samples):
+    spectrum = np.abs(np.fft.rfft(samples * np.hanning(len(samples))))
+    return np.fft.rfftfreq(len(samples), 1 / SAMPLE_RATE)[np.argmax(spectrum)]
+
+
+@pytest.mark.parametrize('duration', [0.5, 0.8, 1.0, 1.7, 2.5])
+def test_fit_to_duration_gives_exact_length(duration):
+    fitted = fit_to_duration(tone(440, 1.0), SAMPLE_RATE, duration)
+    assert len(fitted) == int(round(duration * SAMPLE_RATE))
+
+
+@pytest.mark.parametrize('duration', [0.6, 1.6])
+def test_fit_to_duration_preserves_pitch(duration):
+    fitted = fit_to_duration(tone(440, 1.0), SAMPLE_RATE, duration)
+    # Resampling would have moved the tone to 440 / duration Hz
+    assert dominant_frequency(fitted) == pytest.approx(440, rel=0.03)
+
+
+def test_rate_is_clamped_and_padded_with_silence():
+    # Ten times longer than the clamped 0.5 rate allows: the stretched audio is followed by silence
+    fitted = fit_to_duration(tone(440, 0.2), SAMPLE_RATE, 2.0)
+    assert len(fitted) == 2 * SAMPLE_RATE
+    assert np.abs(fitted[int(0.5 * SAMPLE_RATE):]).max() == 0.0
+    assert np.abs(fitted[:int(0.3 * SAMPLE_RATE)]).max() > 0.1
+
+
+def test_empty_input():
+    assert len(fit_to_duration(np.zeros(0, dtype=np.float32), SAMPLE_RATE, 1.0)) == SAMPLE_RATE
+    assert len(fit_to_duration(tone(440, 1.0), SAMPLE_RATE, 0.0)) == 0
+
+
+def test_unit_rate_is_a_copy():
+    samples = tone(440, 0.1)
+    stretched = wsola(samples, 1.0, SAMPLE_RATE)
+    assert np.array_equal(stretched, samples)
+    assert stretched is not samples
@@ -0,0 +1,133 @@
+import json
+import asyncio
+
+import pytest
+
+from src import tracing
+from src.workspace import Workspace
+
+
+def test_nested_spans_point_to_their_parent():
+    with tracing.Trace('job', export=False) as trace:
+        with tracing.span('outer') as outer:
+            with tracing.span('inner') as inner:
+                pass
+            with tracing.span('sibling') as sibling:
+                pass
+    assert outer.parent_id is None
+    assert inner.parent_id == outer.span_id
+    assert sibling.parent_id == outer.span_id
+    assert [span.name for span in trace.spans] == ['outer', 'inner', 'sibling']
+
+
+def test_tasks_and_threads_inherit_the_current_span():
+    def in_thread():
+        with tracing.span('thread') as span:
+            return span
+
+    async def in_task():
+        with tracing.span('task') as span:
+            return span
+
+    async def main():
+        with tracing.span('stage') as stage:
+            task_span = await asyncio.create_task(in_task())
+            thread_span = await asyncio.to_thread(in_thread)
+        return stage, task_span, thread_span
+
+    with tracing.Trace('job', export=False) as trace:
+        stage, task_span, thread_span = asyncio.run(main())
+    assert task_span.parent_id == thread_span.parent_id == stage.span_id
+    assert len(trace.spans) == 3
+
+
+def test_failed_and_cancelled_spans():
+    with tracing.Trace('job', export=False) as trace:
+        with pytest.raises(ValueError):
+            with tracing.span('fails'):
+                raise ValueError('bad input')
+        with pytest.raises(asyncio.CancelledError):
+            with tracing.span('cancelled'):
+                raise asyncio.CancelledError()
+        with tracing.span('recovers'):
+            tracing.record_error(RuntimeError('fallback used'))
+    assert [(span.status, span.error) for span in trace.spans] == [
+        ('error', 'bad input'), ('cancelled', None), ('error', 'fallback used')
+    ]
+    assert trace.summary()['fails']['errors'] == 1
+
+
+def test_trace_is_saved_as_json(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, 'trace_dir', str(tmp_path))
+    with tracing.Trace('job42', 'reddit') as trace:
+        with tracing.span('download', provider='youtube') as download:
+            tracing.record(bytes=100, retries=1)
+            tracing.record(bytes=50)
+        with tracing.span('download'):
+            tracing.record(cache_hits=1)
+
+    with open(tmp_path / 'job42.json') as f:
+        saved = json.load(f)
+    assert saved['job_id'] == 'job42'
+    assert saved['name'] == 'reddit'
+    assert saved['duration'] == trace.duration
+    first = saved['spans'][0]
+    assert first['span_id'] == download.span_id
+    assert first['attributes'] == {'provider': 'youtube'}
+    assert (first['bytes'], first['retries'], first['status']) == (150, 1, 'ok')
+    summary = saved['summary']['download']
+    assert (summary['count'], summary['bytes'], summary['retries'], summary['cache_hits']) == (2, 150, 1, 1)
+
+
+def test_first_span_in_a_workspace_starts_a_trace(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, 'trace_dir', str(tmp_path / 'traces'))
+    with Workspace(job_id='direct', root=str(tmp_path)):
+        with tracing.span('engine'):
+            with tracing.span('stage'):
+                pass
+
+    with open(tmp_path / 'traces' / 'direct.json') as f:
+        saved = json.load(f)
+    assert saved['name'] == 'engine'
+    assert [span['name'] for span in saved['spans']] == ['engine', 'stage']
+
+
+def test_spans_outside_a_job_are_not_saved(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, 'trace_dir', str(tmp_path))
+    with tracing.span('helper'):
+        pass
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_prometheus_exposition():
+    metrics = tracing.Metrics()
+    metrics.observe('render', 0.3, counters={'bytes': 2048})
+    metrics.observe('render', 45.0, status='error')
+    metrics.observe('image "fetch"', 0.01, counters={'cache_hits': 1})
+    lines = metrics.prometheus().splitlines()
+
+    assert '# TYPE turboreel_span_duration_seconds histogram' in lines
+    # Buckets are cumulative: every observation is counted in each bucket it fits under
+    assert 'turboreel_span_duration_seconds_bucket{span="render",le="0.25"} 0' in lines
+    assert 'turboreel_span_duration_seconds_bucket{span="render",le="0.5"} 1' in lines
+    assert 'turboreel_span_duration_seconds_bucket{span="render",le="60.0"} 2' in lines
+    assert 'turboreel_span_duration_seconds_bucket{span="render",le="+Inf"} 2' in lines
+    assert 'turboreel_span_duration_seconds_sum{span="render"} 45.300000' in lines
+    assert 'turboreel_span_duration_seconds_count{span="render"} 2' in lines
+    assert '# TYPE turboreel_span_errors_total counter' in lines
+    assert 'turboreel_span_errors_total{span="render"} 1' in lines
+    assert 'turboreel_span_bytes_total{span="render"} 2048' in lines
+    # Label values are escaped
+    assert 'turboreel_span_cache_hits_total{span="image \\"fetch\\""} 1' in lines
+    # Spans are listed by name
+    assert lines.index('turboreel_span_errors_total{span="image \\"fetch\\""} 0') < lines.index('turboreel_span_errors_total{span="render"} 1')
+
+
+def test_merge_adds_finished_spans_of_a_trace():
+    metrics = tracing.Metrics()
+    metrics.merge({'spans': [
+        {'name': 'encode', 'duration': 2.0, 'status': 'ok', 'bytes': 10},
+        {'name': 'encode', 'duration': None},
+    ]})
+    assert 'turboreel_span_duration_seconds_count{span="encode"} 1' in metrics.prometheus().splitlines()
+    assert 'turboreel_span_bytes_total{span="encode"} 10' in metrics.prometheus().splitlines()
@@ -0,0 +1,57 @@
+import pytest
+
+from src.captions.transcription_cache import TranscriptionCache
+
+WORDS = [{'word': 'hello', 'start': 0.0, 'end': 0.4}, {'word': 'world', 'start': 0.5, 'end': 0.9}]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return TranscriptionCache(str(tmp_path / 'cache'))
+
+
+@pytest.fixture
+def audio(tmp_path):
+    path = tmp_path / 'voice.mp3'
+    path.write_bytes(b'ID3' + bytes(range(256)) * 64)
+    return str(path)
+
+
+def test_miss_then_hit(cache, audio):
+    key = TranscriptionCache.key(audio, model='whisper-1', language=None)
+    assert cache.get(key) is None
+    cache.put(key, WORDS)
+    assert cache.get(key) == WORDS
+    assert cache.stats == {'hits': 1, 'misses': 1}
+
+
+def test_key_depends_on_content_not_path(tmp_path, audio):
+    copy = tmp_path / 'copy.mp3'
+    copy.write_bytes(open(audio, 'rb').read())
+    assert TranscriptionCache.key(audio, model='whisper-1') == TranscriptionCache.key(str(copy), model='whisper-1')
+
+    changed = tmp_path / 'changed.mp3'
+    changed.write_bytes(open(audio, 'rb').read() + b'\0')
+    assert TranscriptionCache.key(audio, model='whisper-1') != TranscriptionCache.key(str(changed), model='whisper-1')
+
+
+def test_key_depends_on_params(audio):
+    assert TranscriptionCache.key(audio, model='whisper-1', language='en') != TranscriptionCache.key(audio, model='whisper-1', language='fr')
+    # Parameter order does not matter
+    assert TranscriptionCache.key(audio, a=1, b=2) == TranscriptionCache.key(audio, b=2, a=1)
+
+
+def test_corrupt_entry_is_a_miss(cache, audio):
+    key = TranscriptionCache.key(audio)
+    cache.put(key, WORDS)
+    with open(cache._path(key), 'w') as entry:
+        entry.write('{not json')
+    assert cache.get(key) is None
+    assert cache.stats['misses'] == 1
+
+
+def test_put_leaves_no_partial_files(cache, audio, tmp_path):
+    key = TranscriptionCache.key(audio)
+    cache.put(key, WORDS)
+    files = [path.name for path in (tmp_path / 'cache').rglob('*') if path.is_file()]
+    assert files == [f"{key}.json"]
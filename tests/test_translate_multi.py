@@ -0,0 +1,96 @@
+import os
+import asyncio
+
+import pytest
+
+pytest.importorskip('openai')
+pytest.importorskip('moviepy')
+pytest.importorskip('pysrt')
+pytest.importorskip('PIL')
+pytest.importorskip('dotenv')
+
+from src.translation import translation_engine
+from src.translation.translation_engine import TranslationEngine
+from src.workspace import current_workspace
+
+
+@pytest.fixture
+def engine(monkeypatch, tmp_path):
+    """An engine whose transcription, translation, TTS and muxing are recorded instead of run."""
+    engine = TranslationEngine.__new__(TranslationEngine)  # No video editor needed
+    engine.calls = {'transcribe': 0, 'translate': [], 'voice': [], 'remux': [], 'mux': []}
+
+    async def transcribe(video_path):
+        engine.calls['transcribe'] += 1
+        return 'subtitles.srt'
+
+    async def translate(subtitles_path, language):
+        engine.calls['translate'].append(language)
+        if language == 'Klingon':
+            raise RuntimeError('no such language')
+        return [language]
+
+    async def generate_voice(script, output_filename):
+        path = os.path.join(current_workspace.get().path, output_filename)
+        engine.calls['voice'].append(output_filename)
+        return path
+
+    def remux_audio(video_path, audio_path, output_path):
+        engine.calls['remux'].append((audio_path, output_path))
+        return output_path
+
+    def mux_audio_tracks(video_path, tracks, output_path):
+        engine.calls['mux'].append(tracks)
+        return output_path
+
+    monkeypatch.setattr(engine, '_transcribe', transcribe, raising=False)
+    monkeypatch.setattr(engine, '_translate_subtitles', translate, raising=False)
+    monkeypatch.setattr(engine, 'generate_voice', generate_voice, raising=False)
+    monkeypatch.setattr(engine, '_result_dir', lambda: str(tmp_path), raising=False)
+    monkeypatch.setattr(translation_engine, 'remux_audio', remux_audio)
+    monkeypatch.setattr(translation_engine, 'mux_audio_tracks', mux_audio_tracks)
+    monkeypatch.setenv('TURBOREEL_SCRATCH_DIR', str(tmp_path / 'scratch'))
+    return engine
+
+
+def test_one_transcription_for_every_language(engine):
+    result = asyncio.run(engine.translate_video_multi('video.mp4', ['French', 'German']))
+
+    assert result['status'] == 'success'
+    assert engine.calls['transcribe'] == 1
+    assert sorted(engine.calls['translate']) == ['French', 'German']
+    paths = result['translated_video_paths']
+    assert set(paths) == {'French', 'German'}
+    assert len(set(paths.values())) == 2
+    assert 'translated_video_french_' in os.path.basename(paths['French'])
+
+
+def test_spellings_with_the_same_slug_are_translated_once(engine):
+    result = asyncio.run(engine.translate_video_multi('video.mp4', ['pt-BR', 'French', 'pt_br', 'PT BR']))
+
+    assert sorted(engine.calls['translate']) == ['French', 'pt-BR']
+    assert sorted(engine.calls['voice']) == ['full_generated_speech_french.m4a', 'full_generated_speech_pt_br.m4a']
+    audio_paths = [audio for audio, _ in engine.calls['remux']]
+    output_paths = [output for _, output in engine.calls['remux']]
+    assert len(set(audio_paths)) == len(set(output_paths)) == 2
+    assert set(result['translated_video_paths']) == {'pt-BR', 'French'}
+
+
+def test_failed_languages_are_reported(engine):
+    result = asyncio.run(engine.translate_video_multi('video.mp4', ['French', 'Klingon']))
+
+    assert result['status'] == 'success'
+    assert list(result['translated_video_paths']) == ['French']
+    assert result['errors'] == {'Klingon': 'no such language'}
+
+
+def test_multi_track_output(engine):
+    result = asyncio.run(engine.translate_video_multi('video.mp4', ['fr', 'de'], multi_track=True))
+
+    assert result['status'] == 'success'
+    assert [title for _, title in engine.calls['mux'][0]] == ['fr', 'de']
+    assert engine.calls['remux'] == []
+
+
+def test_no_languages(engine):
+    assert asyncio.run(engine.translate_video_multi('video.mp4', []))['status'] == 'error'
@@ -0,0 +1,85 @@
+import json
+import types
+import asyncio
+
+import pytest
+
+pytest.importorskip('openai')
+pytest.importorskip('moviepy')
+pytest.importorskip('pysrt')
+pytest.importorskip('PIL')
+pytest.importorskip('dotenv')
+
+from src.translation.translation_engine import TranslationEngine
+
+
+class FakeCompletions:
+    """Translates window requests by upper-casing the lines marked for translation.
+
+    drop holds line ids left out of the window answers; single-line requests are
+    answered with 'single: <text>'.
+    """
+
+    def __init__(self, drop=()):
+        self.drop = set(drop)
+        self.windows = []
+        self.single_lines = []
+
+    async def create(self, **kwargs):
+        content = kwargs['messages'][1]['content']
+        if content.startswith('Previous subtitle'):
+            current = content.split('Current subtitle: ')[1].split('\n')[0]
+            self.single_lines.append(current)
+            answer = {'current_translated_subtitle': f"single: {current}"}
+        else:
+            lines = json.loads(content)
+            self.windows.append(lines)
+            answer = {'translations': [
+                {'id': line['id'], 'text': line['text'].upper()}
+                for line in lines if line['translate'] and line['id'] not in self.drop
+            ]}
+            # Context lines echoed back must not overwrite another window's lines
+            answer['translations'] += [{'id': line['id'], 'text': 'context'} for line in lines if not line['translate']]
+        message = types.SimpleNamespace(content=json.dumps(answer))
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+
+def translate(texts, monkeypatch, window_size=3, window_context=1, drop=()):
+    completions = FakeCompletions(drop)
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=completions))
+    monkeypatch.setattr(TranslationEngine, 'openai_client', property(lambda self: client))
+    engine = TranslationEngine.__new__(TranslationEngine)  # No video editor needed
+    engine.window_size = window_size
+    engine.window_context = window_context
+    subs = [types.SimpleNamespace(text=text) for text in texts]
+    return asyncio.run(engine._translate_windows(subs, 'French')), completions
+
+
+TEXTS = [f"line {index}" for index in range(8)]
+
+
+def test_windows_are_merged_in_order(monkeypatch):
+    translated, completions = translate(TEXTS, monkeypatch)
+    assert translated == [text.upper() for text in TEXTS]
+    assert completions.single_lines == []
+
+
+def test_windows_overlap_by_the_context_lines(monkeypatch):
+    _, completions = translate(TEXTS, monkeypatch)
+    windows = sorted(completions.windows, key=lambda lines: lines[0]['id'])
+    assert [[line['id'] for line in lines] for lines in windows] == [[0, 1, 2, 3], [2, 3, 4, 5, 6], [5, 6, 7]]
+    assert [[line['id'] for line in lines if line['translate']] for lines in windows] == [[0, 1, 2], [3, 4, 5], [6, 7]]
+
+
+def test_missing_lines_are_retried_one_by_one(monkeypatch):
+    translated, completions = translate(TEXTS, monkeypatch, drop={1, 6})
+    assert translated[1] == 'single: line 1'
+    assert translated[6] == 'single: line 6'
+    assert translated[0] == 'LINE 0' and translated[7] == 'LINE 7'
+    assert sorted(completions.single_lines) == ['line 1', 'line 6']
+
+
+def test_single_window(monkeypatch):
+    translated, completions = translate(TEXTS[:2], monkeypatch, window_size=12, window_context=2)
+    assert translated == ['LINE 0', 'LINE 1']
+    assert len(completions.windows) == 1
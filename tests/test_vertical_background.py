@@ -0,0 +1,72 @@
+import pytest
+
+pytest.importorskip('moviepy')
+pytest.importorskip('yt_dlp')
+pytest.importorskip('mutagen')
+pytest.importorskip('openai')
+pytest.importorskip('pysrt')
+pytest.importorskip('PIL')
+pytest.importorskip('dotenv')
+
+from src.background_library import BackgroundLibrary
+from src.ffmpeg_tools import video_info, vertical_cut
+from src.video_editor import VideoEditor
+
+
+@pytest.fixture
+def editor(tmp_path):
+    editor = VideoEditor.__new__(VideoEditor)
+    editor.base_dir = str(tmp_path)
+    editor.cut_mode = 'lazy'
+    editor.use_proxies = True
+    editor.background_library = BackgroundLibrary(str(tmp_path / 'library'))
+    return editor
+
+
+@pytest.fixture
+def source(make_video):
+    return make_video('landscape.mp4', seconds=3, size=(640, 360))
+
+
+def test_vertical_cut_crops_and_scales(source, tmp_path):
+    output = vertical_cut(source, 1.0, 1.5, str(tmp_path / 'cut.mp4'), 202, 360)
+    info = video_info(output)
+    assert (info['width'], info['height']) == (202, 360)
+    assert info['duration'] == pytest.approx(1.5, abs=0.1)
+
+
+def test_one_shot_background_is_cut_at_output_size(editor, source):
+    clip, cut_path = editor.cut_background(source, 0.5, 2.5, vertical_height=360)
+    try:
+        assert cut_path is not None
+        assert tuple(clip.size) == editor.vertical_size(360) == (202, 360)
+        assert clip.duration == pytest.approx(2.0, abs=0.1)
+    finally:
+        clip.close()
+
+
+def test_short_one_shot_background_is_looped(editor, source):
+    clip, cut_path = editor.cut_background(source, 0.0, 5.0, vertical_height=360)
+    try:
+        assert clip.duration == pytest.approx(5.0, abs=0.1)
+    finally:
+        clip.close()
+
+
+def test_reused_backgrounds_are_cut_lazily(editor, source):
+    clip, cut_path = editor.cut_background(source, 0.5, 2.5)
+    try:
+        assert cut_path is None
+        assert tuple(clip.size) == (640, 360)
+    finally:
+        clip.close()
+
+
+def test_proxies_off_falls_back_to_a_lazy_cut(editor, source):
+    editor.use_proxies = False
+    clip, cut_path = editor.cut_background(source, 0.5, 2.5, vertical_height=360)
+    try:
+        assert cut_path is None
+        assert tuple(clip.size) == (640, 360)
+    finally:
+        clip.close()
@@ -0,0 +1,110 @@
+import os
+import sys
+import signal
+import asyncio
+import threading
+import subprocess
+
+import pytest
+
+from src import workspace
+from src.workspace import Workspace, current_workspace, scoped, scratch_path
+
+
+@pytest.fixture
+def root(tmp_path):
+    return str(tmp_path / 'scratch')
+
+
+def test_concurrent_jobs_get_their_own_intermediates(root, tmp_path):
+    seen = {}
+
+    async def job(name):
+        async with Workspace(job_id=name, root=root):
+            path = scratch_path('voice.mp3', 'audio', default_dir=str(tmp_path / 'assets'))
+            with open(path, 'w') as f:
+                f.write(name)
+            await asyncio.sleep(0.01)  # Let the other job write its file of the same name
+            with open(path) as f:
+                seen[name] = (path, f.read())
+
+    async def main():
+        await asyncio.gather(job('a'), job('b'))
+
+    asyncio.run(main())
+    assert seen['a'][1] == 'a' and seen['b'][1] == 'b'
+    assert seen['a'][0] != seen['b'][0]
+    # Both workspaces are gone once their jobs end, nothing fell back to the shared folder
+    assert os.listdir(root) == []
+    assert not os.path.exists(tmp_path / 'assets')
+
+
+def test_workspace_is_removed_when_the_job_fails(root):
+    async def job():
+        async with Workspace(root=root) as job_workspace:
+            open(job_workspace.file('partial.mp4'), 'w').close()
+            raise RuntimeError('render failed')
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(job())
+    assert os.listdir(root) == []
+    assert current_workspace.get() is None
+
+
+def test_rmtree_runs_off_the_event_loop(root, monkeypatch):
+    threads = []
+    rmtree = workspace.shutil.rmtree
+
+    def spy(path, **kwargs):
+        threads.append(threading.current_thread())
+        rmtree(path, **kwargs)
+
+    monkeypatch.setattr(workspace.shutil, 'rmtree', spy)
+
+    async def job():
+        async with Workspace(root=root):
+            pass
+
+    asyncio.run(job())
+    assert threads and threads[0] is not threading.main_thread()
+
+
+def test_scoped_reuses_an_active_workspace(root, monkeypatch):
+    monkeypatch.setenv('TURBOREEL_SCRATCH_DIR', root)
+
+    @scoped
+    async def engine():
+        return current_workspace.get()
+
+    async def main():
+        own = await engine()
+        async with Workspace(root=root) as job_workspace:
+            return own, job_workspace, await engine()
+
+    own, job_workspace, inner = asyncio.run(main())
+    assert own is not None and own is not job_workspace
+    assert inner is job_workspace
+
+
+def test_keep_leaves_the_directory(root):
+    with Workspace(root=root, keep=True) as kept:
+        pass
+    assert os.path.isdir(kept.path)
+
+
+def test_sigterm_removes_live_workspaces(root):
+    script = (
+        "import sys, time\n"
+        "from src.workspace import Workspace\n"
+        f"workspace = Workspace(root={root!r})\n"
+        "open(workspace.file('frame.png'), 'w').close()\n"
+        "print(workspace.path, flush=True)\n"
+        "time.sleep(30)\n"
+    )
+    process = subprocess.Popen([sys.executable, '-c', script], stdout=subprocess.PIPE, text=True,
+                               cwd=os.path.join(os.path.dirname(__file__), '..'))
+    path = process.stdout.readline().strip()
+    assert os.path.isdir(path)
+    process.send_signal(signal.SIGTERM)
+    assert process.wait(10) == 128 + signal.SIGTERM
+    assert not os.path.exists(path)